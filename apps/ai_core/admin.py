@@ -1,3 +1,37 @@
 from django.contrib import admin
+from .models import AnswerCacheEntry, AnswerCacheDailyStats, GraphCheckpoint, TopicDecision, TurnMetrics
 
-# Register your models here.
+
+@admin.register(AnswerCacheEntry)
+class AnswerCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tema', 'pregunta', 'aciertos', 'fecha_creacion', 'ultimo_uso')
+    list_filter = ('tema', 'modelo_embedding')
+    search_fields = ('pregunta', 'respuesta')
+    readonly_fields = ('embedding', 'modelo_embedding', 'firma_documentos', 'aciertos', 'fecha_creacion', 'ultimo_uso')
+    filter_horizontal = ('documentos',)
+
+
+@admin.register(AnswerCacheDailyStats)
+class AnswerCacheDailyStatsAdmin(admin.ModelAdmin):
+    list_display = ('fecha', 'aciertos', 'fallos', 'tasa_aciertos')
+
+
+@admin.register(TopicDecision)
+class TopicDecisionAdmin(admin.ModelAdmin):
+    list_display = ('fecha', 'ticket', 'tema', 'confianza', 'origen', 'tema_local', 'margen_local', 'coincide')
+    list_filter = ('origen', 'confianza', 'coincide', 'tema')
+    search_fields = ('mensaje', 'tema')
+
+
+@admin.register(TurnMetrics)
+class TurnMetricsAdmin(admin.ModelAdmin):
+    list_display = ('fecha', 'ticket', 'canal', 'duracion_ms', 'llamadas_llm', 'tokens_prompt', 'tokens_respuesta', 'costo_usd')
+    list_filter = ('canal', 'fecha')
+    readonly_fields = [field.name for field in TurnMetrics._meta.fields]
+
+
+@admin.register(GraphCheckpoint)
+class GraphCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('thread_id', 'checkpoint_id', 'parent_checkpoint_id', 'fecha')
+    search_fields = ('thread_id',)
+    readonly_fields = [field.name for field in GraphCheckpoint._meta.fields]
@@ -0,0 +1,238 @@
+# apps/ai_core/answer_cache.py
+
+import hashlib
+import threading
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+
+from apps.tickets.models import KnowledgeDocument
+from .models import AnswerCacheDailyStats, AnswerCacheEntry
+from .topics import clean_topic_name
+
+_candidates_lock = threading.Lock()
+_candidates = {}
+
+
+def _enabled() -> bool:
+    return getattr(settings, 'ANSWER_CACHE_ENABLED', True)
+
+
+def _topic_key(topic) -> str:
+    return clean_topic_name(topic)
+
+
+def _document_ids(relevant_docs: list) -> list:
+    ids = set()
+    for doc in relevant_docs:
+        try:
+            ids.add(int(doc.metadata.get('document_id')))
+        except (TypeError, ValueError):
+            continue
+    return sorted(ids)
+
+
+def document_signature(document_ids: list) -> str:
+    """
+    Firma de un conjunto de documentos: cambia si alguno se borra o se
+    reprocesa con otro contenido (su 'hash_contenido').
+    """
+    rows = KnowledgeDocument.objects.filter(id__in=document_ids).order_by('id').values_list('id', 'hash_contenido')
+    raw = '|'.join(f"{document_id}:{content_hash or ''}" for document_id, content_hash in rows)
+    return hashlib.sha256(f"{len(document_ids)}|{raw}".encode('utf-8')).hexdigest()
+
+
+def _record(hit: bool):
+    stats, _ = AnswerCacheDailyStats.objects.get_or_create(fecha=timezone.localdate())
+    field = 'aciertos' if hit else 'fallos'
+    AnswerCacheDailyStats.objects.filter(pk=stats.pk).update(**{field: F(field) + 1})
+
+
+def _embed(question: str) -> list:
+    from .tools.vector_store import get_embeddings
+    return get_embeddings().embed_query(question)
+
+
+async def _aembed(question: str) -> list:
+    # Como en asearch_knowledge_base_vector: el embedding (una llamada de red
+    # con Gemini) se espera sobre el loop, no en el hilo compartido del ORM.
+    from .tools.vector_store import get_embeddings
+    return await get_embeddings().aembed_query(question)
+
+
+def _expiry_cutoff():
+    """Fecha de creación mínima de una entrada vigente (None si no vencen)."""
+    ttl = getattr(settings, 'ANSWER_CACHE_TTL_SECONDS', None)
+    return timezone.now() - timedelta(seconds=ttl) if ttl else None
+
+
+def _get_candidates(topic_key: str, model_name: str):
+    """
+    Devuelve (pks, matriz de embeddings normalizados) de las entradas vigentes del tema.
+
+    La matriz se guarda en memoria por (tema, modelo) y solo se vuelve a leer
+    de la BD si cambió la cantidad de entradas o la última creada (otro
+    proceso guardó, invalidó o venció alguna); así cada turno hace una
+    consulta de agregación en lugar de decodificar cientos de JSON.
+    """
+    import numpy as np
+
+    entries = AnswerCacheEntry.objects.filter(tema=topic_key, modelo_embedding=model_name)
+    cutoff = _expiry_cutoff()
+    if cutoff is not None:
+        entries = entries.filter(fecha_creacion__gte=cutoff)
+    totals = entries.aggregate(count=Count('id'), last=Max('id'))
+    version = (totals['count'], totals['last'], cutoff is None)
+
+    key = (topic_key, model_name)
+    with _candidates_lock:
+        cached = _candidates.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+
+    if cutoff is not None:
+        expired, _ = AnswerCacheEntry.objects.filter(tema=topic_key, fecha_creacion__lt=cutoff).delete()
+        if expired:
+            print(f"CACHÉ DE RESPUESTAS: {expired} respuestas vencidas eliminadas del tema '{topic_key}'.")
+    rows = list(
+        entries.order_by('-ultimo_uso').values_list('pk', 'embedding')[:getattr(settings, 'ANSWER_CACHE_MAX_CANDIDATES', 500)]
+    )
+    pks = [pk for pk, _ in rows]
+    matrix = np.asarray([embedding for _, embedding in rows], dtype=np.float32)
+    if rows:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1.0, norms)
+    with _candidates_lock:
+        _candidates[key] = (version, pks, matrix)
+    return pks, matrix
+
+
+def clear_candidate_cache():
+    """Descarta las matrices de candidatos en memoria (p. ej. en las pruebas)."""
+    with _candidates_lock:
+        _candidates.clear()
+
+
+def _match_answer(question: str, topic, query_embedding: list):
+    """Parte de lookup_answer que consulta la BD, con el embedding ya calculado."""
+    import numpy as np
+    from .tools.embedding_backends import get_embedding_model_name
+
+    query = np.asarray(query_embedding, dtype=np.float32)
+    pks, matrix = _get_candidates(_topic_key(topic), get_embedding_model_name())
+    threshold = getattr(settings, 'ANSWER_CACHE_SIMILARITY', 0.95)
+    entry, similarity = None, 0.0
+    if pks:
+        similarities = (matrix @ query) / (np.linalg.norm(query) or 1.0)
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        if similarity >= threshold:
+            # Solo se lee la fila de la mejor candidata (puede haberse borrado entretanto).
+            entry = AnswerCacheEntry.objects.filter(pk=pks[best]).first()
+
+    if entry is not None:
+        # Si un documento se borró, ya no está en la relación y la firma tampoco coincide.
+        document_ids = list(entry.documentos.values_list('id', flat=True))
+        if document_signature(document_ids) == entry.firma_documentos:
+            AnswerCacheEntry.objects.filter(pk=entry.pk).update(aciertos=F('aciertos') + 1, ultimo_uso=timezone.now())
+            _record(hit=True)
+            print(f"CACHÉ DE RESPUESTAS: Acierto (similitud {similarity:.3f}) con '{entry.pregunta[:60]}'.")
+            return entry
+        print("CACHÉ DE RESPUESTAS: La entrada más parecida quedó obsoleta (sus documentos cambiaron). Se elimina.")
+        entry.delete()
+
+    _record(hit=False)
+    print(f"CACHÉ DE RESPUESTAS: Fallo (mejor similitud {similarity:.3f}, umbral {threshold}).")
+    return None
+
+
+def lookup_answer(question: str, topic: str = None):
+    """
+    Busca una respuesta ya generada para una pregunta equivalente del mismo tema.
+
+    Es un acierto si la similitud coseno con la pregunta guardada supera
+    ANSWER_CACHE_SIMILARITY y los documentos que la respaldaron no cambiaron.
+    Devuelve la entrada o None.
+    """
+    if not _enabled() or not question:
+        return None
+    try:
+        query_embedding = _embed(question)
+    except Exception as e:
+        print(f"CACHÉ DE RESPUESTAS: No se pudo calcular el embedding ({e}).")
+        return None
+    return _match_answer(question, topic, query_embedding)
+
+
+async def alookup_answer(question: str, topic: str = None):
+    """Versión asíncrona de lookup_answer: solo las consultas a la BD pasan por sync_to_async."""
+    if not _enabled() or not question:
+        return None
+    try:
+        query_embedding = await _aembed(question)
+    except Exception as e:
+        print(f"CACHÉ DE RESPUESTAS: No se pudo calcular el embedding ({e}).")
+        return None
+    return await sync_to_async(_match_answer)(question, topic, query_embedding)
+
+
+def _save_answer(question: str, topic: str, answer: str, relevant_docs: list, question_embedding: list):
+    from .tools.embedding_backends import get_embedding_model_name
+
+    document_ids = _document_ids(relevant_docs)
+    documents = list(KnowledgeDocument.objects.filter(id__in=document_ids))
+    # Fragmentos de documentos que ya no existen: no se puede invalidar luego, mejor no cachear.
+    if not documents or len(documents) != len(document_ids):
+        return None
+    entry = AnswerCacheEntry.objects.create(
+        tema=_topic_key(topic),
+        pregunta=question,
+        embedding=list(map(float, question_embedding)),
+        modelo_embedding=get_embedding_model_name(),
+        respuesta=answer,
+        firma_documentos=document_signature(document_ids),
+    )
+    entry.documentos.set(documents)
+    return entry
+
+
+def store_answer(question: str, topic: str, answer: str, relevant_docs: list):
+    """Guarda la respuesta generada y los documentos que la respaldan."""
+    if not _enabled() or not answer or not relevant_docs:
+        return None
+    return _save_answer(question, topic, answer, relevant_docs, _embed(question))
+
+
+async def astore_answer(question: str, topic: str, answer: str, relevant_docs: list):
+    """Versión asíncrona de store_answer: el embedding sobre el loop, la escritura con sync_to_async."""
+    if not _enabled() or not answer or not relevant_docs:
+        return None
+    question_embedding = await _aembed(question)
+    return await sync_to_async(_save_answer)(question, topic, answer, relevant_docs, question_embedding)
+
+
+def invalidate_answers_for_documents(document_ids: list) -> int:
+    """Elimina las respuestas construidas a partir de los documentos indicados."""
+    entries = AnswerCacheEntry.objects.filter(documentos__id__in=list(document_ids)).distinct()
+    count = entries.count()
+    if count:
+        AnswerCacheEntry.objects.filter(pk__in=list(entries.values_list('pk', flat=True))).delete()
+        print(f"CACHÉ DE RESPUESTAS: {count} respuestas invalidadas por cambios en los documentos {list(document_ids)}.")
+    return count
+
+
+def get_answer_cache_stats(days: int = 30) -> dict:
+    """Aciertos, fallos y tasa de aciertos de los últimos 'days' días."""
+    since = timezone.localdate() - timedelta(days=days - 1)
+    totals = AnswerCacheDailyStats.objects.filter(fecha__gte=since).aggregate(hits=Sum('aciertos'), misses=Sum('fallos'))
+    hits, misses = totals['hits'] or 0, totals['misses'] or 0
+    return {
+        'hits': hits,
+        'misses': misses,
+        'total': hits + misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+        'entries': AnswerCacheEntry.objects.count(),
+    }
@@ -0,0 +1,261 @@
+# apps/ai_core/benchmarks/graph.py
+
+import asyncio
+import statistics
+import tempfile
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.test.utils import override_settings
+
+from .retrieval import _percentile, _quiet, _reset_caches, build_fixture_store, load_suite
+
+DEFAULT_SUITE = 'graph_v1'
+CHANNELS = ('web', 'telegram')
+
+# Turnos medidos por el driver en curso: el hook de instrumentación agrega aquí
+# el TurnCollector de cada turno (la web y cada conversación de Telegram
+# corren en su propio contexto, así que no se mezclan).
+_turn_sink = ContextVar('benchmark_turn_sink', default=None)
+
+
+def _collect_turn(kind, name, data):
+    sink = _turn_sink.get()
+    if kind == 'turn' and sink is not None:
+        sink.append({
+            'graph_ms': data.elapsed_ms,
+            'llm_ms': data.llm_ms,
+            'llm_calls': data.llm_calls,
+            'nodes': dict(data.nodes),
+            'routes': list(data.routes),
+            'error': data.error,
+        })
+
+
+def _turn_record(channel, conversation_id, index, wall_ms, sink, **extra):
+    turn = sink[-1] if sink else {'graph_ms': 0.0, 'llm_ms': 0.0, 'llm_calls': 0, 'nodes': {}, 'routes': [], 'error': 'sin turno del grafo'}
+    return {'channel': channel, 'conversation': conversation_id, 'turn': index, 'turn_ms': round(wall_ms, 2),
+            **turn, 'graph_ms': round(turn['graph_ms'], 2), **extra}
+
+
+def _run_web(conversations, username, turns):
+    """Cada mensaje es un POST a chat_view (con la redirección a la página del chat, como en el navegador)."""
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    from django.urls import reverse
+
+    client = Client()
+    client.force_login(User.objects.create(username=username))
+    for conversation in conversations:
+        client.get(reverse('tickets:new_chat'))
+        for index, text in enumerate(conversation['messages'], start=1):
+            sink = []
+            token = _turn_sink.set(sink)
+            try:
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = client.post(reverse('tickets:chat'), {'mensaje': text}, follow=True)
+                    wall_ms = (time.perf_counter() - started) * 1000
+            finally:
+                _turn_sink.reset(token)
+            turns.append(_turn_record('web', conversation['id'], index, wall_ms, sink,
+                                      queries=len(queries), status=response.status_code))
+    client.logout()
+
+
+async def _telegram_conversation(conversation, username, user_id, semaphore, turns):
+    from telegram import Chat, Message, Update, User as TelegramUser
+    from telegram_bot.handlers import handle_message
+
+    chat = Chat(id=user_id, type=Chat.PRIVATE)
+    from_user = TelegramUser(id=user_id, first_name='Benchmark', is_bot=False, username=username)
+    async with semaphore:
+        for index, text in enumerate(conversation['messages'], start=1):
+            update = Update(update_id=index, message=Message(
+                message_id=index, date=datetime.now(timezone.utc), chat=chat, from_user=from_user, text=text,
+            ))
+            sink = []
+            token = _turn_sink.set(sink)
+            try:
+                started = time.perf_counter()
+                await handle_message(update)
+                wall_ms = (time.perf_counter() - started) * 1000
+            finally:
+                _turn_sink.reset(token)
+            turns.append(_turn_record('telegram', conversation['id'], index, wall_ms, sink))
+
+
+async def _run_telegram(conversations, username_prefix, concurrency, turns):
+    """Cada mensaje pasa por handle_message; hasta 'concurrency' conversaciones a la vez, como en el poller."""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    await asyncio.gather(*(
+        _telegram_conversation(conversation, f"{username_prefix}{position}", 900_000_000 + position, semaphore, turns)
+        for position, conversation in enumerate(conversations)
+    ))
+
+
+@contextmanager
+def _memory_broker():
+    # Las tareas encoladas durante el benchmark (resúmenes, avisos a técnicos)
+    # se publican en un broker en memoria: no se ejecutan ni salen a la red.
+    from core.celery import app as celery_app
+    previous = celery_app.conf.broker_write_url
+    celery_app.conf.broker_write_url = 'memory://'
+    try:
+        yield
+    finally:
+        celery_app.conf.broker_write_url = previous
+
+
+def _reset_runtime():
+    from apps.ai_core.llm import reset_chat_models
+    from apps.ai_core.llm_gateway import reset_llm_gateway
+    from apps.ai_core.llm_replay import reset_replay_metrics
+    from apps.ai_core.topic_classifier import reset_classifier
+    _reset_caches()
+    reset_classifier()
+    reset_chat_models()
+    reset_llm_gateway()
+    reset_replay_metrics()
+
+
+def cleanup_benchmark_data(username_prefix: str) -> int:
+    """Borra los usuarios del benchmark con sus tickets, logs, checkpoints y métricas. Devuelve los tickets borrados."""
+    from django.contrib.auth.models import User
+    from apps.ai_core.checkpointer import DjangoCheckpointSaver, thread_id_for_ticket
+    from apps.ai_core.models import TopicDecision, TurnMetrics
+    from apps.tickets.models import Ticket
+
+    ticket_ids = list(Ticket.objects.filter(usuario__username__startswith=username_prefix).values_list('id', flat=True))
+    saver = DjangoCheckpointSaver()
+    for ticket_id in ticket_ids:
+        saver.delete_thread(thread_id_for_ticket(ticket_id))
+    TurnMetrics.objects.filter(ticket_id__in=ticket_ids).delete()
+    TopicDecision.objects.filter(ticket_id__in=ticket_ids).delete()
+    User.objects.filter(username__startswith=username_prefix).delete()
+    return len(ticket_ids)
+
+
+def _channel_metrics(turns: list, elapsed_seconds: float) -> dict:
+    """
+    Agrega los turnos de un canal. 'turn_ms' es el turno completo visto por el
+    canal (vista o handler: ORM, grafo y respuesta); 'overhead_ms' es ese
+    tiempo menos la espera del LLM, es decir, el costo propio.
+    """
+    turn_ms = [turn['turn_ms'] for turn in turns]
+    llm_ms = [turn['llm_ms'] for turn in turns]
+    overhead_ms = [turn['turn_ms'] - turn['llm_ms'] for turn in turns]
+    graph_overhead_ms = [turn['graph_ms'] - turn['llm_ms'] for turn in turns]
+    nodes = {}
+    for turn in turns:
+        for node, ms in turn['nodes'].items():
+            nodes.setdefault(node, []).append(ms)
+    metrics = {
+        'turns': len(turns),
+        'errors': sum(1 for turn in turns if turn['error']),
+        'turns_per_second': round(len(turns) / elapsed_seconds, 2) if elapsed_seconds else 0.0,
+        'turn_ms_p50': round(_percentile(turn_ms, 50), 2),
+        'turn_ms_p95': round(_percentile(turn_ms, 95), 2),
+        'turn_ms_mean': round(statistics.fmean(turn_ms), 2) if turns else 0.0,
+        'llm_ms_mean': round(statistics.fmean(llm_ms), 2) if turns else 0.0,
+        'llm_calls_mean': round(statistics.fmean(turn['llm_calls'] for turn in turns), 2) if turns else 0.0,
+        'overhead_ms_p50': round(_percentile(overhead_ms, 50), 2),
+        'overhead_ms_p95': round(_percentile(overhead_ms, 95), 2),
+        'overhead_ms_mean': round(statistics.fmean(overhead_ms), 2) if turns else 0.0,
+        'graph_overhead_ms_mean': round(statistics.fmean(graph_overhead_ms), 2) if turns else 0.0,
+        # Por nodo incluye la espera del LLM de los nodos que lo llaman.
+        'node_ms_p50': {node: round(_percentile(values, 50), 2) for node, values in sorted(nodes.items())},
+        'routes': dict(Counter(' → '.join(turn['routes']) or '-' for turn in turns)),
+    }
+    queries = [turn['queries'] for turn in turns if 'queries' in turn]
+    if queries:
+        metrics['queries_mean'] = round(statistics.fmean(queries), 2)
+    return metrics
+
+
+def run_graph_benchmark(suite: dict, channels=CHANNELS, provider: str = 'stub', fixtures_path: str = None,
+                        latency_ms: float = 0.0, jitter_ms: float = 0.0, repeat: int = 1, concurrency: int = 1,
+                        backend: str = 'local', verbose: bool = False, keep_data: bool = False) -> dict:
+    """
+    Ejecuta las conversaciones del suite de punta a punta (chat_view y
+    handle_message, con el grafo, el ORM y la recuperación reales) sobre un
+    ChromaDB temporal con el corpus del suite, y con el LLM de LLM_PROVIDER
+    'stub', 'replay' o 'record' (ver llm_replay). Los tickets se crean en la
+    BD configurada y se borran al terminar, salvo keep_data.
+
+    La caché de respuestas se desactiva (cada repetición recorre el grafo
+    completo) y Telegram se mide sin streaming (no hay chat real que editar).
+    """
+    from apps.ai_core.instrumentation import register_hook, unregister_hook
+    from apps.ai_core.llm_replay import get_replay_metrics
+
+    corpus = load_suite(suite['corpus_suite'])
+    conversations = suite['conversations'] * max(1, repeat)
+    username_prefix = f"benchmark_graph_{uuid.uuid4().hex[:8]}_"
+    results, all_turns = {}, []
+
+    with tempfile.TemporaryDirectory(prefix='benchmark_graph_chroma_') as store_dir:
+        overrides = {
+            'CHROMA_PERSIST_DIRECTORY': store_dir,
+            'LEXICAL_INDEX_PATH': None,
+            'EMBEDDING_BACKEND': backend,
+            'EMBEDDING_CACHE_DISK_PATH': None,
+            'LLM_PROVIDER': provider,
+            'LLM_FIXTURES_PATH': fixtures_path or getattr(settings, 'LLM_FIXTURES_PATH', None),
+            'LLM_STUB_LATENCY_MS': latency_ms,
+            'LLM_STUB_LATENCY_JITTER_MS': jitter_ms,
+            'ANSWER_CACHE_ENABLED': False,
+            'TELEGRAM_STREAM_RESPONSES': False,
+            'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+        }
+        _reset_runtime()
+        register_hook(_collect_turn)
+        try:
+            with override_settings(**overrides), _memory_broker():
+                with _quiet(verbose):
+                    index = build_fixture_store(corpus)
+                    for channel in channels:
+                        turns = []
+                        started = time.perf_counter()
+                        if channel == 'web':
+                            _run_web(conversations, f"{username_prefix}web", turns)
+                        else:
+                            asyncio.run(_run_telegram(conversations, f"{username_prefix}tg_", concurrency, turns))
+                        results[channel] = _channel_metrics(turns, time.perf_counter() - started)
+                        all_turns.extend(turns)
+                llm = get_replay_metrics()
+        finally:
+            unregister_hook(_collect_turn)
+            if not keep_data:
+                cleanup_benchmark_data(username_prefix)
+            _reset_runtime()
+
+    return {
+        'suite': suite.get('name'),
+        'suite_version': suite.get('version'),
+        'generated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'config': {
+            'llm_provider': provider,
+            'llm_fixtures': str(overrides['LLM_FIXTURES_PATH']) if provider != 'stub' else None,
+            'llm_latency_ms': latency_ms,
+            'llm_latency_jitter_ms': jitter_ms,
+            'embedding_backend': backend,
+            'channels': list(channels),
+            'repeat': repeat,
+            'telegram_concurrency': concurrency,
+            'combined_classify_rewrite': getattr(settings, 'GRAPH_COMBINED_CLASSIFY_REWRITE', True),
+            'checkpoint_durability': getattr(settings, 'GRAPH_CHECKPOINT_DURABILITY', 'exit'),
+            'data_prefix': username_prefix if keep_data else None,
+        },
+        'index': index,
+        'llm': llm,
+        'results': results,
+        'turns': all_turns,
+    }
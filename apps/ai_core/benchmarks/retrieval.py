@@ -0,0 +1,221 @@
+# apps/ai_core/benchmarks/retrieval.py
+
+import contextlib
+import io
+import json
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.test.utils import override_settings
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+DEFAULT_SUITE = 'retrieval_v1'
+RECALL_CUTOFFS = (1, 3, 5)
+
+
+def load_suite(name_or_path: str = DEFAULT_SUITE) -> dict:
+    """
+    Carga un set de preguntas versionado: un nombre de 'fixtures/' o la ruta a un suite.json.
+    Las rutas de los documentos del corpus se resuelven relativas al archivo.
+    """
+    path = name_or_path
+    if not os.path.exists(path):
+        path = os.path.join(FIXTURES_DIR, name_or_path)
+    if os.path.isdir(path):
+        path = os.path.join(path, 'suite.json')
+    with open(path, 'r', encoding='utf-8') as f:
+        suite = json.load(f)
+    suite['base_dir'] = os.path.dirname(os.path.abspath(path))
+    return suite
+
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = (len(ordered) - 1) * pct / 100
+    lower, upper = int(index), min(int(index) + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (index - lower)
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def build_fixture_store(suite: dict) -> dict:
+    """
+    Indexa el corpus del suite con el mismo flujo de ingesta que producción
+    (loaders, splitter, metadatos de tema, ChromaDB e índice léxico), en el
+    directorio de ChromaDB vigente en settings.
+    """
+    from apps.ai_core.tools.vector_store import get_embeddings, get_vectorstore, mark_index_updated
+    from apps.tasks.ingestion import iter_document_chunks, sync_document_chunks
+
+    vectorstore, embeddings = get_vectorstore(), get_embeddings()
+    chunks = 0
+    start = time.perf_counter()
+    for entry in suite['documents']:
+        document = SimpleNamespace(id=int(entry['document_id']), nombre=entry['nombre'], categoria=entry.get('categoria'))
+        file_path = os.path.join(suite['base_dir'], entry['archivo'])
+        stats = sync_document_chunks(document.id, iter_document_chunks(file_path, document), vectorstore, embeddings)
+        chunks += stats['total_chunks']
+    mark_index_updated()
+    return {
+        'documents': len(suite['documents']),
+        'chunks': chunks,
+        'build_seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def evaluate_questions(questions: list, mode: str, use_topic: bool = True, repeat: int = 1) -> dict:
+    """
+    Ejecuta cada pregunta contra search_knowledge_base_vector y calcula:
+
+    - recall@k: proporción de preguntas con un documento esperado entre los k primeros.
+    - mrr: media del recíproco de la posición del primer documento esperado.
+    - evidence_recall: proporción de preguntas en las que algún fragmento devuelto
+      contiene el texto de 'evidence' (acierto a nivel de fragmento; no depende
+      de chunk_size, así el mismo set sirve para comparar configuraciones).
+    - latencias p50/p95/media en ms, sobre 'repeat' ejecuciones por pregunta.
+    """
+    from apps.ai_core.tools.knowledge_base import search_knowledge_base_vector
+
+    latencies, reciprocal_ranks, evidence_hits = [], [], 0
+    recall_hits = {k: 0 for k in RECALL_CUTOFFS}
+    per_question = []
+
+    for item in questions:
+        expected = {str(document_id) for document_id in item.get('expected_document_ids', [])}
+        topic = item.get('topic') if use_topic else None
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            docs = search_knowledge_base_vector(item['question'], topic=topic, mode=mode)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        returned = [str(doc.metadata.get('document_id')) for doc in docs]
+        rank = next((position for position, document_id in enumerate(returned, start=1) if document_id in expected), None)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+        for k in RECALL_CUTOFFS:
+            if rank and rank <= k:
+                recall_hits[k] += 1
+
+        evidence = item.get('evidence')
+        evidence_found = bool(evidence) and any(
+            evidence in doc.page_content for doc in docs if str(doc.metadata.get('document_id')) in expected
+        )
+        evidence_hits += evidence_found
+        per_question.append({
+            'id': item.get('id', item['question']),
+            'rank': rank,
+            'evidence_found': evidence_found,
+            'returned': [
+                {'document_id': str(doc.metadata.get('document_id')), 'chunk_index': doc.metadata.get('chunk_index')}
+                for doc in docs
+            ],
+        })
+
+    total = len(questions) or 1
+    metrics = {f'recall@{k}': round(hits / total, 4) for k, hits in recall_hits.items()}
+    metrics.update({
+        'mrr': round(sum(reciprocal_ranks) / total, 4),
+        'evidence_recall': round(evidence_hits / total, 4),
+        'latency_ms_p50': round(_percentile(latencies, 50), 2),
+        'latency_ms_p95': round(_percentile(latencies, 95), 2),
+        'latency_ms_mean': round(statistics.fmean(latencies), 2) if latencies else 0.0,
+        'questions': per_question,
+    })
+    return metrics
+
+
+def _quiet(verbose: bool):
+    # La búsqueda imprime cada paso; se silencia para que no ensucie ni distorsione las latencias.
+    return contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+
+
+def _reset_caches():
+    from apps.ai_core.tools.lexical_index import reset_lexical_index
+    from apps.ai_core.tools.topic_index import reset_topic_index
+    from apps.ai_core.tools.vector_store import reset_vectorstore
+    reset_vectorstore()
+    reset_lexical_index()
+    reset_topic_index()
+
+
+def run_benchmark(suite: dict, modes=('vector', 'hybrid'), backend: str = 'local', chunk_size: int = None,
+                  chunk_overlap: int = None, threshold: float = None, use_topic: bool = True,
+                  repeat: int = 1, verbose: bool = False, rerank: bool = True) -> dict:
+    """
+    Construye un ChromaDB temporal con el corpus del suite y mide cada modo de recuperación.
+    Devuelve un reporte serializable en JSON, pensado para compararse entre versiones.
+    """
+    chunk_size = chunk_size or getattr(settings, 'INGESTION_CHUNK_SIZE', 1000)
+    chunk_overlap = chunk_overlap if chunk_overlap is not None else getattr(settings, 'INGESTION_CHUNK_OVERLAP', 200)
+
+    with tempfile.TemporaryDirectory(prefix='benchmark_chroma_') as store_dir:
+        overrides = {
+            'CHROMA_PERSIST_DIRECTORY': store_dir,
+            'LEXICAL_INDEX_PATH': None,
+            'EMBEDDING_BACKEND': backend,
+            'EMBEDDING_CACHE_DISK_PATH': None,
+            'INGESTION_CHUNK_SIZE': chunk_size,
+            'INGESTION_CHUNK_OVERLAP': chunk_overlap,
+            'SIMILARITY_THRESHOLD': threshold,
+            'RERANK_ENABLED': rerank,
+        }
+        _reset_caches()
+        try:
+            with override_settings(**overrides):
+                from apps.ai_core.tools.knowledge_base import SEARCH_K, _get_similarity_threshold
+
+                with _quiet(verbose):
+                    index = build_fixture_store(suite)
+                    index['size_bytes'] = directory_size(store_dir)
+                    results = {
+                        mode: evaluate_questions(suite['questions'], mode, use_topic=use_topic, repeat=repeat)
+                        for mode in modes
+                    }
+                effective_threshold = _get_similarity_threshold()
+        finally:
+            _reset_caches()
+
+    return {
+        'suite': suite.get('name'),
+        'suite_version': suite.get('version'),
+        'generated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'config': {
+            'embedding_backend': backend,
+            'chunk_size': chunk_size,
+            'chunk_overlap': chunk_overlap,
+            'similarity_threshold': effective_threshold,
+            'search_k': SEARCH_K,
+            'use_topic_filter': use_topic,
+            'rerank': rerank,
+            'repeat': repeat,
+        },
+        'index': index,
+        'results': results,
+    }
+
+
+def compare_reports(previous: dict, current: dict) -> dict:
+    """Diferencias (actual - anterior) de las métricas agregadas de cada modo presente en ambos reportes."""
+    deltas = {}
+    for mode, metrics in current.get('results', {}).items():
+        before = previous.get('results', {}).get(mode)
+        if not before:
+            continue
+        deltas[mode] = {
+            name: round(value - before[name], 4)
+            for name, value in metrics.items()
+            if isinstance(value, (int, float)) and isinstance(before.get(name), (int, float))
+        }
+    return deltas
@@ -0,0 +1,164 @@
+# apps/ai_core/checkpointer.py
+
+import random
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+from .models import GraphCheckpoint, GraphCheckpointWrite
+
+# El estado del grafo de cada ticket (tema fijado, intentos de aclaración,
+# última búsqueda...) se guarda en la BD: la web y Telegram retoman la
+# conversación donde quedó, sin depender de la sesión del navegador.
+
+
+def thread_id_for_ticket(ticket_id) -> str:
+    return f"ticket-{ticket_id}"
+
+
+class DjangoCheckpointSaver(BaseCheckpointSaver):
+    """
+    Checkpointer de LangGraph sobre el ORM de Django. Cada checkpoint se guarda
+    completo (con los valores de los canales) en un GraphCheckpoint; por hilo
+    se conservan solo los últimos GRAPH_CHECKPOINTS_PER_THREAD.
+
+    Las variantes async usan sync_to_async, igual que el ORM async de Django.
+    """
+
+    def _config(self, thread_id, checkpoint_ns, checkpoint_id):
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}}
+
+    def _to_tuple(self, row) -> CheckpointTuple:
+        writes = GraphCheckpointWrite.objects.filter(
+            thread_id=row.thread_id, checkpoint_ns=row.checkpoint_ns, checkpoint_id=row.checkpoint_id
+        ).order_by('task_id', 'idx')
+        return CheckpointTuple(
+            config=self._config(row.thread_id, row.checkpoint_ns, row.checkpoint_id),
+            checkpoint=self.serde.loads_typed((row.tipo, bytes(row.checkpoint))),
+            metadata=self.serde.loads_typed((row.tipo_metadatos, bytes(row.metadatos))),
+            parent_config=(
+                self._config(row.thread_id, row.checkpoint_ns, row.parent_checkpoint_id)
+                if row.parent_checkpoint_id else None
+            ),
+            pending_writes=[
+                (write.task_id, write.canal, self.serde.loads_typed((write.tipo, bytes(write.valor))))
+                for write in writes
+            ],
+        )
+
+    def get_tuple(self, config):
+        configurable = config["configurable"]
+        rows = GraphCheckpoint.objects.filter(
+            thread_id=configurable["thread_id"], checkpoint_ns=configurable.get("checkpoint_ns", "")
+        )
+        if checkpoint_id := get_checkpoint_id(config):
+            rows = rows.filter(checkpoint_id=checkpoint_id)
+        # Los IDs de checkpoint son UUIDv6: su orden es el orden de creación.
+        row = rows.order_by('-checkpoint_id').first()
+        return self._to_tuple(row) if row else None
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        rows = GraphCheckpoint.objects.all()
+        if config:
+            configurable = config["configurable"]
+            rows = rows.filter(thread_id=configurable["thread_id"])
+            if configurable.get("checkpoint_ns") is not None:
+                rows = rows.filter(checkpoint_ns=configurable["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                rows = rows.filter(checkpoint_id=checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            rows = rows.filter(checkpoint_id__lt=before_id)
+        remaining = limit
+        for row in rows.order_by('-checkpoint_id').iterator():
+            checkpoint_tuple = self._to_tuple(row)
+            if filter and not all(checkpoint_tuple.metadata.get(key) == value for key, value in filter.items()):
+                continue
+            if remaining is not None:
+                if remaining <= 0:
+                    break
+                remaining -= 1
+            yield checkpoint_tuple
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        configurable = config["configurable"]
+        thread_id, checkpoint_ns = configurable["thread_id"], configurable.get("checkpoint_ns", "")
+        checkpoint_type, checkpoint_bytes = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_bytes = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with transaction.atomic():
+            GraphCheckpoint.objects.update_or_create(
+                thread_id=thread_id, checkpoint_ns=checkpoint_ns, checkpoint_id=checkpoint["id"],
+                defaults={
+                    "parent_checkpoint_id": configurable.get("checkpoint_id"),
+                    "tipo": checkpoint_type, "checkpoint": checkpoint_bytes,
+                    "tipo_metadatos": metadata_type, "metadatos": metadata_bytes,
+                },
+            )
+            self._prune(thread_id, checkpoint_ns)
+        return self._config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    def _prune(self, thread_id, checkpoint_ns):
+        keep = getattr(settings, 'GRAPH_CHECKPOINTS_PER_THREAD', 3)
+        old_ids = list(
+            GraphCheckpoint.objects.filter(thread_id=thread_id, checkpoint_ns=checkpoint_ns)
+            .order_by('-checkpoint_id').values_list('checkpoint_id', flat=True)[keep:]
+        )
+        if old_ids:
+            GraphCheckpoint.objects.filter(thread_id=thread_id, checkpoint_ns=checkpoint_ns, checkpoint_id__in=old_ids).delete()
+            GraphCheckpointWrite.objects.filter(thread_id=thread_id, checkpoint_ns=checkpoint_ns, checkpoint_id__in=old_ids).delete()
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        configurable = config["configurable"]
+        key = {
+            "thread_id": configurable["thread_id"],
+            "checkpoint_ns": configurable.get("checkpoint_ns", ""),
+            "checkpoint_id": configurable["checkpoint_id"],
+        }
+        with transaction.atomic():
+            for idx, (channel, value) in enumerate(writes):
+                idx = WRITES_IDX_MAP.get(channel, idx)
+                value_type, value_bytes = self.serde.dumps_typed(value)
+                values = {"task_path": task_path, "canal": channel, "tipo": value_type, "valor": value_bytes}
+                if idx >= 0:
+                    # Las escrituras normales no se pisan; las especiales (errores, interrupciones) sí.
+                    GraphCheckpointWrite.objects.get_or_create(**key, task_id=task_id, idx=idx, defaults=values)
+                else:
+                    GraphCheckpointWrite.objects.update_or_create(**key, task_id=task_id, idx=idx, defaults=values)
+
+    def delete_thread(self, thread_id):
+        GraphCheckpoint.objects.filter(thread_id=thread_id).delete()
+        GraphCheckpointWrite.objects.filter(thread_id=thread_id).delete()
+
+    async def aget_tuple(self, config):
+        return await sync_to_async(self.get_tuple)(config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await sync_to_async(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))()
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await sync_to_async(self.put)(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await sync_to_async(self.put_writes)(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await sync_to_async(self.delete_thread)(thread_id)
+
+    def get_next_version(self, current, channel):
+        # Mismo formato que los checkpointers de LangGraph: contador + desempate aleatorio.
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
@@ -0,0 +1,182 @@
+# apps/ai_core/context_packing.py
+
+import math
+import re
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+# Fin de oración: puntuación final seguida de espacio, o salto de línea.
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…:;])\s+|\n+")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimación local de tokens, sin llamar a la API: cada signo de puntuación
+    cuenta como uno y cada palabra como un token cada 4 caracteres. Se ajusta
+    razonablemente al tokenizador de Gemini en español y nunca lo subestima mucho.
+    """
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _TOKEN_RE.findall(text or ''))
+
+
+def split_sentences(text: str) -> list:
+    return [sentence.strip() for sentence in _SENTENCE_END_RE.split(text or '') if sentence.strip()]
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Recorta el texto a 'max_tokens' sin cortar oraciones. Si ni la primera
+    oración entra, se corta por palabras y se marca con "…".
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    kept, used = [], 0
+    for sentence in split_sentences(text):
+        tokens = count_tokens(sentence)
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+    if kept:
+        return ' '.join(kept)
+
+    words, used = [], 0
+    for word in text.split():
+        tokens = count_tokens(word)
+        if used + tokens > max_tokens - 1:
+            break
+        words.append(word)
+        used += tokens
+    return ' '.join(words) + '…' if words else ''
+
+
+@dataclass
+class PackedContext:
+    question: str
+    passages: list = field(default_factory=list)
+    recent_turns: list = field(default_factory=list)   # [(emisor, mensaje)] en orden cronológico
+    older_summary: str = ''
+    stats: dict = field(default_factory=dict)
+
+    def passages_text(self, empty: str = '') -> str:
+        return "\n\n".join(self.passages) if self.passages else empty
+
+    def history_text(self) -> str:
+        lines = []
+        if self.older_summary:
+            lines.append(f"[Resumen de mensajes anteriores]\n{self.older_summary}")
+        lines.extend(f"{speaker}: {message}" for speaker, message in self.recent_turns)
+        return "\n".join(lines)
+
+
+def summarize_turns(turns: list, max_tokens: int) -> str:
+    """
+    Resumen extractivo de los turnos antiguos: la primera oración de cada uno,
+    acotada a CONTEXT_SUMMARY_TOKENS_PER_TURN, hasta agotar 'max_tokens'.
+    Si no entran todos, se priorizan los más cercanos a la conversación actual.
+    """
+    per_turn = getattr(settings, 'CONTEXT_SUMMARY_TOKENS_PER_TURN', 40)
+    lines, used = [], 0
+    for speaker, message in reversed(turns):
+        sentences = split_sentences(message)
+        if not sentences:
+            continue
+        line = f"- {speaker}: {truncate_to_tokens(sentences[0], per_turn)}"
+        tokens = count_tokens(line)
+        if used + tokens > max_tokens:
+            break
+        lines.insert(0, line)
+        used += tokens
+    return "\n".join(lines)
+
+
+def pack_context(question: str, passages: list = None, turns: list = None, budget: int = None,
+                 summary: str = '') -> PackedContext:
+    """
+    Llena un presupuesto de tokens en orden de prioridad:
+
+    1. La última pregunta del usuario (siempre; se recorta solo si excede el presupuesto).
+    2. Los mejores pasajes, en el orden recibido (el último que no entra se recorta por oraciones).
+    3. Los turnos más recientes del historial, hasta CONTEXT_RECENT_TURNS.
+    4. Con lo que quede, 'summary' (el resumen guardado del ticket, ver
+       conversation_summary.py) y un resumen de los turnos que no entraron.
+
+    'turns' es una lista [(emisor, mensaje)] en orden cronológico.
+    """
+    budget = budget or getattr(settings, 'CONTEXT_TOKEN_BUDGET', 6000)
+    min_passage_tokens = getattr(settings, 'CONTEXT_MIN_PASSAGE_TOKENS', 40)
+    max_recent_turns = getattr(settings, 'CONTEXT_RECENT_TURNS', 8)
+    passages, turns = list(passages or []), list(turns or [])
+    dropped = {"passages": 0, "turns_summarized": 0, "turns_dropped": 0, "tokens": 0}
+
+    question = truncate_to_tokens(question, budget)
+    remaining = budget - count_tokens(question)
+    packed = PackedContext(question=question)
+
+    for passage in passages:
+        tokens = count_tokens(passage)
+        if tokens <= remaining:
+            packed.passages.append(passage)
+            remaining -= tokens
+        elif remaining >= min_passage_tokens:
+            truncated = truncate_to_tokens(passage, remaining)
+            if truncated:
+                packed.passages.append(truncated)
+                remaining -= count_tokens(truncated)
+            dropped["tokens"] += tokens - count_tokens(truncated)
+        else:
+            dropped["passages"] += 1
+            dropped["tokens"] += tokens
+
+    # Turnos recientes, del más nuevo al más viejo, mientras entren completos.
+    for speaker, message in reversed(turns[-max_recent_turns:] if max_recent_turns else []):
+        tokens = count_tokens(f"{speaker}: {message}")
+        if tokens > remaining:
+            break
+        packed.recent_turns.insert(0, (speaker, message))
+        remaining -= tokens
+    older = turns[:len(turns) - len(packed.recent_turns)]
+
+    if summary and remaining > 0:
+        packed.older_summary = truncate_to_tokens(summary, remaining)
+        remaining -= count_tokens(packed.older_summary)
+    older_text = summarize_turns(older, remaining) if older and remaining > 0 else ''
+    if older_text:
+        packed.older_summary = "\n".join(part for part in (packed.older_summary, older_text) if part)
+        remaining -= count_tokens(older_text)
+    summarized = older_text.count("\n") + 1 if older_text else 0
+    dropped["turns_summarized"] = summarized
+    dropped["turns_dropped"] = len(older) - summarized
+    dropped["tokens"] += max(0, sum(count_tokens(f"{s}: {m}") for s, m in older) - count_tokens(older_text))
+
+    packed.stats = {"budget": budget, "used": budget - remaining, **dropped}
+    print(f"CONTEXTO: {packed.stats['used']}/{budget} tokens; {len(packed.passages)} pasajes, "
+          f"{len(packed.recent_turns)} turnos recientes, {summarized} resumidos. "
+          f"Descartado: {dropped['passages']} pasajes, {dropped['turns_dropped']} turnos, ~{dropped['tokens']} tokens.")
+    return packed
+
+
+def extractive_answer(question: str, passages: list, max_tokens: int = None) -> str:
+    """
+    Respuesta sin LLM para el modo degradado: las oraciones de los pasajes que
+    comparten más palabras con la pregunta, en el orden en que aparecen, hasta
+    'max_tokens'. Si ninguna coincide, el comienzo del mejor pasaje.
+    """
+    max_tokens = max_tokens or getattr(settings, 'LLM_DEGRADED_ANSWER_TOKENS', 250)
+    terms = {word for word in re.findall(r"\w+", (question or '').lower()) if len(word) > 3}
+    sentences = [sentence for passage in passages for sentence in split_sentences(passage)]
+    scored = sorted(
+        ((len(terms & set(re.findall(r"\w+", sentence.lower()))), i) for i, sentence in enumerate(sentences)),
+        key=lambda item: (-item[0], item[1]),
+    )
+    chosen, used = [], 0
+    for score, i in scored:
+        tokens = count_tokens(sentences[i])
+        if score == 0 or used + tokens > max_tokens:
+            break
+        chosen.append(i)
+        used += tokens
+    if not chosen:
+        return truncate_to_tokens(passages[0], max_tokens) if passages else ''
+    return ' '.join(sentences[i] for i in sorted(chosen))
@@ -0,0 +1,131 @@
+# apps/ai_core/conversation_summary.py
+
+from django.conf import settings
+
+from apps.tickets.models import Ticket, LogInteraccion
+from .context_packing import count_tokens, truncate_to_tokens, summarize_turns
+from .llm_gateway import LLMUnavailableError, invoke_llm
+
+# Memoria de la conversación de un ticket: un resumen incremental guardado en
+# Ticket.descripcion_confirmada_ia más los últimos mensajes textuales. El
+# resumen cubre los logs hasta Ticket.resumen_ultimo_log_id; cada turno solo
+# lee los logs posteriores, así el prompt y las lecturas de la BD no crecen
+# con el largo de la conversación.
+
+
+def _recent_turns() -> int:
+    return getattr(settings, 'CONVERSATION_RECENT_TURNS', 6)
+
+
+def _max_raw_turns() -> int:
+    # Si el resumen se atrasa (p. ej. Celery caído) se leen más mensajes, pero con tope.
+    return max(_recent_turns(), getattr(settings, 'CONVERSATION_MAX_RAW_TURNS', 16))
+
+
+def _pending_logs_query(ticket):
+    logs = LogInteraccion.objects.filter(ticket_id=ticket.id)
+    if ticket.resumen_ultimo_log_id:
+        logs = logs.filter(id__gt=ticket.resumen_ultimo_log_id)
+    return logs.order_by('-id').only('id', 'mensaje', 'emisor')[:_max_raw_turns()]
+
+
+def load_conversation(ticket):
+    """
+    Devuelve (resumen, logs) para armar los prompts: el resumen guardado y los
+    mensajes posteriores a él (como mucho CONVERSATION_MAX_RAW_TURNS), en orden
+    cronológico.
+    """
+    return ticket.descripcion_confirmada_ia or '', list(reversed(_pending_logs_query(ticket)))
+
+
+async def aload_conversation(ticket):
+    return ticket.descripcion_confirmada_ia or '', list(reversed([log async for log in _pending_logs_query(ticket)]))
+
+
+def history_text(summary: str, logs) -> str:
+    """Historial para los prompts del grafo: el resumen y los mensajes recientes."""
+    lines = [f"[Resumen de la conversación]\n{summary}"] if summary else []
+    lines.extend(f"{log.get_emisor_display()}: {log.mensaje}" for log in logs)
+    return "\n".join(lines) or "(sin mensajes anteriores)"
+
+
+def _summary_prompt(summary: str, turns: list) -> str:
+    max_tokens = getattr(settings, 'CONVERSATION_SUMMARY_TOKENS', 300)
+    new_turns = "\n".join(f"{speaker}: {message}" for speaker, message in turns)
+    return (
+        "Eres el asistente de una mesa de ayuda. Actualiza el resumen de la conversación con los mensajes nuevos. "
+        "Conserva el problema del usuario, los datos que aportó (trámite, documentos, fechas, errores), lo que ya se le "
+        "respondió y lo que quedó pendiente. Omite saludos y repeticiones. "
+        f"Escribe en español, en prosa, con no más de {max_tokens * 3 // 4} palabras.\n\n"
+        f"**Resumen actual:**\n{summary or '(vacío)'}\n\n"
+        f"**Mensajes nuevos:**\n{new_turns}\n\n"
+        "**Resumen actualizado:**"
+    )
+
+
+def _fallback_summary(summary: str, turns: list, max_tokens: int) -> str:
+    """Sin LLM: se agrega la primera oración de cada mensaje y se conserva lo más reciente."""
+    lines = [line for line in (summary or '').splitlines() if line.strip()]
+    lines.extend(summarize_turns(turns, max_tokens).splitlines())
+    kept, used = [], 0
+    for line in reversed(lines):
+        tokens = count_tokens(line)
+        if used + tokens > max_tokens:
+            break
+        kept.insert(0, line)
+        used += tokens
+    return "\n".join(kept)
+
+
+def update_conversation_summary(ticket_id) -> bool:
+    """
+    Incorpora al resumen los mensajes que quedaron fuera de los últimos
+    CONVERSATION_RECENT_TURNS. Devuelve True si el resumen cambió (puede
+    quedar más por incorporar si había más de CONVERSATION_SUMMARY_BATCH).
+
+    La escritura es condicional sobre la marca anterior: si otro worker ya lo
+    actualizó, este resultado se descarta en lugar de pisarlo.
+    """
+    try:
+        ticket = Ticket.objects.only('id', 'descripcion_confirmada_ia', 'resumen_ultimo_log_id').get(id=ticket_id)
+    except Ticket.DoesNotExist:
+        return False
+
+    pending = LogInteraccion.objects.filter(ticket_id=ticket_id)
+    if ticket.resumen_ultimo_log_id:
+        pending = pending.filter(id__gt=ticket.resumen_ultimo_log_id)
+    # Como mucho CONVERSATION_SUMMARY_BATCH mensajes por llamada (p. ej. tickets largos sin resumen previo).
+    fold_count = min(pending.count() - _recent_turns(), getattr(settings, 'CONVERSATION_SUMMARY_BATCH', 40))
+    if fold_count <= 0:
+        return False
+    to_fold = list(pending.order_by('id').values_list('id', 'emisor', 'mensaje')[:fold_count])
+
+    emisores = dict(LogInteraccion.Emisor.choices)
+    turns = [(emisores.get(emisor, emisor), mensaje) for _, emisor, mensaje in to_fold]
+    summary = ticket.descripcion_confirmada_ia or ''
+    max_tokens = getattr(settings, 'CONVERSATION_SUMMARY_TOKENS', 300)
+    try:
+        response = invoke_llm(_summary_prompt(summary, turns), temperature=0.0)
+        new_summary = truncate_to_tokens(response.content.strip(), max_tokens)
+    except LLMUnavailableError as e:
+        print(f"RESUMEN: LLM no disponible ({e}). Resumen extractivo para el Ticket #{ticket_id}.")
+        new_summary = _fallback_summary(summary, turns, max_tokens)
+
+    updated = Ticket.objects.filter(id=ticket_id, resumen_ultimo_log_id=ticket.resumen_ultimo_log_id).update(
+        descripcion_confirmada_ia=new_summary, resumen_ultimo_log_id=to_fold[-1][0],
+    )
+    if updated:
+        print(f"RESUMEN: Ticket #{ticket_id}: {len(to_fold)} mensajes incorporados ({count_tokens(new_summary)} tokens).")
+    else:
+        print(f"RESUMEN: Ticket #{ticket_id}: otro proceso actualizó el resumen; se descarta este.")
+    return bool(updated)
+
+
+def schedule_summary_update(ticket_id):
+    """Encola la actualización del resumen al terminar un turno (sin demorar la respuesta)."""
+    from apps.tasks.tasks import update_conversation_summary_task
+    try:
+        update_conversation_summary_task.delay(ticket_id)
+    except Exception as e:
+        # Sin broker el turno no falla: el resumen se pondrá al día en el próximo.
+        print(f"RESUMEN: No se pudo encolar la actualización del Ticket #{ticket_id} ({e}).")
@@ -1,17 +1,24 @@
 # apps/ai_core/graph.py
 
-import os
 import json
 from typing import List, TypedDict, Literal
+from django.conf import settings
 from apps.tickets.models import Ticket, LogInteraccion
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from .tools.knowledge_base import search_knowledge_base_vector
+from langchain_core.runnables import RunnableLambda
+from asgiref.sync import sync_to_async
+from .tools.knowledge_base import search_knowledge_base_vector, asearch_knowledge_base_vector
+from .tools.vector_store import get_index_version
 from apps.tasks.tasks import notify_technician_task
 from langgraph.graph import StateGraph, END
-from .topics import get_master_topic_list
-
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+from .topics import get_master_topic_list, resolve_topic
+from .context_packing import extractive_answer, pack_context
+from .conversation_summary import aload_conversation, history_text, load_conversation
+from .answer_cache import alookup_answer, astore_answer, lookup_answer, store_answer
+from .llm_gateway import LLMUnavailableError, ainvoke_llm, invoke_llm, record_degraded
+from .models import TopicDecision
+from .topic_classifier import classify_locally, record_decision
+from .instrumentation import ainstrument_node, instrument_node, instrument_router
+from .checkpointer import DjangoCheckpointSaver, thread_id_for_ticket
 
 # ==============================================================================
 # 1. Definición del Estado del Grafo
@@ -19,7 +26,7 @@ GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 class GraphState(TypedDict):
     ticket_id: int
     user_input: str
-    chat_history: List[BaseMessage]
+    chat_history: str  # resumen de la conversación + últimos mensajes (ver conversation_summary.py)
     final_response: str
     current_topic: str
     topic_confidence: str
@@ -27,34 +34,48 @@ class GraphState(TypedDict):
     topic_locked: bool
     rewritten_query: str
     relevant_docs: List[dict]
+    answer_cache_hit: bool
+    llm_degraded: bool
+    retrieval_key: str
 
 # ==============================================================================
 # 2. Definición de los Nodos del Grafo (Versión Final y Limpia)
 # ==============================================================================
+# Cada nodo tiene una versión síncrona (`app.invoke`) y una asíncrona
+# (`app.ainvoke`/`app.astream`) con ORM async y `ainvoke` del modelo. Ambas
+# comparten los prompts y la interpretación de las respuestas.
+
+def _chat_history(state: GraphState, summary: str, logs: list) -> str:
+    # El mensaje actual ya está guardado en el log, pero los prompts lo llevan aparte.
+    if logs and logs[-1].emisor == LogInteraccion.Emisor.USUARIO and logs[-1].mensaje == state['user_input']:
+        logs = logs[:-1]
+    return history_text(summary, logs)
+
+# El estado se retoma del checkpoint del ticket: las marcas de un turno no pasan al siguiente.
+_TURN_RESET = {"llm_degraded": False, "answer_cache_hit": False}
 
 def assemble_context(state: GraphState) -> dict:
-    """Carga el historial de la conversación desde la BD."""
+    """Carga el resumen de la conversación y los últimos mensajes desde la BD."""
     print("--- GRAFO: NODO (assemble_context) ---")
     ticket_id = state['ticket_id']
     try:
         ticket = Ticket.objects.get(id=ticket_id)
-        logs = ticket.logs.all().order_by('fecha_creacion')
-        chat_history = [HumanMessage(content=log.mensaje) if log.emisor == LogInteraccion.Emisor.USUARIO else AIMessage(content=log.mensaje) for log in logs]
-        return {"chat_history": chat_history}
+        return {"chat_history": _chat_history(state, *load_conversation(ticket)), **_TURN_RESET}
     except Ticket.DoesNotExist:
-        return {"chat_history": []}
-
-def determine_topic(state: GraphState) -> dict:
-    """Clasifica la consulta del usuario en un tema y evalúa la confianza."""
-    print("--- GRAFO: NODO (determine_topic) ---")
-    if state.get('topic_locked'):
-        print(f"-> Tema ya fijado en: '{state['current_topic']}'. Saltando clasificación.")
-        return {"current_topic": state['current_topic'], "topic_confidence": "alta"}
+        return {"chat_history": history_text('', []), **_TURN_RESET}
 
-    user_input, chat_history, master_topics = state['user_input'], state['chat_history'], get_master_topic_list()
-    # En el nodo determine_topic de tu graph.py
+async def aassemble_context(state: GraphState) -> dict:
+    print("--- GRAFO: NODO (assemble_context, async) ---")
+    ticket_id = state['ticket_id']
+    try:
+        ticket = await Ticket.objects.aget(id=ticket_id)
+        return {"chat_history": _chat_history(state, *await aload_conversation(ticket)), **_TURN_RESET}
+    except Ticket.DoesNotExist:
+        return {"chat_history": history_text('', []), **_TURN_RESET}
 
-    prompt = (
+def _topic_prompt(user_input, chat_history) -> str:
+    master_topics = get_master_topic_list()
+    return (
         "Eres un experto en clasificación de texto para una mesa de ayuda. Tu tarea es analizar la consulta de un usuario "
         "y determinar a cuál de los siguientes temas predefinidos pertenece. Debes también evaluar tu nivel de confianza.\n\n"
         "**Temas Disponibles:**\n"
@@ -71,72 +92,357 @@ def determine_topic(state: GraphState) -> dict:
         f"**Consulta del Usuario:**\n'{user_input}'\n\n"
         "**Respuesta JSON:**"
     )
+
+def _parse_topic(content: str):
+    """Devuelve (tema, confianza) de la respuesta JSON del clasificador."""
+    result = json.loads(content)
+    topic, confidence = result.get("tema", "Información General"), result.get("confianza", "baja")
+    print(f"-> Tema Detectado: '{topic}' con confianza '{confidence}'")
+    return topic, confidence, result
+
+def _locked_topic(state: GraphState) -> dict:
+    print(f"-> Tema ya fijado en: '{state['current_topic']}'. Saltando clasificación.")
+    return {"current_topic": state['current_topic'], "topic_confidence": "alta"}
+
+def _local_topic(state: GraphState):
+    """Camino rápido: si el clasificador local tiene margen suficiente, no se llama al LLM."""
+    local = classify_locally(state['user_input'])
+    return local, bool(local and local[3])
+
+def _keeps_locked_topic(state: GraphState, local, confident) -> bool:
+    """
+    El tema fijado se conserva entre turnos (queda en el checkpoint), salvo que
+    el clasificador local elija con confianza un tema de otra familia: el
+    usuario cambió de asunto y hay que volver a clasificar.
+    """
+    if not state.get('topic_locked'):
+        return False
+    if confident and resolve_topic(local[0])[0] != resolve_topic(state.get('current_topic'))[0]:
+        print(f"-> El mensaje es de otro tema ('{local[0]}'). Se libera el tema fijado '{state.get('current_topic')}'.")
+        return False
+    return True
+
+def _local_decision_args(state: GraphState, local):
+    return state['ticket_id'], state['user_input'], local[0], "alta", TopicDecision.Origen.LOCAL, local
+
+def _degraded_topic(state: GraphState, local, error) -> dict:
+    """
+    Sin LLM no se escala: se sigue con el mejor tema del clasificador local
+    (aunque tenga poco margen) y la consulta tal como la escribió el usuario.
+    """
+    topic = local[0] if local else "Información General"
+    print(f"-> LLM no disponible ({error}). Modo degradado con el tema '{topic}'.")
+    return {
+        "current_topic": topic, "topic_confidence": "baja", "topic_locked": False,
+        "rewritten_query": state['user_input'], "llm_degraded": True,
+    }
+
+def _topic_fallback(error) -> dict:
+    print(f"-> ERROR al determinar el tema: {error}")
+    return {"current_topic": "Información General", "topic_confidence": "baja"}
+
+def determine_topic(state: GraphState) -> dict:
+    """Clasifica la consulta del usuario en un tema y evalúa la confianza."""
+    print("--- GRAFO: NODO (determine_topic) ---")
+    local, confident = _local_topic(state)
+    if _keeps_locked_topic(state, local, confident):
+        return _locked_topic(state)
+    if confident:
+        record_decision(*_local_decision_args(state, local))
+        return {"current_topic": local[0], "topic_confidence": "alta", "topic_locked": False, "clarification_attempts": 0}
+    try:
+        response = invoke_llm(_topic_prompt(state['user_input'], state['chat_history']),
+                              temperature=0.0, response_mime_type="application/json")
+        topic, confidence, _ = _parse_topic(response.content)
+        record_decision(state['ticket_id'], state['user_input'], topic, confidence, TopicDecision.Origen.LLM, local)
+        return {"current_topic": topic, "topic_confidence": confidence, "topic_locked": False, "clarification_attempts": 0}
+    except LLMUnavailableError as e:
+        return _degraded_topic(state, local, e)
+    except Exception as e:
+        return _topic_fallback(e)
+
+async def adetermine_topic(state: GraphState) -> dict:
+    print("--- GRAFO: NODO (determine_topic, async) ---")
+    local, confident = _local_topic(state)
+    if _keeps_locked_topic(state, local, confident):
+        return _locked_topic(state)
+    if confident:
+        await sync_to_async(record_decision)(*_local_decision_args(state, local))
+        return {"current_topic": local[0], "topic_confidence": "alta", "topic_locked": False, "clarification_attempts": 0}
     try:
-        llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.0, google_api_key=GEMINI_API_KEY, response_mime_type="application/json")
-        response = llm.invoke(prompt)
-        result = json.loads(response.content)
-        topic, confidence = result.get("tema", "Información General"), result.get("confianza", "baja")
-        print(f"-> Tema Detectado: '{topic}' con confianza '{confidence}'")
+        response = await ainvoke_llm(_topic_prompt(state['user_input'], state['chat_history']),
+                                     temperature=0.0, response_mime_type="application/json")
+        topic, confidence, _ = _parse_topic(response.content)
+        await sync_to_async(record_decision)(state['ticket_id'], state['user_input'], topic, confidence, TopicDecision.Origen.LLM, local)
         return {"current_topic": topic, "topic_confidence": confidence, "topic_locked": False, "clarification_attempts": 0}
+    except LLMUnavailableError as e:
+        return _degraded_topic(state, local, e)
     except Exception as e:
-        print(f"-> ERROR al determinar el tema: {e}")
-        return {"current_topic": "Información General", "topic_confidence": "baja"}
+        return _topic_fallback(e)
+
+def _classify_and_rewrite_prompt(user_input, chat_history) -> str:
+    master_topics = get_master_topic_list()
+    return (
+        "Eres un experto en clasificación de texto para una mesa de ayuda. Tu tarea es analizar la consulta de un usuario, "
+        "determinar a cuál de los siguientes temas predefinidos pertenece, evaluar tu nivel de confianza y reformularla "
+        "como una pregunta completa y autónoma para buscar en la base de conocimiento.\n\n"
+        "**Temas Disponibles:**\n"
+        f"{', '.join(master_topics)}\n\n"
+        "**Instrucciones:**\n"
+        "1. Lee la 'Consulta del Usuario' y el 'Historial' para entender el contexto.\n"
+        "2. Elige el tema más relevante de la lista de 'Temas Disponibles'.\n"
+        "3. Evalúa tu confianza como 'alta', 'media' o 'baja'. La confianza debe ser 'alta' solo si la consulta es muy explícita. "
+        "Si es ambigua o muy general, usa 'media'. Si no encaja en ningún tema, elige un tema general y usa 'baja'.\n"
+        "4. **MUY IMPORTANTE:** Si la consulta del usuario es una pregunta general como 'quiero actualizar mi página' o 'necesito ayuda', y el historial no da más contexto, es preferible que elijas un tema amplio como 'Información General' con confianza 'media' antes que un tema específico.\n"
+        "5. Reformula el mensaje del usuario como una pregunta completa y autónoma, considerando el historial.\n"
+        "6. Responde únicamente en formato JSON con las claves 'tema', 'confianza' y 'pregunta'. "
+        "Ejemplo: {\"tema\": \"Identidad Visual Web\", \"confianza\": \"alta\", \"pregunta\": \"¿Cómo cambio el logo del sitio web del consulado?\"}\n\n"
+        f"**Historial:**\n{chat_history}\n\n"
+        f"**Consulta del Usuario:**\n'{user_input}'\n\n"
+        "**Respuesta JSON:**"
+    )
+
+def _classify_and_rewrite_result(state: GraphState, content: str):
+    """Interpreta la respuesta combinada. Devuelve (actualización del estado, tema, confianza)."""
+    topic, confidence, result = _parse_topic(content)
+    rewritten_query = (result.get("pregunta") or "").strip() or state['user_input']
+    print(f"-> Pregunta optimizada: '{rewritten_query}'")
+    # Igual que rewrite_query: el tema se fija solo si se procede con la búsqueda.
+    return {
+        "current_topic": topic, "topic_confidence": confidence, "rewritten_query": rewritten_query,
+        "topic_locked": confidence == "alta", "clarification_attempts": 0,
+    }, topic, confidence
+
+def _classify_and_rewrite_fallback(error) -> dict:
+    print(f"-> ERROR al clasificar y reformular: {error}")
+    return {"current_topic": "Información General", "topic_confidence": "baja"}
+
+def classify_and_rewrite(state: GraphState) -> dict:
+    """
+    Clasifica el tema y reformula la pregunta en una sola llamada al LLM
+    (reemplaza a determine_topic + rewrite_query cuando GRAPH_COMBINED_CLASSIFY_REWRITE
+    está activo). Devuelve las mismas claves, así que los routers no cambian.
+    """
+    print("--- GRAFO: NODO (classify_and_rewrite) ---")
+    local, confident = _local_topic(state)
+    if _keeps_locked_topic(state, local, confident):
+        return {**_locked_topic(state), **rewrite_query(state)}
+
+    # Con el tema resuelto localmente solo queda reformular la pregunta.
+    if confident:
+        record_decision(*_local_decision_args(state, local))
+        return {"current_topic": local[0], "topic_confidence": "alta", "clarification_attempts": 0, **rewrite_query(state)}
+    try:
+        response = invoke_llm(_classify_and_rewrite_prompt(state['user_input'], state['chat_history']),
+                              temperature=0.0, response_mime_type="application/json")
+        update, topic, confidence = _classify_and_rewrite_result(state, response.content)
+        record_decision(state['ticket_id'], state['user_input'], topic, confidence, TopicDecision.Origen.LLM, local)
+        return update
+    except LLMUnavailableError as e:
+        return _degraded_topic(state, local, e)
+    except Exception as e:
+        return _classify_and_rewrite_fallback(e)
+
+async def aclassify_and_rewrite(state: GraphState) -> dict:
+    print("--- GRAFO: NODO (classify_and_rewrite, async) ---")
+    local, confident = _local_topic(state)
+    if _keeps_locked_topic(state, local, confident):
+        return {**_locked_topic(state), **await arewrite_query(state)}
+
+    if confident:
+        await sync_to_async(record_decision)(*_local_decision_args(state, local))
+        return {"current_topic": local[0], "topic_confidence": "alta", "clarification_attempts": 0, **await arewrite_query(state)}
+    try:
+        response = await ainvoke_llm(_classify_and_rewrite_prompt(state['user_input'], state['chat_history']),
+                                     temperature=0.0, response_mime_type="application/json")
+        update, topic, confidence = _classify_and_rewrite_result(state, response.content)
+        await sync_to_async(record_decision)(state['ticket_id'], state['user_input'], topic, confidence, TopicDecision.Origen.LLM, local)
+        return update
+    except LLMUnavailableError as e:
+        return _degraded_topic(state, local, e)
+    except Exception as e:
+        return _classify_and_rewrite_fallback(e)
 
 def ask_topic_clarification(state: GraphState) -> dict:
     """Genera una pregunta para que el usuario aclare el tema."""
     print("--- GRAFO: NODO (ask_topic_clarification) ---")
     attempts = state.get("clarification_attempts", 0)
     clarification_message = "Para poder ayudarte mejor, ¿podrías describir tu problema con otras palabras o indicar a qué tema se refiere?"
-    return {"final_response": clarification_message, "clarification_attempts": attempts + 1}
+    # Si el usuario tiene que aclarar el tema, el que estaba fijado ya no vale.
+    return {"final_response": clarification_message, "clarification_attempts": attempts + 1, "topic_locked": False}
+
+def _rewrite_prompt(user_input, chat_history) -> str:
+    return f"Reformula el siguiente mensaje de usuario como una pregunta completa y autónoma, considerando el historial. Historial:{chat_history}\nMensaje: {user_input}\nPregunta:"
+
+def _rewrite_result(content: str) -> dict:
+    print(f"-> Pregunta optimizada: '{content}'")
+    return {"rewritten_query": content, "topic_locked": True} # Fijamos el tema al proceder con la búsqueda
+
+def _degraded_rewrite(state: GraphState, error=None) -> dict:
+    if error is not None:
+        print(f"-> LLM no disponible ({error}). Se busca con la consulta original.")
+    return {"rewritten_query": state['user_input'], "llm_degraded": True}
 
 def rewrite_query(state: GraphState) -> dict:
     """Reformula la pregunta del usuario para optimizar la búsqueda."""
     print("--- GRAFO: NODO (rewrite_query) ---")
     # ... (Esta función puede permanecer como la tenías, es una buena utilidad)
-    user_input, chat_history = state['user_input'], state['chat_history']
-    prompt = f"Reformula el siguiente mensaje de usuario como una pregunta completa y autónoma, considerando el historial. Historial:{chat_history}\nMensaje: {user_input}\nPregunta:"
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.0, google_api_key=GEMINI_API_KEY)
-    response = llm.invoke(prompt)
-    rewritten_query = response.content
-    print(f"-> Pregunta optimizada: '{rewritten_query}'")
-    return {"rewritten_query": rewritten_query, "topic_locked": True} # Fijamos el tema al proceder con la búsqueda
+    if state.get('llm_degraded'):
+        return _degraded_rewrite(state)
+    try:
+        response = invoke_llm(_rewrite_prompt(state['user_input'], state['chat_history']), temperature=0.0)
+    except LLMUnavailableError as e:
+        return _degraded_rewrite(state, e)
+    return _rewrite_result(response.content)
+
+async def arewrite_query(state: GraphState) -> dict:
+    print("--- GRAFO: NODO (rewrite_query, async) ---")
+    if state.get('llm_degraded'):
+        return _degraded_rewrite(state)
+    try:
+        response = await ainvoke_llm(_rewrite_prompt(state['user_input'], state['chat_history']), temperature=0.0)
+    except LLMUnavailableError as e:
+        return _degraded_rewrite(state, e)
+    return _rewrite_result(response.content)
+
+def _answer_cache_result(state: GraphState, entry) -> dict:
+    if entry is None:
+        return {"answer_cache_hit": False}
+    if state.get('llm_degraded'):
+        record_degraded()
+    return {"final_response": entry.respuesta, "answer_cache_hit": True}
+
+def check_answer_cache(state: GraphState) -> dict:
+    """Responde desde la caché semántica si ya se contestó una pregunta equivalente del mismo tema."""
+    print("--- GRAFO: NODO (check_answer_cache) ---")
+    return _answer_cache_result(state, lookup_answer(state['rewritten_query'], state.get('current_topic')))
+
+async def acheck_answer_cache(state: GraphState) -> dict:
+    print("--- GRAFO: NODO (check_answer_cache, async) ---")
+    return _answer_cache_result(state, await alookup_answer(state['rewritten_query'], state.get('current_topic')))
+
+def _retrieval_key(state: GraphState) -> str:
+    # La versión del índice invalida la búsqueda guardada si cambió la base de conocimiento.
+    return json.dumps([state['rewritten_query'], state.get('current_topic'), get_index_version()], default=str)
+
+def _reused_retrieval(state: GraphState, key: str):
+    """La búsqueda del turno anterior, si fue la misma consulta con el mismo tema."""
+    if state.get('retrieval_key') == key and state.get('relevant_docs'):
+        print(f"-> Se reutilizan los {len(state['relevant_docs'])} fragmentos de la búsqueda anterior.")
+        return {"relevant_docs": state['relevant_docs']}
+    return None
 
 def search_knowledge_base(state: GraphState) -> dict:
     """Busca en la BD vectorial usando un filtro de tema."""
     print("--- GRAFO: NODO (search_knowledge_base) ---")
+    key = _retrieval_key(state)
+    if reused := _reused_retrieval(state, key):
+        return reused
     rewritten_query, current_topic = state['rewritten_query'], state.get('current_topic')
     print(f"-> Buscando con la consulta: '{rewritten_query}' y filtro de tema: '{current_topic}'")
     relevant_docs = search_knowledge_base_vector(rewritten_query, topic=current_topic)
-    return {"relevant_docs": relevant_docs}
+    return {"relevant_docs": relevant_docs, "retrieval_key": key}
 
-def generate_response(state: GraphState) -> dict:
-    """Genera una respuesta basada en el conocimiento encontrado."""
-    print("--- GRAFO: NODO (generate_response) ---")
-    rewritten_query, relevant_docs = state['rewritten_query'], state['relevant_docs']
-    context = "\n\n".join([doc.page_content for doc in relevant_docs])
-    prompt = (
+async def asearch_knowledge_base(state: GraphState) -> dict:
+    """Versión asíncrona del nodo de búsqueda, usada por `app.ainvoke`."""
+    print("--- GRAFO: NODO (search_knowledge_base, async) ---")
+    key = _retrieval_key(state)
+    if reused := _reused_retrieval(state, key):
+        return reused
+    rewritten_query, current_topic = state['rewritten_query'], state.get('current_topic')
+    print(f"-> Buscando con la consulta: '{rewritten_query}' y filtro de tema: '{current_topic}'")
+    relevant_docs = await asearch_knowledge_base_vector(rewritten_query, topic=current_topic)
+    return {"relevant_docs": relevant_docs, "retrieval_key": key}
+
+def _generation_prompt(rewritten_query, relevant_docs) -> str:
+    # Los pasajes ya vienen ordenados por relevancia: el empaquetador llena el presupuesto en ese orden.
+    packed = pack_context(rewritten_query, passages=[doc.page_content for doc in relevant_docs])
+    return (
         "Eres un asistente de soporte experto. Responde la pregunta del usuario basándote ESTRICTAMENTE en el siguiente contexto. "
         "Sé claro y conciso.\n\n"
-        f"Pregunta: '{rewritten_query}'\n\n"
-        f"Contexto:\n---\n{context}\n---\n\n"
+        f"Pregunta: '{packed.question}'\n\n"
+        f"Contexto:\n---\n{packed.passages_text()}\n---\n\n"
         "Respuesta:"
     )
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.2, google_api_key=GEMINI_API_KEY)
-    response = llm.invoke(prompt)
+
+def _store_generated_answer(state: GraphState, answer: str):
+    try:
+        store_answer(state['rewritten_query'], state.get('current_topic'), answer, state['relevant_docs'])
+    except Exception as e:
+        print(f"-> ERROR al guardar la respuesta en la caché: {e}")
+
+async def _astore_generated_answer(state: GraphState, answer: str):
+    try:
+        await astore_answer(state['rewritten_query'], state.get('current_topic'), answer, state['relevant_docs'])
+    except Exception as e:
+        print(f"-> ERROR al guardar la respuesta en la caché: {e}")
+
+def _degraded_response(state: GraphState, error) -> dict:
+    """Respuesta extractiva con los pasajes encontrados. No se guarda en la caché."""
+    print(f"-> LLM no disponible ({error}). Se responde con los pasajes encontrados.")
+    record_degraded()
+    excerpt = extractive_answer(state['rewritten_query'], [doc.page_content for doc in state['relevant_docs']])
+    message = (
+        "En este momento el asistente tiene demoras para redactar una respuesta. "
+        f"Esto es lo que encontré en la base de conocimiento:\n\n{excerpt}"
+    )
+    return {"final_response": message, "llm_degraded": True}
+
+def generate_response(state: GraphState) -> dict:
+    """Genera una respuesta basada en el conocimiento encontrado."""
+    print("--- GRAFO: NODO (generate_response) ---")
+    try:
+        response = invoke_llm(_generation_prompt(state['rewritten_query'], state['relevant_docs']), temperature=0.2)
+    except LLMUnavailableError as e:
+        return _degraded_response(state, e)
+    _store_generated_answer(state, response.content)
     return {"final_response": response.content}
 
+async def agenerate_response(state: GraphState) -> dict:
+    print("--- GRAFO: NODO (generate_response, async) ---")
+    try:
+        response = await ainvoke_llm(_generation_prompt(state['rewritten_query'], state['relevant_docs']), temperature=0.2)
+    except LLMUnavailableError as e:
+        return _degraded_response(state, e)
+    await _astore_generated_answer(state, response.content)
+    return {"final_response": response.content}
+
+def _escalation_message(state: GraphState) -> str:
+    return f"No he podido resolver tu consulta sobre '{state['user_input']}'. He escalado el Ticket #{state['ticket_id']} a un técnico."
+
 def escalate_to_technician(state: GraphState) -> dict:
     """Prepara un mensaje de escalada y notifica al técnico."""
     print("--- GRAFO: NODO (escalate_to_technician) ---")
-    ticket_id, user_input = state['ticket_id'], state['user_input']
+    ticket_id = state['ticket_id']
     try:
         ticket = Ticket.objects.get(id=ticket_id)
         ticket.estado = Ticket.Estado.ESCALADO
         ticket.save()
     except Ticket.DoesNotExist: pass
-    escalation_message = f"No he podido resolver tu consulta sobre '{user_input}'. He escalado el Ticket #{ticket_id} a un técnico."
     notify_technician_task.delay(ticket_id)
-    return {"final_response": escalation_message}
+    # El siguiente mensaje del ticket escalado se vuelve a clasificar desde cero.
+    return {"final_response": _escalation_message(state), "topic_locked": False}
+
+async def aescalate_to_technician(state: GraphState) -> dict:
+    print("--- GRAFO: NODO (escalate_to_technician, async) ---")
+    ticket_id = state['ticket_id']
+    try:
+        ticket = await Ticket.objects.aget(id=ticket_id)
+        ticket.estado = Ticket.Estado.ESCALADO
+        await ticket.asave()
+    except Ticket.DoesNotExist: pass
+    # Encolar en Celery es una llamada bloqueante al broker.
+    await sync_to_async(notify_technician_task.delay)(ticket_id)
+    return {"final_response": _escalation_message(state), "topic_locked": False}
+
+def _node(func, afunc=None):
+    """
+    Nodo con ambas variantes: `invoke` usa la síncrona y `ainvoke`/`astream` la
+    asíncrona. Las dos se miden para las métricas del turno (ver instrumentation.py).
+    """
+    name = func.__name__
+    afunc = ainstrument_node(name, afunc) if afunc else None
+    return RunnableLambda(instrument_node(name, func), afunc=afunc, name=name)
 
 # ==============================================================================
 # 3. Routers y Construcción del Grafo
@@ -145,50 +451,75 @@ def route_by_topic_confidence(state: GraphState) -> Literal["ask_clarification",
     """Router que dirige el flujo basándose en la confianza del tema."""
     print("--- GRAFO: ROUTER (route_by_topic_confidence) ---")
     confidence, attempts = state.get("topic_confidence", "baja"), state.get("clarification_attempts", 0)
-    if confidence == "alta":
+    # Sin LLM se intenta responder desde la caché o la base de conocimiento antes que escalar.
+    if confidence == "alta" or state.get("llm_degraded"):
         return "rewrite_query"
     elif confidence == "media" and attempts < 1:
         return "ask_clarification"
     else:
         return "escalate"
 
+def route_after_cache(state: GraphState) -> Literal["cached", "search_knowledge_base"]:
+    """Router que termina el turno si la respuesta salió de la caché."""
+    print("--- GRAFO: ROUTER (route_after_cache) ---")
+    return "cached" if state.get("answer_cache_hit") else "search_knowledge_base"
+
 def route_after_search(state: GraphState) -> Literal["generate_response", "escalate_to_technician"]:
     """Router que decide si responder o escalar después de la búsqueda."""
     print("--- GRAFO: ROUTER (route_after_search) ---")
     return "generate_response" if state['relevant_docs'] else "escalate_to_technician"
 
+# Con el modo combinado, un solo nodo clasifica y reformula (una llamada al LLM
+# menos por turno) y el camino de búsqueda continúa directo en la caché.
+COMBINED_CLASSIFY_REWRITE = getattr(settings, 'GRAPH_COMBINED_CLASSIFY_REWRITE', True)
+
 workflow = StateGraph(GraphState)
 
 # Añadimos los nodos
-workflow.add_node("assemble_context", assemble_context)
-workflow.add_node("determine_topic", determine_topic)
-workflow.add_node("ask_topic_clarification", ask_topic_clarification)
-workflow.add_node("rewrite_query", rewrite_query)
-workflow.add_node("search_knowledge_base", search_knowledge_base)
-workflow.add_node("generate_response", generate_response)
-workflow.add_node("escalate_to_technician", escalate_to_technician)
+workflow.add_node("assemble_context", _node(assemble_context, aassemble_context))
+if COMBINED_CLASSIFY_REWRITE:
+    topic_node = "classify_and_rewrite"
+    workflow.add_node(topic_node, _node(classify_and_rewrite, aclassify_and_rewrite))
+else:
+    topic_node = "determine_topic"
+    workflow.add_node(topic_node, _node(determine_topic, adetermine_topic))
+    workflow.add_node("rewrite_query", _node(rewrite_query, arewrite_query))
+workflow.add_node("ask_topic_clarification", _node(ask_topic_clarification))
+workflow.add_node("check_answer_cache", _node(check_answer_cache, acheck_answer_cache))
+workflow.add_node("search_knowledge_base", _node(search_knowledge_base, asearch_knowledge_base))
+workflow.add_node("generate_response", _node(generate_response, agenerate_response))
+workflow.add_node("escalate_to_technician", _node(escalate_to_technician, aescalate_to_technician))
 
 # Construimos el flujo
 workflow.set_entry_point("assemble_context")
-workflow.add_edge("assemble_context", "determine_topic")
+workflow.add_edge("assemble_context", topic_node)
 
 # Primer router: por confianza del tema
 workflow.add_conditional_edges(
-    "determine_topic",
-    route_by_topic_confidence,
+    topic_node,
+    instrument_router(route_by_topic_confidence),
     {
         "ask_clarification": "ask_topic_clarification",
-        "rewrite_query": "rewrite_query",
+        "rewrite_query": "check_answer_cache" if COMBINED_CLASSIFY_REWRITE else "rewrite_query",
         "escalate": "escalate_to_technician"
     }
 )
-# El camino de la búsqueda
-workflow.add_edge("rewrite_query", "search_knowledge_base")
+# El camino de la búsqueda: antes se consulta la caché de respuestas
+if not COMBINED_CLASSIFY_REWRITE:
+    workflow.add_edge("rewrite_query", "check_answer_cache")
+workflow.add_conditional_edges(
+    "check_answer_cache",
+    instrument_router(route_after_cache),
+    {
+        "cached": END,
+        "search_knowledge_base": "search_knowledge_base"
+    }
+)
 
 # Segundo router: por resultados de la búsqueda
 workflow.add_conditional_edges(
     "search_knowledge_base",
-    route_after_search,
+    instrument_router(route_after_search),
     {
         "generate_response": "generate_response",
         "escalate_to_technician": "escalate_to_technician"
@@ -199,5 +530,18 @@ workflow.add_edge("generate_response", END)
 workflow.add_edge("escalate_to_technician", END)
 workflow.add_edge("ask_topic_clarification", END)
 
-app = workflow.compile()
+# El estado de cada ticket se guarda en la BD (hilo 'ticket-<id>'): cada turno
+# retoma el tema fijado, los intentos de aclaración y la última búsqueda. Con
+# durabilidad "exit" se escribe un checkpoint por turno, no uno por nodo.
+CHECKPOINT_DURABILITY = getattr(settings, 'GRAPH_CHECKPOINT_DURABILITY', 'exit')
+
+def turn_kwargs(ticket_id) -> dict:
+    """Argumentos de invoke/stream para un turno del ticket: su hilo y la durabilidad."""
+    return {"config": {"configurable": {"thread_id": thread_id_for_ticket(ticket_id)}}, "durability": CHECKPOINT_DURABILITY}
+
+def get_ticket_graph_state(ticket_id) -> dict:
+    """Último estado guardado del grafo para el ticket ({} si aún no tuvo turnos)."""
+    return app.get_state(turn_kwargs(ticket_id)["config"]).values or {}
+
+app = workflow.compile(checkpointer=DjangoCheckpointSaver())
 print("--- GRAFO v3.2 COMPILADO Y LISTO (ARQUITECTURA REFINADA) ---")
\ No newline at end of file
@@ -0,0 +1,333 @@
+# apps/ai_core/instrumentation.py
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .context_packing import count_tokens
+
+# Turno en curso del contexto actual. LangGraph copia el contexto a los hilos
+# y tareas donde corre cada nodo, y todos comparten el mismo recolector.
+_current_turn = ContextVar('current_turn', default=None)
+
+# Funciones extra que reciben cada evento: hook(tipo, nombre, datos).
+# Tipos: 'node' (ms, resultado), 'router' (ruta elegida), 'llm' (tokens y ms) y 'turn' (TurnCollector).
+_hooks = []
+
+
+def register_hook(hook):
+    """Suscribe una función a los eventos de instrumentación del grafo."""
+    if hook not in _hooks:
+        _hooks.append(hook)
+
+
+def unregister_hook(hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def _emit(kind, name, data):
+    for hook in list(_hooks):
+        try:
+            hook(kind, name, data)
+        except Exception as e:
+            print(f"MÉTRICAS: Error en un hook ({e}).")
+
+
+class TurnCollector:
+    """Acumula lo que ocurre en un turno del grafo para guardarlo como un TurnMetrics."""
+
+    def __init__(self, ticket_id=None, channel=''):
+        self.ticket_id = ticket_id
+        self.channel = channel
+        self.started = time.perf_counter()
+        self.nodes = {}
+        self.routes = []
+        self.llm_calls = 0
+        self.llm_ms = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.estimated_tokens = False
+        self.cost_usd = 0.0
+        self.retrieved_chunks = 0
+        self.error = ''
+
+    def add_node(self, name, elapsed_ms):
+        self.nodes[name] = round(self.nodes.get(name, 0.0) + elapsed_ms, 2)
+
+    def add_llm_usage(self, model, prompt_tokens, completion_tokens, estimated=False, elapsed_ms=0.0):
+        self.llm_calls += 1
+        self.llm_ms = round(self.llm_ms + elapsed_ms, 2)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.estimated_tokens = self.estimated_tokens or estimated
+        self.cost_usd += estimate_cost(model, prompt_tokens, completion_tokens)
+
+    @property
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def save(self):
+        from .models import TurnMetrics
+        try:
+            return TurnMetrics.objects.create(
+                ticket_id=self.ticket_id,
+                canal=self.channel or '',
+                duracion_ms=round(self.elapsed_ms, 2),
+                nodos=self.nodes,
+                ruta=self.routes,
+                llamadas_llm=self.llm_calls,
+                tokens_prompt=self.prompt_tokens,
+                tokens_respuesta=self.completion_tokens,
+                tokens_estimados=self.estimated_tokens,
+                costo_usd=round(self.cost_usd, 6),
+                fragmentos_recuperados=self.retrieved_chunks,
+                error=self.error[:500],
+            )
+        except Exception as e:
+            print(f"MÉTRICAS: No se pudo guardar el turno ({e}).")
+            return None
+
+
+def current_turn():
+    return _current_turn.get()
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens) -> float:
+    """Costo en USD según LLM_PRICING_USD_PER_MILLION (0 si el modelo no tiene precio)."""
+    pricing = getattr(settings, 'LLM_PRICING_USD_PER_MILLION', {}).get(model or '')
+    if not pricing:
+        return 0.0
+    return (prompt_tokens * pricing.get('input', 0.0) + completion_tokens * pricing.get('output', 0.0)) / 1_000_000
+
+
+def _finish_turn(collector, error=None):
+    if error is not None:
+        collector.error = f"{type(error).__name__}: {error}"
+    print(f"MÉTRICAS: Turno del Ticket #{collector.ticket_id} en {collector.elapsed_ms:.0f} ms; "
+          f"{collector.llm_calls} llamadas al LLM, {collector.prompt_tokens}+{collector.completion_tokens} tokens, "
+          f"ruta: {' → '.join(collector.routes) or '-'}.")
+    _emit('turn', 'turn', collector)
+    collector.save()
+
+
+@contextmanager
+def track_turn(ticket_id=None, channel=''):
+    """
+    Mide un turno del grafo (síncrono). Se usa alrededor de `app.invoke` o de
+    la iteración de un stream:
+
+        with track_turn(ticket.id, 'WEB'):
+            final_state = app.invoke(state)
+    """
+    collector = TurnCollector(ticket_id, channel)
+    token = _current_turn.set(collector)
+    try:
+        yield collector
+    except BaseException as e:
+        _reset(token)
+        _finish_turn(collector, e)
+        raise
+    _reset(token)
+    _finish_turn(collector)
+
+
+def _reset(token):
+    # Dentro de un generador de streaming, el servidor puede reanudarlo en otro
+    # contexto: en ese caso solo se limpia el turno del contexto actual.
+    try:
+        _current_turn.reset(token)
+    except ValueError:
+        _current_turn.set(None)
+
+
+class atrack_turn:
+    """Versión asíncrona de track_turn (guarda las métricas sin bloquear el event loop)."""
+
+    def __init__(self, ticket_id=None, channel=''):
+        self.collector = TurnCollector(ticket_id, channel)
+        self._token = None
+
+    async def __aenter__(self):
+        self._token = _current_turn.set(self.collector)
+        return self.collector
+
+    async def __aexit__(self, exc_type, exc, tb):
+        from asgiref.sync import sync_to_async
+        _reset(self._token)
+        await sync_to_async(_finish_turn)(self.collector, exc)
+        return False
+
+
+def _record_node(name, started, result):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    collector = _current_turn.get()
+    if collector is not None:
+        collector.add_node(name, elapsed_ms)
+        if isinstance(result, dict) and result.get('relevant_docs') is not None:
+            collector.retrieved_chunks += len(result['relevant_docs'])
+    _emit('node', name, {'ms': elapsed_ms, 'result': result})
+
+
+def instrument_node(name, func):
+    """Envuelve un nodo (síncrono) para medir su tiempo."""
+    @functools.wraps(func)
+    def wrapper(state):
+        started = time.perf_counter()
+        result = func(state)
+        _record_node(name, started, result)
+        return result
+    return wrapper
+
+
+def ainstrument_node(name, afunc):
+    """Envuelve un nodo asíncrono para medir su tiempo."""
+    @functools.wraps(afunc)
+    async def wrapper(state):
+        started = time.perf_counter()
+        result = await afunc(state)
+        _record_node(name, started, result)
+        return result
+    return wrapper
+
+
+def instrument_router(router):
+    """Envuelve un router para registrar la ruta elegida."""
+    @functools.wraps(router)
+    def wrapper(state):
+        route = router(state)
+        collector = _current_turn.get()
+        if collector is not None:
+            collector.routes.append(f"{router.__name__}:{route}")
+        _emit('router', router.__name__, route)
+        return route
+    return wrapper
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """
+    Registra los tokens de cada llamada al LLM en el turno en curso. Si el
+    proveedor no informa el uso, se estima con count_tokens.
+    """
+
+    # Corre en el mismo contexto que la llamada, también con `ainvoke`.
+    run_inline = True
+
+    def __init__(self):
+        # Una sola instancia la usan todos los hilos y tareas del proceso.
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        params = kwargs.get('invocation_params') or {}
+        prompt = "\n".join(str(message.content) for batch in messages for message in batch)
+        run = (params.get('model') or params.get('model_name') or '', count_tokens(prompt), time.perf_counter())
+        with self._lock:
+            self._runs[run_id] = run
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            model, estimated_prompt, started = self._runs.pop(run_id, ('', 0, None))
+        # Tiempo dentro del modelo (la espera de la respuesta), para separarlo del resto del turno.
+        elapsed_ms = (time.perf_counter() - started) * 1000 if started else 0.0
+        collector = _current_turn.get()
+        usage, text = None, ''
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, 'message', None)
+                usage = usage or getattr(message, 'usage_metadata', None)
+                text += generation.text or ''
+        if usage:
+            prompt_tokens, completion_tokens, estimated = usage.get('input_tokens', 0), usage.get('output_tokens', 0), False
+        else:
+            prompt_tokens, completion_tokens, estimated = estimated_prompt, count_tokens(text), True
+        model = model.removeprefix('models/')
+        if collector is not None:
+            collector.add_llm_usage(model, prompt_tokens, completion_tokens, estimated, elapsed_ms)
+        _emit('llm', model, {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                             'estimated': estimated, 'ms': round(elapsed_ms, 2)})
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._runs.pop(run_id, None)
+
+
+usage_handler = UsageCallbackHandler()
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+    return values[index]
+
+
+# Los percentiles por nodo se calculan en Python (los tiempos están en un
+# JSONField): el resultado se reutiliza durante GRAPH_METRICS_CACHE_SECONDS.
+_metrics_lock = threading.Lock()
+_metrics_cache = {}
+
+
+def get_graph_metrics(days: int = 7, spend_days: int = 14, max_turns: int = 5000) -> dict:
+    """
+    Agregados para el tablero: p50/p95 por nodo y del turno completo (últimos
+    'days' días, hasta 'max_turns' turnos) y gasto estimado por día.
+    """
+    ttl = getattr(settings, 'GRAPH_METRICS_CACHE_SECONDS', 60)
+    key = (days, spend_days, max_turns)
+    with _metrics_lock:
+        cached = _metrics_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    metrics = _compute_graph_metrics(days, spend_days, max_turns)
+    with _metrics_lock:
+        _metrics_cache[key] = (time.monotonic(), metrics)
+    return metrics
+
+
+def reset_graph_metrics_cache():
+    with _metrics_lock:
+        _metrics_cache.clear()
+
+
+def _compute_graph_metrics(days, spend_days, max_turns) -> dict:
+    from .models import TurnMetrics
+    since = timezone.now() - timedelta(days=days)
+    turns = list(
+        TurnMetrics.objects.filter(fecha__gte=since).order_by('-fecha').values_list('duracion_ms', 'nodos')[:max_turns]
+    )
+    per_node = {}
+    for _, nodes in turns:
+        for name, ms in (nodes or {}).items():
+            per_node.setdefault(name, []).append(ms)
+    nodes = sorted(
+        ({'name': name, 'count': len(values), 'p50': _percentile(values, 0.5), 'p95': _percentile(values, 0.95)}
+         for name, values in per_node.items()),
+        key=lambda row: -row['p95'],
+    )
+    durations = [duration for duration, _ in turns]
+
+    spend_since = timezone.now() - timedelta(days=spend_days)
+    spend = list(
+        TurnMetrics.objects.filter(fecha__gte=spend_since)
+        .annotate(dia=TruncDate('fecha')).values('dia')
+        .annotate(costo=Sum('costo_usd'), tokens_prompt=Sum('tokens_prompt'), tokens_respuesta=Sum('tokens_respuesta'))
+        .order_by('-dia')
+    )
+    return {
+        'turns': len(turns),
+        'turn_p50': _percentile(durations, 0.5),
+        'turn_p95': _percentile(durations, 0.95),
+        'nodes': nodes,
+        'daily_spend': spend,
+    }
@@ -0,0 +1,113 @@
+# apps/ai_core/llm.py
+
+import os
+import threading
+
+from django.conf import settings
+
+# Un cliente por combinación de (modelo, temperatura, opciones) y por proceso.
+# Cada ChatGoogleGenerativeAI abre su propio canal gRPC/HTTP: crearlo en cada
+# llamada repetía el handshake TLS en cada turno. Los canales se reutilizan y
+# son seguros entre hilos (los de 'sync_to_async' del poller, o los de Django).
+_lock = threading.Lock()
+_models = {}
+
+_metrics = {
+    "created": 0,
+    "reused": 0,
+}
+
+
+LLM_PROVIDERS = ('gemini', 'record', 'replay', 'stub')
+
+
+def get_default_model_name() -> str:
+    return getattr(settings, 'GEMINI_CHAT_MODEL', 'gemini-1.5-flash')
+
+
+def _registry_key(model: str, temperature: float, options: dict) -> tuple:
+    return (model, float(temperature), tuple(sorted((name, repr(value)) for name, value in options.items())))
+
+
+def get_llm_provider() -> str:
+    """'gemini' (API real), 'record', 'replay' o 'stub' (ver llm_replay)."""
+    provider = getattr(settings, 'LLM_PROVIDER', 'gemini') or 'gemini'
+    if provider not in LLM_PROVIDERS:
+        raise ValueError(f"LLM_PROVIDER no soportado: '{provider}'. Opciones: {', '.join(LLM_PROVIDERS)}.")
+    return provider
+
+
+def _create_gemini_client(model: str, temperature: float, options: dict, callbacks=None):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    transport = getattr(settings, 'GEMINI_TRANSPORT', None)
+    if transport and 'transport' not in options:
+        options = {**options, 'transport': transport}
+    # Un solo intento por llamada: los reintentos y el plazo los maneja llm_gateway.
+    options = {'max_retries': 1, 'timeout': getattr(settings, 'LLM_REQUEST_TIMEOUT_SECONDS', 20.0), **options}
+    return ChatGoogleGenerativeAI(
+        model=model,
+        temperature=temperature,
+        google_api_key=os.getenv('GEMINI_API_KEY'),
+        callbacks=callbacks,
+        **options
+    )
+
+
+def _create_client(provider: str, model: str, temperature: float, options: dict):
+    from .instrumentation import usage_handler
+    # Registra los tokens de cada llamada en las métricas del turno.
+    callbacks = [usage_handler]
+    if provider == 'gemini':
+        return _create_gemini_client(model, temperature, options, callbacks)
+
+    from .llm_replay import RecordingChatModel, ReplayChatModel, get_fixtures_path
+    if provider == 'record':
+        # El cliente interno no lleva callbacks: el uso se registra una sola vez, en el que graba.
+        return RecordingChatModel(
+            client=_create_gemini_client(model, temperature, options), model_name=model, temperature=temperature,
+            options=options, fixtures_path=get_fixtures_path(), callbacks=callbacks,
+        )
+    return ReplayChatModel(
+        model_name=model, temperature=temperature, options=options,
+        fixtures_path=get_fixtures_path() if provider == 'replay' else None, callbacks=callbacks,
+    )
+
+
+def get_chat_model(model: str = None, temperature: float = 0.0, **options):
+    """
+    Devuelve el cliente de chat compartido para esa configuración, creándolo
+    una sola vez por proceso. 'options' se pasan tal cual a ChatGoogleGenerativeAI
+    (p. ej. response_mime_type="application/json").
+
+    Con LLM_PROVIDER distinto de 'gemini' el cliente graba las llamadas o las
+    responde localmente (ver llm_replay), sin cambiar nada en quien lo llama.
+
+    Para llamar al modelo usar llm_gateway.invoke_llm / ainvoke_llm, que agregan
+    límites de concurrencia, reintentos y el circuit breaker.
+    """
+    model = model or get_default_model_name()
+    provider = get_llm_provider()
+    key = (provider, *_registry_key(model, temperature, options))
+    with _lock:
+        llm = _models.get(key)
+        if llm is not None:
+            _metrics["reused"] += 1
+            return llm
+
+        llm = _create_client(provider, model, temperature, options)
+        _models[key] = llm
+        _metrics["created"] += 1
+        print(f"LLM: Cliente '{provider}' creado para '{model}' (temperatura {temperature}). Clientes activos: {len(_models)}.")
+        return llm
+
+
+def get_chat_model_metrics() -> dict:
+    """Devuelve cuántos clientes se crearon y cuántas veces se reutilizaron."""
+    with _lock:
+        return {**_metrics, "clients": len(_models)}
+
+
+def reset_chat_models():
+    """Descarta los clientes en memoria (p. ej. tras cambiar la clave de API en pruebas)."""
+    with _lock:
+        _models.clear()
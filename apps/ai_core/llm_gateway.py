@@ -0,0 +1,390 @@
+# apps/ai_core/llm_gateway.py
+
+import asyncio
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from .llm import get_chat_model, get_default_model_name
+
+# Toda llamada al LLM de chat pasa por aquí. Sin este punto único, un corte de
+# la API durante una ráfaga hacía que cada nodo cayera en su 'except' y
+# escalara el ticket: un solo problema de Gemini inundaba a los técnicos.
+#
+# - Límite de llamadas simultáneas global y por modelo (el resto espera su turno).
+# - Reintentos con backoff exponencial y jitter, solo para errores transitorios.
+# - Un plazo total por llamada, que incluye la espera y los reintentos.
+# - Un circuit breaker por modelo: tras varios fallos seguidos deja de llamar
+#   durante un tiempo y lanza LLMUnavailableError, para que el grafo responda
+#   en modo degradado (caché o respuesta extractiva) en lugar de escalar.
+
+# Códigos HTTP y excepciones (de google.api_core, httpx, grpc...) que indican un problema transitorio.
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'DeadlineExceeded',
+    'InternalServerError', 'BadGateway', 'GatewayTimeout', 'RetryError',
+    'TimeoutError', 'ConnectionError', 'ConnectTimeout', 'ReadTimeout', 'RemoteProtocolError',
+}
+
+# Cada cuánto revisa un llamador asíncrono si se liberó un lugar.
+_ASYNC_POLL_SECONDS = 0.02
+
+
+class LLMUnavailableError(Exception):
+    """El LLM no respondió: circuito abierto, reintentos agotados o plazo vencido."""
+
+
+def is_retryable(error) -> bool:
+    """Indica si el error (o alguna de sus causas) es transitorio."""
+    while error is not None:
+        if isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in RETRYABLE_ERROR_NAMES:
+            return True
+        code = getattr(error, 'code', None)
+        try:
+            if code is not None and int(code) in RETRYABLE_STATUS_CODES:
+                return True
+        except (TypeError, ValueError):
+            pass
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class ConcurrencyLimiter:
+    """Semáforo que además cuenta cuántos llamadores esperan (la profundidad de la cola)."""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, int(limit))
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        with self._cond:
+            self.waiting += 1
+            try:
+                acquired = self._cond.wait_for(lambda: self.active < self.limit, timeout=max(0.0, timeout))
+                if acquired:
+                    self.active += 1
+                return acquired
+            finally:
+                self.waiting -= 1
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            return False
+
+    async def aacquire(self, timeout: float) -> bool:
+        # Sin bloquear el event loop: el mismo contador sirve a hilos y corrutinas.
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.waiting += 1
+        try:
+            while not self.try_acquire():
+                if time.monotonic() >= deadline:
+                    return False
+                await asyncio.sleep(_ASYNC_POLL_SECONDS)
+            return True
+        finally:
+            with self._cond:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+class CircuitBreaker:
+    """
+    'cerrado': las llamadas pasan. Tras 'threshold' fallos transitorios seguidos
+    pasa a 'abierto' y rechaza todo durante 'cooldown' segundos. Luego queda
+    'semiabierto': deja pasar una sola llamada de prueba, que lo cierra si
+    funciona o lo vuelve a abrir si falla.
+
+    allow() entrega un permiso (None si rechaza). Si el intento termina sin
+    resultado, el llamador lo devuelve con cancel(): solo el dueño de la llamada
+    de prueba puede liberarla.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'cerrado', 'abierto', 'semiabierto'
+
+    def __init__(self, name: str, threshold: int, cooldown: float, clock=None):
+        self.name = name
+        self.threshold = max(1, int(threshold))
+        self.cooldown = cooldown
+        self.clock = clock or time.monotonic
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._opened_at = None
+        self._probe = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and self.clock() - self._opened_at >= self.cooldown:
+                self.state, self._probe = self.HALF_OPEN, None
+                print(f"LLM: Circuito de '{self.name}' semiabierto, se prueba una llamada.")
+            if self.state == self.HALF_OPEN:
+                if self._probe is not None:
+                    return None
+                self._probe = object()
+                return self._probe
+            return object() if self.state == self.CLOSED else None
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"LLM: Circuito de '{self.name}' cerrado, el servicio responde otra vez.")
+            self.state, self.failures, self._probe = self.CLOSED, 0, None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                self.state, self._opened_at, self._probe = self.OPEN, self.clock(), None
+                self.trips += 1
+                print(f"LLM: Circuito de '{self.name}' ABIERTO tras {self.failures} fallos; "
+                      f"se responde en modo degradado durante {self.cooldown:.0f}s.")
+
+    def cancel(self, permit):
+        """Libera la llamada de prueba si es de este permiso y no llegó a terminar (sin lugar, cancelada)."""
+        with self._lock:
+            if permit is not None and permit is self._probe:
+                self._probe = None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures, 'trips': self.trips}
+
+
+_lock = threading.Lock()
+_global_limiter = None
+_model_limiters = {}
+_breakers = {}
+_metrics = {
+    "calls": 0,
+    "succeeded": 0,
+    "retries": 0,
+    "rejected": 0,      # circuito abierto
+    "timeouts": 0,      # sin lugar o sin respuesta dentro del plazo
+    "failed": 0,        # reintentos agotados
+    "degraded": 0,      # respuestas servidas en modo degradado
+}
+
+
+def _get_global_limiter() -> ConcurrencyLimiter:
+    global _global_limiter
+    with _lock:
+        if _global_limiter is None:
+            _global_limiter = ConcurrencyLimiter(getattr(settings, 'LLM_MAX_CONCURRENCY', 16))
+        return _global_limiter
+
+
+def _get_model_limiter(model: str) -> ConcurrencyLimiter:
+    with _lock:
+        limiter = _model_limiters.get(model)
+        if limiter is None:
+            per_model = getattr(settings, 'LLM_MODEL_CONCURRENCY', {})
+            limit = per_model.get(model, getattr(settings, 'LLM_MAX_CONCURRENCY', 16))
+            limiter = _model_limiters[model] = ConcurrencyLimiter(limit)
+        return limiter
+
+
+def get_breaker(model: str) -> CircuitBreaker:
+    with _lock:
+        breaker = _breakers.get(model)
+        if breaker is None:
+            breaker = _breakers[model] = CircuitBreaker(
+                model,
+                threshold=getattr(settings, 'LLM_BREAKER_FAILURE_THRESHOLD', 5),
+                cooldown=getattr(settings, 'LLM_BREAKER_COOLDOWN_SECONDS', 30.0),
+            )
+        return breaker
+
+
+def _count(name: str, amount: int = 1):
+    with _lock:
+        _metrics[name] += amount
+
+
+def record_degraded():
+    """Lo llaman los nodos cuando responden sin el LLM (caché o respuesta extractiva)."""
+    _count("degraded")
+
+
+def _retry_delay(attempt: int) -> float:
+    base = getattr(settings, 'LLM_RETRY_BASE_SECONDS', 0.5)
+    cap = getattr(settings, 'LLM_RETRY_MAX_SECONDS', 8.0)
+    return min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+def _call_settings(model, deadline):
+    model = model or get_default_model_name()
+    deadline = deadline if deadline is not None else getattr(settings, 'LLM_CALL_DEADLINE_SECONDS', 30.0)
+    return model, time.monotonic() + deadline, getattr(settings, 'LLM_MAX_RETRIES', 2)
+
+
+def _unavailable(model: str, reason: str, metric: str, error=None):
+    _count(metric)
+    print(f"LLM: '{model}' no disponible ({reason}).")
+    return LLMUnavailableError(f"{model}: {reason}") if error is None else LLMUnavailableError(f"{model}: {reason}: {error}")
+
+
+def _handle_failure(model, breaker, error, attempt, max_retries, expires_at):
+    """
+    Registra el fallo y devuelve cuántos segundos esperar antes de reintentar.
+    Lanza el error original si no es transitorio, o LLMUnavailableError si no quedan intentos.
+    """
+    if not is_retryable(error):
+        # El error no dice si el servicio se recuperó (p. ej. un prompt inválido):
+        # no cuenta para el circuito. Si era la llamada de prueba, quien llama la
+        # libera con cancel() sin cerrar el circuito.
+        raise error
+    breaker.record_failure()
+    delay = _retry_delay(attempt)
+    if attempt >= max_retries or time.monotonic() + delay >= expires_at:
+        raise _unavailable(model, f"reintentos agotados tras {attempt + 1} intento(s)", "failed", error) from error
+    _count("retries")
+    print(f"LLM: Llamada a '{model}' falló ({type(error).__name__}: {error}). "
+          f"Reintento {attempt + 1}/{max_retries} en {delay:.1f}s.")
+    return delay
+
+
+@contextmanager
+def _slots(model, expires_at):
+    """Ocupa un lugar del modelo y uno global (en ese orden) hasta el final del intento."""
+    limiters = []
+    try:
+        for limiter in (_get_model_limiter(model), _get_global_limiter()):
+            if not limiter.acquire(expires_at - time.monotonic()):
+                raise _unavailable(model, "sin lugar dentro del plazo", "timeouts")
+            limiters.append(limiter)
+        yield
+    finally:
+        for limiter in reversed(limiters):
+            limiter.release()
+
+
+@asynccontextmanager
+async def _aslots(model, expires_at):
+    limiters = []
+    try:
+        for limiter in (_get_model_limiter(model), _get_global_limiter()):
+            if not await limiter.aacquire(expires_at - time.monotonic()):
+                raise _unavailable(model, "sin lugar dentro del plazo", "timeouts")
+            limiters.append(limiter)
+        yield
+    finally:
+        for limiter in reversed(limiters):
+            limiter.release()
+
+
+def invoke_llm(prompt, *, model: str = None, temperature: float = 0.0, deadline: float = None, **options):
+    """
+    Llama al modelo de chat compartido (ver llm.get_chat_model) respetando los
+    límites de concurrencia, los reintentos, el plazo y el circuit breaker.
+    Devuelve el mensaje de respuesta; lanza LLMUnavailableError si el LLM no
+    está disponible.
+
+    En la versión síncrona el plazo limita la espera y los reintentos; cada
+    intento lo acota el 'timeout' del cliente (LLM_REQUEST_TIMEOUT_SECONDS).
+    """
+    model, expires_at, max_retries = _call_settings(model, deadline)
+    breaker = get_breaker(model)
+    llm = get_chat_model(model=model, temperature=temperature, **options)
+    _count("calls")
+    for attempt in range(max_retries + 1):
+        permit = breaker.allow()
+        if permit is None:
+            raise _unavailable(model, "circuito abierto", "rejected")
+        try:
+            with _slots(model, expires_at):
+                try:
+                    response = llm.invoke(prompt)
+                except Exception as e:
+                    delay = _handle_failure(model, breaker, e, attempt, max_retries, expires_at)
+                else:
+                    breaker.record_success()
+                    _count("succeeded")
+                    return response
+        except BaseException:
+            # Sin lugar, interrumpido o cancelado: si era la llamada de prueba, el
+            # circuito no puede quedar semiabierto esperando un resultado que no llega.
+            breaker.cancel(permit)
+            raise
+        time.sleep(delay)
+
+
+async def ainvoke_llm(prompt, *, model: str = None, temperature: float = 0.0, deadline: float = None, **options):
+    """Versión asíncrona de invoke_llm. Aquí el plazo también corta el intento en curso."""
+    model, expires_at, max_retries = _call_settings(model, deadline)
+    breaker = get_breaker(model)
+    llm = get_chat_model(model=model, temperature=temperature, **options)
+    _count("calls")
+    for attempt in range(max_retries + 1):
+        permit = breaker.allow()
+        if permit is None:
+            raise _unavailable(model, "circuito abierto", "rejected")
+        try:
+            async with _aslots(model, expires_at):
+                try:
+                    response = await asyncio.wait_for(llm.ainvoke(prompt), timeout=max(0.0, expires_at - time.monotonic()))
+                except asyncio.TimeoutError as e:
+                    breaker.record_failure()
+                    raise _unavailable(model, "plazo vencido", "timeouts", e) from e
+                except Exception as e:
+                    delay = _handle_failure(model, breaker, e, attempt, max_retries, expires_at)
+                else:
+                    breaker.record_success()
+                    _count("succeeded")
+                    return response
+        except BaseException:
+            breaker.cancel(permit)
+            raise
+        await asyncio.sleep(delay)
+
+
+def get_llm_gateway_metrics() -> dict:
+    """Contadores del proceso, estado del circuito y profundidad de la cola por modelo."""
+    global_limiter = _get_global_limiter()
+    with _lock:
+        metrics = dict(_metrics)
+        limiters = dict(_model_limiters)
+        breakers = dict(_breakers)
+    models = {}
+    for model in sorted(set(limiters) | set(breakers)):
+        limiter = limiters.get(model)
+        models[model] = {
+            **(breakers[model].snapshot() if model in breakers else {'state': CircuitBreaker.CLOSED, 'failures': 0, 'trips': 0}),
+            'in_flight': limiter.active if limiter else 0,
+            'queued': limiter.waiting if limiter else 0,
+            'limit': limiter.limit if limiter else None,
+        }
+    open_models = [model for model, data in models.items() if data['state'] != CircuitBreaker.CLOSED]
+    return {
+        **metrics,
+        'in_flight': global_limiter.active,
+        'queued': global_limiter.waiting + sum(data['queued'] for data in models.values()),
+        'limit': global_limiter.limit,
+        'models': models,
+        'breaker_state': CircuitBreaker.OPEN if open_models else CircuitBreaker.CLOSED,
+        'open_models': open_models,
+    }
+
+
+def reset_llm_gateway():
+    """Descarta límites, circuitos y contadores (p. ej. tras cambiar la configuración en pruebas)."""
+    global _global_limiter
+    with _lock:
+        _global_limiter = None
+        _model_limiters.clear()
+        _breakers.clear()
+        for name in _metrics:
+            _metrics[name] = 0
@@ -0,0 +1,298 @@
+# apps/ai_core/llm_replay.py
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from django.conf import settings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+from .context_packing import count_tokens, extractive_answer, truncate_to_tokens
+
+# Modelos de chat sin red para medir el grafo (LLM_PROVIDER en settings):
+#
+# - 'record': llama a Gemini y guarda cada par prompt → respuesta (con su uso
+#   de tokens y su latencia) en un archivo JSONL de fixtures.
+# - 'replay': responde desde esas fixtures; un prompt no grabado se responde
+#   como en 'stub' y se cuenta como fallo.
+# - 'stub': respuestas sintéticas deterministas que respetan el formato que
+#   espera cada nodo (JSON del clasificador, pregunta reformulada, respuesta).
+#
+# En 'replay' y 'stub' cada llamada espera una latencia sintética configurable,
+# así se separa el costo propio (ORM, recuperación, orquestación) del del modelo.
+
+_lock = threading.Lock()
+_stores = {}
+
+_metrics = {
+    "hits": 0,
+    "misses": 0,
+    "stubbed": 0,
+    "recorded": 0,
+}
+
+
+def get_fixtures_path() -> str:
+    return str(getattr(settings, 'LLM_FIXTURES_PATH', None) or os.path.join(settings.BASE_DIR, 'llm_fixtures.jsonl'))
+
+
+def fixture_key(model: str, temperature: float, options: dict, prompt: str) -> str:
+    """Clave de una llamada: el modelo, la temperatura, las opciones (p. ej. modo JSON) y el prompt."""
+    raw = json.dumps([model, float(temperature), {name: repr(value) for name, value in options.items()}, prompt],
+                     ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _prompt_text(messages) -> str:
+    return "\n".join(str(message.content) for message in messages)
+
+
+def _count(name: str):
+    with _lock:
+        _metrics[name] += 1
+
+
+class FixtureStore:
+    """Fixtures de un archivo JSONL (una llamada grabada por línea), indexadas por su clave."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        self._write_lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry['key']] = entry
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str):
+        return self.entries.get(key)
+
+    def append(self, entry: dict):
+        with self._write_lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.entries[entry['key']] = entry
+
+
+def get_fixture_store(path: str = None) -> FixtureStore:
+    path = os.path.abspath(path or get_fixtures_path())
+    with _lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = FixtureStore(path)
+        return store
+
+
+def _synthetic_latency(entry=None) -> float:
+    """Segundos a esperar: LLM_STUB_LATENCY_MS ± LLM_STUB_LATENCY_JITTER_MS (None = la latencia grabada)."""
+    latency_ms = getattr(settings, 'LLM_STUB_LATENCY_MS', 0.0)
+    if latency_ms is None:
+        latency_ms = (entry or {}).get('latency_ms', 0.0)
+    jitter_ms = getattr(settings, 'LLM_STUB_LATENCY_JITTER_MS', 0.0)
+    if jitter_ms:
+        latency_ms += random.uniform(-jitter_ms, jitter_ms)
+    return max(0.0, latency_ms) / 1000
+
+
+# --- Respuestas sintéticas ---
+
+_WORD_RE = re.compile(r"\w{4,}")
+
+
+def _words(text: str) -> set:
+    # Raíces de 6 letras: "apostillar" coincide con "Apostilla".
+    return {word.lower()[:6] for word in _WORD_RE.findall(text or '')}
+
+
+def _last_match(pattern: str, text: str, default: str = '') -> str:
+    matches = re.findall(pattern, text, flags=re.DOTALL)
+    return matches[-1].strip() if matches else default
+
+
+def _stub_json(prompt: str) -> str:
+    """Clasificador: el tema disponible que comparte más palabras con la consulta, con confianza alta."""
+    query = _last_match(r"\*\*Consulta del Usuario:\*\*\n'(.*)'", prompt)
+    topics = [topic.strip() for topic in _last_match(r"\*\*Temas Disponibles:\*\*\n([^\n]*)", prompt).split(',') if topic.strip()]
+    query_words = _words(query)
+    topic = max(topics, key=lambda name: len(_words(name) & query_words), default="Información General")
+    if not _words(topic) & query_words and "Información General" in topics:
+        topic = "Información General"
+    result = {"tema": topic, "confianza": "alta"}
+    if "'pregunta'" in prompt:
+        result["pregunta"] = query
+    return json.dumps(result, ensure_ascii=False)
+
+
+def _stub_text(prompt: str) -> str:
+    """Reformulación: el mensaje tal cual. Respuesta: un extracto del contexto. Otro prompt: su comienzo."""
+    max_tokens = getattr(settings, 'LLM_STUB_RESPONSE_TOKENS', 120)
+    if prompt.rstrip().endswith("Pregunta:"):
+        return _last_match(r"Mensaje: (.*)\nPregunta:", prompt) or "¿Podrías darme más detalles?"
+    context = _last_match(r"Contexto:\n---\n(.*)\n---", prompt)
+    if context:
+        question = _last_match(r"Pregunta: '(.*?)'\n", prompt)
+        return extractive_answer(question, [part for part in context.split("\n\n") if part.strip()], max_tokens)
+    return truncate_to_tokens(prompt.strip(), max_tokens)
+
+
+def stub_response(prompt: str, options: dict) -> str:
+    if options.get('response_mime_type') == 'application/json':
+        return _stub_json(prompt)
+    return _stub_text(prompt)
+
+
+# --- Modelos ---
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Modelo local para 'replay' y 'stub'. Con fixtures_path responde lo grabado
+    para el mismo prompt; si no hay grabación (o en 'stub') responde
+    stub_response. Tras la latencia sintética, la respuesta se entrega por
+    palabras cuando el grafo transmite tokens.
+    """
+
+    model_name: str
+    temperature: float = 0.0
+    options: dict = Field(default_factory=dict)
+    fixtures_path: Optional[str] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.model_name, "temperature": self.temperature}
+
+    def _lookup(self, messages):
+        """Devuelve (contenido, uso grabado o None, fixture o None)."""
+        prompt = _prompt_text(messages)
+        if self.fixtures_path:
+            entry = get_fixture_store(self.fixtures_path).get(fixture_key(self.model_name, self.temperature, self.options, prompt))
+            if entry is not None:
+                _count("hits")
+                return entry['response'], entry.get('usage'), entry
+            _count("misses")
+            print(f"LLM: Prompt sin grabar en {self.fixtures_path} ({count_tokens(prompt)} tokens). Respuesta sintética.")
+        else:
+            _count("stubbed")
+        return stub_response(prompt, self.options), None, None
+
+    @staticmethod
+    def _message(content, usage, chunk=False):
+        message_class = AIMessageChunk if chunk else AIMessage
+        return message_class(content=content, usage_metadata=usage) if usage else message_class(content=content)
+
+    @staticmethod
+    def _pieces(content: str):
+        return re.findall(r"\S+\s*|\s+", content) or [content]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        content, usage, entry = self._lookup(messages)
+        time.sleep(_synthetic_latency(entry))
+        return ChatResult(generations=[ChatGeneration(message=self._message(content, usage))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        content, usage, entry = self._lookup(messages)
+        await asyncio.sleep(_synthetic_latency(entry))
+        return ChatResult(generations=[ChatGeneration(message=self._message(content, usage))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        content, usage, entry = self._lookup(messages)
+        time.sleep(_synthetic_latency(entry))
+        pieces = self._pieces(content)
+        for index, piece in enumerate(pieces):
+            # El uso de tokens va en el último fragmento, como en los proveedores reales.
+            chunk = ChatGenerationChunk(message=self._message(piece, usage if index == len(pieces) - 1 else None, chunk=True))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        content, usage, entry = self._lookup(messages)
+        await asyncio.sleep(_synthetic_latency(entry))
+        pieces = self._pieces(content)
+        for index, piece in enumerate(pieces):
+            chunk = ChatGenerationChunk(message=self._message(piece, usage if index == len(pieces) - 1 else None, chunk=True))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+
+class RecordingChatModel(BaseChatModel):
+    """
+    Envuelve al cliente real y graba cada llamada exitosa en fixtures_path.
+    Los errores se propagan sin grabar (los reintentos siguen en llm_gateway).
+    """
+
+    client: Any
+    model_name: str
+    temperature: float = 0.0
+    options: dict = Field(default_factory=dict)
+    fixtures_path: str
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.model_name, "temperature": self.temperature}
+
+    def _record(self, messages, result, started):
+        message = result.generations[0].message
+        prompt = _prompt_text(messages)
+        get_fixture_store(self.fixtures_path).append({
+            "key": fixture_key(self.model_name, self.temperature, self.options, prompt),
+            "model": self.model_name,
+            "temperature": self.temperature,
+            "options": {name: repr(value) for name, value in self.options.items()},
+            "prompt": prompt,
+            "response": message.content,
+            "usage": getattr(message, 'usage_metadata', None),
+            "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+            "recorded_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        })
+        _count("recorded")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        result = self.client._generate(messages, stop=stop, **kwargs)
+        self._record(messages, result, started)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        result = await self.client._agenerate(messages, stop=stop, **kwargs)
+        self._record(messages, result, started)
+        return result
+
+
+def get_replay_metrics() -> dict:
+    """Llamadas respondidas desde fixtures, sin grabación, sintéticas y grabadas en este proceso."""
+    with _lock:
+        return dict(_metrics)
+
+
+def reset_replay_metrics():
+    with _lock:
+        for name in _metrics:
+            _metrics[name] = 0
+        _stores.clear()
@@ -0,0 +1,96 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.ai_core.benchmarks.graph import CHANNELS, DEFAULT_SUITE, run_graph_benchmark
+from apps.ai_core.benchmarks.retrieval import compare_reports, load_suite
+
+PROVIDERS = ('stub', 'replay', 'record')
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el grafo de punta a punta (chat_view y handle_message) con un LLM local grabado o sintético, '
+        'separando el tiempo propio (ORM, recuperación, orquestación) de la espera del modelo.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--suite', default=DEFAULT_SUITE,
+                            help=f'Suite de conversaciones (nombre o ruta a suite.json). Por defecto: {DEFAULT_SUITE}.')
+        parser.add_argument('--channel', choices=CHANNELS, action='append', dest='channels',
+                            help='Canal a medir (repetible). Por defecto ambos.')
+        parser.add_argument('--provider', choices=PROVIDERS, default='stub', help=(
+            "'stub': respuestas sintéticas; 'replay': responde desde las fixtures grabadas; "
+            "'record': llama a Gemini y graba las fixtures (requiere GEMINI_API_KEY). Por defecto 'stub'."
+        ))
+        parser.add_argument('--fixtures', help='Archivo JSONL de fixtures del LLM. Por defecto LLM_FIXTURES_PATH.')
+        parser.add_argument('--latency-ms', type=float, default=0.0, help='Latencia sintética por llamada al LLM.')
+        parser.add_argument('--jitter-ms', type=float, default=0.0, help='Variación aleatoria (±) de la latencia.')
+        parser.add_argument('--recorded-latency', action='store_true',
+                            help="Con 'replay', espera la latencia grabada de cada llamada en lugar de --latency-ms.")
+        parser.add_argument('--repeat', type=int, default=1, help='Veces que se recorre el set de conversaciones.')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Conversaciones de Telegram atendidas a la vez.')
+        parser.add_argument('--backend', default='local',
+                            help="Backend de embeddings del índice de prueba. Por defecto 'local' (sin red).")
+        parser.add_argument('--output', help='Guarda el reporte JSON (con el detalle por turno) en este archivo.')
+        parser.add_argument('--compare', help='Reporte JSON anterior contra el que se muestran las diferencias.')
+        parser.add_argument('--keep-data', action='store_true',
+                            help='No borra los usuarios, tickets y checkpoints creados por el benchmark.')
+        parser.add_argument('--verbose', action='store_true', help='Muestra el log del grafo en cada turno.')
+
+    def handle(self, *args, **options):
+        try:
+            suite = load_suite(options['suite'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"No se pudo leer el suite de benchmark: {e}")
+
+        provider = options['provider']
+        if provider == 'replay' and options['fixtures'] and not os.path.exists(options['fixtures']):
+            raise CommandError(f"No existe el archivo de fixtures: {options['fixtures']}")
+        if provider == 'record':
+            self.stdout.write(self.style.WARNING('Modo record: cada llamada va a la API de Gemini y se graba.'))
+
+        report = run_graph_benchmark(
+            suite, channels=options['channels'] or list(CHANNELS), provider=provider,
+            fixtures_path=options['fixtures'],
+            latency_ms=None if options['recorded_latency'] else options['latency_ms'],
+            jitter_ms=options['jitter_ms'], repeat=options['repeat'], concurrency=options['concurrency'],
+            backend=options['backend'], verbose=options['verbose'], keep_data=options['keep_data'],
+        )
+
+        llm = report['llm']
+        self.stdout.write(
+            f"LLM '{provider}': {llm['hits']} respuestas grabadas, {llm['misses']} sin grabar, "
+            f"{llm['stubbed']} sintéticas, {llm['recorded']} grabadas ahora."
+        )
+        for channel, metrics in report['results'].items():
+            line = (
+                f"{channel:>8}: {metrics['turns']} turnos ({metrics['turns_per_second']:.1f}/s)  "
+                f"turno p50={metrics['turn_ms_p50']:.1f} ms  p95={metrics['turn_ms_p95']:.1f} ms  "
+                f"LLM={metrics['llm_ms_mean']:.1f} ms ({metrics['llm_calls_mean']:.1f} llamadas)  "
+                f"propio p50={metrics['overhead_ms_p50']:.1f} ms  p95={metrics['overhead_ms_p95']:.1f} ms"
+            )
+            if 'queries_mean' in metrics:
+                line += f"  consultas SQL={metrics['queries_mean']:.1f}"
+            self.stdout.write(self.style.ERROR(line) if metrics['errors'] else self.style.SUCCESS(line))
+            nodes = '  '.join(f"{node}={ms:.1f}" for node, ms in metrics['node_ms_p50'].items())
+            self.stdout.write(f"{'':>8}  nodos p50 (ms): {nodes}")
+            if metrics['errors']:
+                self.stdout.write(self.style.WARNING(f"{'':>8}  {metrics['errors']} turnos con error."))
+
+        if options['compare']:
+            with open(options['compare'], 'r', encoding='utf-8') as f:
+                deltas = compare_reports(json.load(f), report)
+            for channel, values in deltas.items():
+                changes = '  '.join(f"{name}={value:+g}" for name, value in values.items())
+                self.stdout.write(f"{channel:>8} vs anterior: {changes}")
+
+        if options['keep_data']:
+            self.stdout.write(f"Datos conservados: usuarios '{report['config']['data_prefix']}*'.")
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+            self.stdout.write(f"Reporte guardado en {options['output']}")
@@ -0,0 +1,95 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.ai_core.benchmarks.retrieval import (
+    DEFAULT_SUITE, compare_reports, evaluate_questions, load_suite, run_benchmark,
+)
+
+MODES = ('vector', 'hybrid')
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide la recuperación (recall@k, MRR, latencia p50/p95 y tamaño del índice) sobre un set de '
+        'preguntas versionado y un ChromaDB de prueba, y genera un reporte JSON comparable entre versiones.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('questions', nargs='?', help=(
+            'Opcional: archivo JSON con preguntas para evaluar contra el índice REAL: '
+            '[{"question": "...", "topic": "...", "expected_document_ids": ["3"]}]'
+        ))
+        parser.add_argument('--suite', default=DEFAULT_SUITE,
+                            help=f'Suite de fixtures (nombre o ruta a suite.json). Por defecto: {DEFAULT_SUITE}.')
+        parser.add_argument('--mode', choices=MODES, action='append', dest='modes',
+                            help='Modo de recuperación a medir (repetible). Por defecto ambos.')
+        parser.add_argument('--backend', default='local',
+                            help="Backend de embeddings del índice de prueba. Por defecto 'local' (sin red).")
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--chunk-overlap', type=int, default=None)
+        parser.add_argument('--threshold', type=float, default=None,
+                            help='Umbral de distancia a usar en lugar del del backend.')
+        parser.add_argument('--no-topic', action='store_true', help='Busca sin filtro de tema.')
+        parser.add_argument('--no-rerank', action='store_true', help='Desactiva el reranking local y el MMR.')
+        parser.add_argument('--repeat', type=int, default=3, help='Ejecuciones por pregunta para medir latencia.')
+        parser.add_argument('--output', help='Guarda el reporte JSON en este archivo.')
+        parser.add_argument('--compare', help='Reporte JSON anterior contra el que se muestran las diferencias.')
+        parser.add_argument('--verbose', action='store_true', help='Muestra el log de cada búsqueda.')
+
+    def handle(self, *args, **options):
+        modes = options['modes'] or list(MODES)
+
+        if options['questions']:
+            report = self._run_live(options['questions'], modes, options)
+        else:
+            try:
+                suite = load_suite(options['suite'])
+            except (OSError, ValueError) as e:
+                raise CommandError(f"No se pudo leer el suite de benchmark: {e}")
+            report = run_benchmark(
+                suite, modes=modes, backend=options['backend'],
+                chunk_size=options['chunk_size'], chunk_overlap=options['chunk_overlap'],
+                threshold=options['threshold'], use_topic=not options['no_topic'],
+                repeat=options['repeat'], verbose=options['verbose'], rerank=not options['no_rerank'],
+            )
+            index = report['index']
+            self.stdout.write(
+                f"Índice de prueba: {index['documents']} documentos, {index['chunks']} fragmentos, "
+                f"{index['size_bytes'] / 1024:.0f} KiB ({report['config']['embedding_backend']})."
+            )
+
+        for mode, metrics in report['results'].items():
+            self.stdout.write(self.style.SUCCESS(
+                f"{mode:>7}: recall@1={metrics['recall@1']:.2%}  recall@5={metrics['recall@5']:.2%}  "
+                f"MRR={metrics['mrr']:.3f}  evidencia={metrics['evidence_recall']:.2%}  "
+                f"p50={metrics['latency_ms_p50']:.1f} ms  p95={metrics['latency_ms_p95']:.1f} ms"
+            ))
+
+        if options['compare']:
+            with open(options['compare'], 'r', encoding='utf-8') as f:
+                deltas = compare_reports(json.load(f), report)
+            for mode, values in deltas.items():
+                changes = '  '.join(f"{name}={value:+g}" for name, value in values.items())
+                self.stdout.write(f"{mode:>7} vs anterior: {changes}")
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+            self.stdout.write(f"Reporte guardado en {options['output']}")
+
+    def _run_live(self, questions_path, modes, options):
+        """Evalúa un set de preguntas propio contra el índice configurado en settings."""
+        try:
+            with open(questions_path, 'r', encoding='utf-8') as f:
+                questions = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"No se pudo leer el set de preguntas: {e}")
+        return {
+            'suite': questions_path,
+            'config': {'use_topic_filter': not options['no_topic'], 'repeat': options['repeat']},
+            'results': {
+                mode: evaluate_questions(questions, mode, use_topic=not options['no_topic'], repeat=options['repeat'])
+                for mode in modes
+            },
+        }
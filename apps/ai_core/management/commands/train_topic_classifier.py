@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from apps.ai_core.topic_classifier import (
+    collect_training_examples, evaluate_classifier, save_classifier, train_classifier,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Entrena el clasificador de temas local (centroide más cercano) con los nombres de los temas, '
+        'los fragmentos de la base de conocimiento y las consultas de tickets que el LLM ya clasificó.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-chunks', action='store_true', help='No usa los fragmentos de la base de conocimiento.')
+        parser.add_argument('--no-history', action='store_true', help='No usa las clasificaciones anteriores del LLM.')
+        parser.add_argument('--holdout', type=int, default=5,
+                            help='Reserva 1 de cada N consultas históricas para medir la precisión (0 para no evaluar).')
+        parser.add_argument('--output', help='Ruta del modelo. Por defecto TOPIC_CLASSIFIER_PATH o junto al índice.')
+        parser.add_argument('--dry-run', action='store_true', help='Entrena y evalúa sin guardar el modelo.')
+
+    def handle(self, *args, **options):
+        base = collect_training_examples(include_chunks=not options['no_chunks'], include_decisions=False)
+        history = [] if options['no_history'] else collect_training_examples(include_names=False, include_chunks=False)
+        self.stdout.write(f"Ejemplos: {len(base)} de temas y fragmentos, {len(history)} de tickets anteriores.")
+
+        holdout = options['holdout']
+        if holdout and len(history) >= holdout:
+            train, test = [], []
+            for i, example in enumerate(history):
+                (test if i % holdout == 0 else train).append(example)
+            metrics = evaluate_classifier(train_classifier(base + train), test)
+            self.stdout.write(
+                f"Evaluación sobre {metrics['examples']} consultas reservadas: precisión={metrics['accuracy']:.2%}, "
+                f"camino rápido={metrics['fast_path_rate']:.2%} (precisión {metrics['fast_path_accuracy']:.2%})."
+            )
+        elif holdout:
+            self.stdout.write("No hay suficientes consultas históricas para evaluar; se entrena igual.")
+
+        classifier = train_classifier(base + history)
+        empty = [label for label, count in classifier.counts.items() if count <= 1]
+        if empty:
+            self.stdout.write(self.style.WARNING(f"Temas solo con su nombre como ejemplo: {', '.join(empty)}"))
+        if options['dry_run']:
+            self.stdout.write("Modo --dry-run: no se guardó el modelo.")
+            return
+        path = save_classifier(classifier, options['output'])
+        self.stdout.write(self.style.SUCCESS(f"Clasificador guardado en {path} ({len(classifier.labels)} temas)."))
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.4 on 2026-10-17 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('tickets', '0006_knowledgedocument_duplicado_de_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerCacheDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(unique=True, verbose_name='Fecha')),
+                ('aciertos', models.PositiveIntegerField(default=0, verbose_name='Aciertos')),
+                ('fallos', models.PositiveIntegerField(default=0, verbose_name='Fallos')),
+            ],
+            options={
+                'verbose_name': 'Estadística Diaria de la Caché',
+                'verbose_name_plural': 'Estadísticas Diarias de la Caché',
+                'ordering': ['-fecha'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AnswerCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tema', models.CharField(blank=True, db_index=True, default='', max_length=255, verbose_name='Tema')),
+                ('pregunta', models.TextField(verbose_name='Pregunta Reformulada')),
+                ('embedding', models.JSONField(verbose_name='Embedding de la Pregunta')),
+                ('modelo_embedding', models.CharField(max_length=100, verbose_name='Modelo de Embedding')),
+                ('respuesta', models.TextField(verbose_name='Respuesta')),
+                ('firma_documentos', models.CharField(help_text='Hash de los documentos de soporte y su contenido al momento de generar la respuesta.', max_length=64, verbose_name='Firma de los Documentos')),
+                ('aciertos', models.PositiveIntegerField(default=0, verbose_name='Aciertos')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Creación')),
+                ('ultimo_uso', models.DateTimeField(auto_now=True, verbose_name='Último Uso')),
+                ('documentos', models.ManyToManyField(blank=True, related_name='respuestas_cacheadas', to='tickets.knowledgedocument', verbose_name='Documentos de Soporte')),
+            ],
+            options={
+                'verbose_name': 'Respuesta en Caché',
+                'verbose_name_plural': 'Respuestas en Caché',
+                'ordering': ['-ultimo_uso'],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-17 17:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_core', '0001_initial'),
+        ('tickets', '0006_knowledgedocument_duplicado_de_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicDecision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mensaje', models.TextField(verbose_name='Mensaje del Usuario')),
+                ('tema', models.CharField(max_length=255, verbose_name='Tema Elegido')),
+                ('confianza', models.CharField(blank=True, max_length=10, verbose_name='Confianza')),
+                ('origen', models.CharField(choices=[('LOCAL', 'Clasificador Local'), ('LLM', 'LLM')], max_length=10, verbose_name='Origen')),
+                ('tema_local', models.CharField(blank=True, max_length=255, null=True, verbose_name='Tema del Clasificador Local')),
+                ('margen_local', models.FloatField(blank=True, null=True, verbose_name='Margen del Clasificador Local')),
+                ('coincide', models.BooleanField(blank=True, null=True, verbose_name='Coincide con el LLM')),
+                ('fecha', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Fecha')),
+                ('ticket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='decisiones_tema', to='tickets.ticket', verbose_name='Ticket')),
+            ],
+            options={
+                'verbose_name': 'Decisión de Tema',
+                'verbose_name_plural': 'Decisiones de Tema',
+                'ordering': ['-fecha'],
+            },
+        ),
+    ]
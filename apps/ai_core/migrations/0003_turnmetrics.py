@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-17 17:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_core', '0002_topicdecision'),
+        ('tickets', '0006_knowledgedocument_duplicado_de_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TurnMetrics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('canal', models.CharField(blank=True, max_length=10, verbose_name='Canal')),
+                ('fecha', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Fecha')),
+                ('duracion_ms', models.FloatField(verbose_name='Duración (ms)')),
+                ('nodos', models.JSONField(default=dict, verbose_name='Tiempo por Nodo (ms)')),
+                ('ruta', models.JSONField(default=list, verbose_name='Ruta')),
+                ('llamadas_llm', models.PositiveIntegerField(default=0, verbose_name='Llamadas al LLM')),
+                ('tokens_prompt', models.PositiveIntegerField(default=0, verbose_name='Tokens de Prompt')),
+                ('tokens_respuesta', models.PositiveIntegerField(default=0, verbose_name='Tokens de Respuesta')),
+                ('tokens_estimados', models.BooleanField(default=False, help_text='El proveedor no informó el uso y se estimó localmente.', verbose_name='Tokens Estimados')),
+                ('costo_usd', models.FloatField(default=0.0, verbose_name='Costo Estimado (USD)')),
+                ('fragmentos_recuperados', models.PositiveIntegerField(default=0, verbose_name='Fragmentos Recuperados')),
+                ('error', models.CharField(blank=True, max_length=500, verbose_name='Error')),
+                ('ticket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='metricas_turnos', to='tickets.ticket', verbose_name='Ticket')),
+            ],
+            options={
+                'verbose_name': 'Métricas de Turno',
+                'verbose_name_plural': 'Métricas de Turnos',
+                'ordering': ['-fecha'],
+            },
+        ),
+    ]
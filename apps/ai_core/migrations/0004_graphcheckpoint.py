@@ -0,0 +1,54 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_core', '0003_turnmetrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GraphCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('thread_id', models.CharField(max_length=100, verbose_name='Hilo')),
+                ('checkpoint_ns', models.CharField(blank=True, default='', max_length=255, verbose_name='Espacio de Nombres')),
+                ('checkpoint_id', models.CharField(max_length=64, verbose_name='ID del Checkpoint')),
+                ('parent_checkpoint_id', models.CharField(blank=True, max_length=64, null=True, verbose_name='Checkpoint Anterior')),
+                ('tipo', models.CharField(max_length=32, verbose_name='Formato')),
+                ('checkpoint', models.BinaryField(verbose_name='Checkpoint')),
+                ('tipo_metadatos', models.CharField(max_length=32, verbose_name='Formato de los Metadatos')),
+                ('metadatos', models.BinaryField(verbose_name='Metadatos')),
+                ('fecha', models.DateTimeField(auto_now_add=True, verbose_name='Fecha')),
+            ],
+            options={
+                'verbose_name': 'Checkpoint del Grafo',
+                'verbose_name_plural': 'Checkpoints del Grafo',
+                'ordering': ['-checkpoint_id'],
+                'constraints': [models.UniqueConstraint(fields=('thread_id', 'checkpoint_ns', 'checkpoint_id'), name='unique_graph_checkpoint')],
+            },
+        ),
+        migrations.CreateModel(
+            name='GraphCheckpointWrite',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('thread_id', models.CharField(max_length=100, verbose_name='Hilo')),
+                ('checkpoint_ns', models.CharField(blank=True, default='', max_length=255, verbose_name='Espacio de Nombres')),
+                ('checkpoint_id', models.CharField(max_length=64, verbose_name='ID del Checkpoint')),
+                ('task_id', models.CharField(max_length=64, verbose_name='Tarea')),
+                ('task_path', models.CharField(blank=True, default='', max_length=255, verbose_name='Ruta de la Tarea')),
+                ('idx', models.IntegerField(verbose_name='Índice')),
+                ('canal', models.CharField(max_length=255, verbose_name='Canal')),
+                ('tipo', models.CharField(max_length=32, verbose_name='Formato')),
+                ('valor', models.BinaryField(verbose_name='Valor')),
+            ],
+            options={
+                'verbose_name': 'Escritura de Checkpoint',
+                'verbose_name_plural': 'Escrituras de Checkpoints',
+                'constraints': [models.UniqueConstraint(fields=('thread_id', 'checkpoint_ns', 'checkpoint_id', 'task_id', 'idx'), name='unique_graph_checkpoint_write')],
+            },
+        ),
+    ]
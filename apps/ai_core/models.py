@@ -1,3 +1,176 @@
 from django.db import models
 
-# Create your models here.
+from apps.tickets.models import KnowledgeDocument, Ticket
+
+
+# ==============================================================================
+# Caché semántica de respuestas
+# ==============================================================================
+class AnswerCacheEntry(models.Model):
+    """
+    Respuesta final de 'generate_response' guardada junto con el embedding de la
+    pregunta reformulada, para responder preguntas equivalentes sin llamar al LLM.
+    """
+    tema = models.CharField(max_length=255, blank=True, default='', db_index=True, verbose_name="Tema")
+    pregunta = models.TextField(verbose_name="Pregunta Reformulada")
+    embedding = models.JSONField(verbose_name="Embedding de la Pregunta")
+    modelo_embedding = models.CharField(max_length=100, verbose_name="Modelo de Embedding")
+    respuesta = models.TextField(verbose_name="Respuesta")
+    documentos = models.ManyToManyField(
+        KnowledgeDocument, blank=True, related_name="respuestas_cacheadas", verbose_name="Documentos de Soporte"
+    )
+    firma_documentos = models.CharField(
+        max_length=64, verbose_name="Firma de los Documentos",
+        help_text="Hash de los documentos de soporte y su contenido al momento de generar la respuesta."
+    )
+    aciertos = models.PositiveIntegerField(default=0, verbose_name="Aciertos")
+    fecha_creacion = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Creación")
+    ultimo_uso = models.DateTimeField(auto_now=True, verbose_name="Último Uso")
+
+    def __str__(self):
+        return f"[{self.tema}] {self.pregunta[:60]}"
+
+    class Meta:
+        verbose_name = "Respuesta en Caché"
+        verbose_name_plural = "Respuestas en Caché"
+        ordering = ['-ultimo_uso']
+
+
+class AnswerCacheDailyStats(models.Model):
+    """Consultas a la caché de respuestas por día, para el tablero."""
+    fecha = models.DateField(unique=True, verbose_name="Fecha")
+    aciertos = models.PositiveIntegerField(default=0, verbose_name="Aciertos")
+    fallos = models.PositiveIntegerField(default=0, verbose_name="Fallos")
+
+    @property
+    def tasa_aciertos(self):
+        total = self.aciertos + self.fallos
+        return self.aciertos / total if total else 0.0
+
+    def __str__(self):
+        return f"{self.fecha}: {self.aciertos}/{self.aciertos + self.fallos}"
+
+    class Meta:
+        verbose_name = "Estadística Diaria de la Caché"
+        verbose_name_plural = "Estadísticas Diarias de la Caché"
+        ordering = ['-fecha']
+
+
+# ==============================================================================
+# Clasificación de temas (camino rápido local vs. LLM)
+# ==============================================================================
+class TopicDecision(models.Model):
+    """
+    Cada clasificación de tema de un turno: quién la tomó (el clasificador local
+    o el LLM) y, cuando decidió el LLM, qué había propuesto el clasificador local.
+    Las del LLM con confianza alta sirven además para reentrenar el clasificador.
+    """
+    class Origen(models.TextChoices):
+        LOCAL = 'LOCAL', 'Clasificador Local'
+        LLM = 'LLM', 'LLM'
+
+    ticket = models.ForeignKey(
+        Ticket, on_delete=models.SET_NULL, null=True, blank=True, related_name="decisiones_tema", verbose_name="Ticket"
+    )
+    mensaje = models.TextField(verbose_name="Mensaje del Usuario")
+    tema = models.CharField(max_length=255, verbose_name="Tema Elegido")
+    confianza = models.CharField(max_length=10, blank=True, verbose_name="Confianza")
+    origen = models.CharField(max_length=10, choices=Origen.choices, verbose_name="Origen")
+    tema_local = models.CharField(max_length=255, null=True, blank=True, verbose_name="Tema del Clasificador Local")
+    margen_local = models.FloatField(null=True, blank=True, verbose_name="Margen del Clasificador Local")
+    coincide = models.BooleanField(null=True, blank=True, verbose_name="Coincide con el LLM")
+    fecha = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Fecha")
+
+    def __str__(self):
+        return f"[{self.get_origen_display()}] {self.tema} ({self.confianza})"
+
+    class Meta:
+        verbose_name = "Decisión de Tema"
+        verbose_name_plural = "Decisiones de Tema"
+        ordering = ['-fecha']
+
+
+# ==============================================================================
+# Métricas por turno del grafo
+# ==============================================================================
+class TurnMetrics(models.Model):
+    """
+    Una fila por turno del grafo: tiempo total y por nodo (ms), ruta tomada por
+    los routers, uso del LLM y fragmentos recuperados.
+    """
+    ticket = models.ForeignKey(
+        Ticket, on_delete=models.SET_NULL, null=True, blank=True, related_name="metricas_turnos", verbose_name="Ticket"
+    )
+    canal = models.CharField(max_length=10, blank=True, verbose_name="Canal")
+    fecha = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Fecha")
+    duracion_ms = models.FloatField(verbose_name="Duración (ms)")
+    nodos = models.JSONField(default=dict, verbose_name="Tiempo por Nodo (ms)")
+    ruta = models.JSONField(default=list, verbose_name="Ruta")
+    llamadas_llm = models.PositiveIntegerField(default=0, verbose_name="Llamadas al LLM")
+    tokens_prompt = models.PositiveIntegerField(default=0, verbose_name="Tokens de Prompt")
+    tokens_respuesta = models.PositiveIntegerField(default=0, verbose_name="Tokens de Respuesta")
+    tokens_estimados = models.BooleanField(default=False, verbose_name="Tokens Estimados",
+                                           help_text="El proveedor no informó el uso y se estimó localmente.")
+    costo_usd = models.FloatField(default=0.0, verbose_name="Costo Estimado (USD)")
+    fragmentos_recuperados = models.PositiveIntegerField(default=0, verbose_name="Fragmentos Recuperados")
+    error = models.CharField(max_length=500, blank=True, verbose_name="Error")
+
+    def __str__(self):
+        return f"Turno {self.fecha:%Y-%m-%d %H:%M} ({self.duracion_ms:.0f} ms)"
+
+    class Meta:
+        verbose_name = "Métricas de Turno"
+        verbose_name_plural = "Métricas de Turnos"
+        ordering = ['-fecha']
+
+
+# ==============================================================================
+# Checkpoints del grafo (estado de la conversación por ticket)
+# ==============================================================================
+class GraphCheckpoint(models.Model):
+    """
+    Checkpoint de LangGraph serializado (ver checkpointer.DjangoCheckpointSaver).
+    El hilo de cada ticket es 'ticket-<id>'.
+    """
+    thread_id = models.CharField(max_length=100, verbose_name="Hilo")
+    checkpoint_ns = models.CharField(max_length=255, blank=True, default='', verbose_name="Espacio de Nombres")
+    checkpoint_id = models.CharField(max_length=64, verbose_name="ID del Checkpoint")
+    parent_checkpoint_id = models.CharField(max_length=64, null=True, blank=True, verbose_name="Checkpoint Anterior")
+    tipo = models.CharField(max_length=32, verbose_name="Formato")
+    checkpoint = models.BinaryField(verbose_name="Checkpoint")
+    tipo_metadatos = models.CharField(max_length=32, verbose_name="Formato de los Metadatos")
+    metadatos = models.BinaryField(verbose_name="Metadatos")
+    fecha = models.DateTimeField(auto_now_add=True, verbose_name="Fecha")
+
+    def __str__(self):
+        return f"{self.thread_id} · {self.checkpoint_id}"
+
+    class Meta:
+        verbose_name = "Checkpoint del Grafo"
+        verbose_name_plural = "Checkpoints del Grafo"
+        ordering = ['-checkpoint_id']
+        constraints = [
+            models.UniqueConstraint(fields=['thread_id', 'checkpoint_ns', 'checkpoint_id'], name='unique_graph_checkpoint'),
+        ]
+
+
+class GraphCheckpointWrite(models.Model):
+    """Escrituras pendientes de un checkpoint (resultados de nodos aún no consolidados)."""
+    thread_id = models.CharField(max_length=100, verbose_name="Hilo")
+    checkpoint_ns = models.CharField(max_length=255, blank=True, default='', verbose_name="Espacio de Nombres")
+    checkpoint_id = models.CharField(max_length=64, verbose_name="ID del Checkpoint")
+    task_id = models.CharField(max_length=64, verbose_name="Tarea")
+    task_path = models.CharField(max_length=255, blank=True, default='', verbose_name="Ruta de la Tarea")
+    idx = models.IntegerField(verbose_name="Índice")
+    canal = models.CharField(max_length=255, verbose_name="Canal")
+    tipo = models.CharField(max_length=32, verbose_name="Formato")
+    valor = models.BinaryField(verbose_name="Valor")
+
+    class Meta:
+        verbose_name = "Escritura de Checkpoint"
+        verbose_name_plural = "Escrituras de Checkpoints"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['thread_id', 'checkpoint_ns', 'checkpoint_id', 'task_id', 'idx'], name='unique_graph_checkpoint_write'
+            ),
+        ]
@@ -1,10 +1,9 @@
-import os
 from apps.tickets.models import Ticket, LogInteraccion
 from .tools.knowledge_base import search_knowledge_base_vector
+from .context_packing import extractive_answer, pack_context
+from .conversation_summary import load_conversation
 from apps.tasks.tasks import notify_technician_task
-from langchain_google_genai import ChatGoogleGenerativeAI
-
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+from .llm_gateway import LLMUnavailableError, invoke_llm, record_degraded
 
 def process_user_request(ticket_id, mensaje_actual):
     """
@@ -17,15 +16,21 @@ def process_user_request(ticket_id, mensaje_actual):
         print(f"ORQUESTADOR: Error - No se encontró el ticket #{ticket_id}")
         return
 
-    # 1. Obtenemos el historial completo de la conversación para darle memoria al bot.
-    conversation_logs = ticket.logs.all().order_by('fecha_creacion')
-    chat_history = "\n".join(
-        [f"{log.get_emisor_display()}: {log.mensaje}" for log in conversation_logs]
-    )
+    # 1. Obtenemos la memoria de la conversación: el resumen del ticket y los últimos mensajes.
+    summary, recent_logs = load_conversation(ticket)
+    turns = [(log.get_emisor_display(), log.mensaje) for log in recent_logs]
+    # El mensaje actual va aparte en el prompt, con la máxima prioridad.
+    if turns and turns[-1][1] == mensaje_actual:
+        turns = turns[:-1]
 
     # 2. Buscamos en la base de conocimiento usando el último mensaje.
     relevant_docs = search_knowledge_base_vector(mensaje_actual)
-    context = "\n\n".join([doc.page_content for doc in relevant_docs]) if relevant_docs else "No se encontró información relevante en la base de conocimiento."
+
+    # El prompt se ajusta al presupuesto de tokens: último mensaje, pasajes,
+    # turnos recientes y el resumen de los anteriores, en ese orden de prioridad.
+    packed = pack_context(mensaje_actual, passages=[doc.page_content for doc in relevant_docs], turns=turns, summary=summary)
+    context = packed.passages_text(empty="No se encontró información relevante en la base de conocimiento.")
+    chat_history = packed.history_text()
 
     # 3. Creamos el prompt conversacional que incluye el historial.
     prompt = (
@@ -43,16 +48,12 @@ def process_user_request(ticket_id, mensaje_actual):
         "--- INICIO DEL HISTORIAL DE LA CONVERSACIÓN ---\n"
         "{chat_history}\n"
         "--- FIN DEL HISTORIAL ---\n\n"
+        "Último mensaje del usuario: {question}\n\n"
         "Tu tarea es generar la siguiente respuesta del 'Sistema':"
-    ).format(context=context, chat_history=chat_history)
+    ).format(context=context, chat_history=chat_history, question=packed.question)
 
     try:
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash",
-            temperature=0.3,
-            google_api_key=GEMINI_API_KEY
-        )
-        response = llm.invoke(prompt)
+        response = invoke_llm(prompt, temperature=0.3)
         respuesta_ia = response.content if hasattr(response, "content") else str(response)
 
         LogInteraccion.objects.create(
@@ -70,6 +71,21 @@ def process_user_request(ticket_id, mensaje_actual):
              ticket.estado = Ticket.Estado.RESUELTO_BOT
              ticket.save()
 
+    except LLMUnavailableError as e:
+        # Modo degradado: si hay pasajes relevantes se responde con ellos en
+        # lugar de escalar; el ticket sigue abierto por si el usuario insiste.
+        if not relevant_docs:
+            escalate_to_technician(ticket, "Error en la API de IA.")
+            return
+        print(f"ORQUESTADOR: LLM no disponible ({e}). Respuesta extractiva para el ticket #{ticket.id}.")
+        record_degraded()
+        excerpt = extractive_answer(mensaje_actual, [doc.page_content for doc in relevant_docs])
+        LogInteraccion.objects.create(
+            ticket=ticket,
+            mensaje=f"En este momento el asistente tiene demoras. Esto es lo que encontré en la base de conocimiento:\n\n{excerpt}",
+            emisor=LogInteraccion.Emisor.SISTEMA
+        )
+
     except Exception as e:
         print(f"ORQUESTADOR: Error al llamar a Gemini: {e}")
         escalate_to_technician(ticket, "Error en la API de IA.")
@@ -0,0 +1,100 @@
+# apps/ai_core/streaming.py
+
+import time
+
+from .graph import app as langgraph_app, turn_kwargs
+
+# Nodos cuyos tokens se muestran al usuario a medida que llegan. Los demás
+# también llaman al LLM (clasificación, reformulación), pero su salida es interna.
+STREAMED_NODES = {"generate_response"}
+
+
+def stream_graph_response(initial_state: dict):
+    """
+    Ejecuta el grafo y produce eventos a medida que avanza:
+
+    - ("token", texto): fragmento de la respuesta que se está generando.
+    - ("final", estado): estado final del grafo, al terminar.
+
+    Las respuestas que no pasan por el LLM (caché, aclaración, escalada) no
+    producen tokens: llegan completas en 'final_response' del estado final.
+    """
+    final_state = {}
+    for mode, chunk in langgraph_app.stream(initial_state, stream_mode=["messages", "values"],
+                                            **turn_kwargs(initial_state["ticket_id"])):
+        if mode == "values":
+            final_state = chunk
+            continue
+        message, metadata = chunk
+        if metadata.get("langgraph_node") in STREAMED_NODES and message.content:
+            yield "token", message.content
+    yield "final", final_state
+
+
+async def astream_graph_response(initial_state: dict):
+    """Versión asíncrona de stream_graph_response: usa los nodos async del grafo."""
+    final_state = {}
+    async for mode, chunk in langgraph_app.astream(initial_state, stream_mode=["messages", "values"],
+                                                   **turn_kwargs(initial_state["ticket_id"])):
+        if mode == "values":
+            final_state = chunk
+            continue
+        message, metadata = chunk
+        if metadata.get("langgraph_node") in STREAMED_NODES and message.content:
+            yield "token", message.content
+    yield "final", final_state
+
+
+class ThrottledMessageEditor:
+    """
+    Acumula tokens y publica el texto parcial como mucho cada 'interval'
+    segundos. 'publish(text)' lo provee cada canal (p. ej. editar un mensaje
+    de Telegram, que limita la frecuencia de ediciones).
+    """
+
+    def __init__(self, publish, interval: float = 1.0, clock=None):
+        self.publish = publish
+        self.interval = interval
+        self.clock = clock or time.monotonic
+        self.text = ""
+        self.published_text = ""
+        self._last_publish = None
+
+    def add(self, token: str):
+        self.text += token
+        now = self.clock()
+        if self._last_publish is None or now - self._last_publish >= self.interval:
+            self._publish(now)
+
+    def _publish(self, now):
+        if self.text.strip() and self.text != self.published_text:
+            self.publish(self.text)
+            self.published_text = self.text
+            self._last_publish = now
+
+    def finish(self, final_text: str = None):
+        """Publica el texto definitivo (si difiere del último publicado)."""
+        if final_text is not None:
+            self.text = final_text
+        self._publish(self.clock())
+
+
+class AsyncThrottledMessageEditor(ThrottledMessageEditor):
+    """Igual que ThrottledMessageEditor, pero 'publish(text)' es una corrutina."""
+
+    async def add(self, token: str):
+        self.text += token
+        now = self.clock()
+        if self._last_publish is None or now - self._last_publish >= self.interval:
+            await self._publish(now)
+
+    async def _publish(self, now):
+        if self.text.strip() and self.text != self.published_text:
+            await self.publish(self.text)
+            self.published_text = self.text
+            self._last_publish = now
+
+    async def finish(self, final_text: str = None):
+        if final_text is not None:
+            self.text = final_text
+        await self._publish(self.clock())
@@ -1,3 +1,660 @@
-from django.test import TestCase
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from langchain_core.documents import Document
+from langgraph.checkpoint.base import ERROR, empty_checkpoint
+
+from apps.tickets.models import KnowledgeDocument
+from . import answer_cache, instrumentation, llm_gateway
+from .checkpointer import DjangoCheckpointSaver
+from .context_packing import count_tokens, pack_context, truncate_to_tokens
+from .graph import _keeps_locked_topic, ask_topic_clarification
+from .llm_gateway import CircuitBreaker
+from .models import AnswerCacheDailyStats, AnswerCacheEntry, GraphCheckpoint, GraphCheckpointWrite, TurnMetrics
+from .tools import embedding_cache, knowledge_base
+from .tools.embedding_cache import CachedEmbeddings
+from .tools.lexical_index import LexicalIndex, tokenize
+from .tools.reranking import mmr_select, overlap, rerank_passages, score_passages
+from .topics import build_search_scopes
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('modelo', threshold=2, cooldown=10, clock=self.clock)
+
+    def trip(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+    def test_opens_after_threshold_and_rejects_during_cooldown(self):
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertIsNotNone(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.clock.now = 9.9
+        self.assertIsNone(self.breaker.allow())
+        self.assertEqual(self.breaker.snapshot()['trips'], 1)
+
+    def test_half_open_allows_a_single_probe_and_success_closes(self):
+        self.trip()
+        self.clock.now = 10
+        probe = self.breaker.allow()
+        self.assertIsNotNone(probe)
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertIsNone(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.snapshot(), {'state': CircuitBreaker.CLOSED, 'failures': 0, 'trips': 1})
+        self.assertIsNotNone(self.breaker.allow())
+
+    def test_probe_failure_reopens(self):
+        self.trip()
+        self.clock.now = 10
+        self.assertIsNotNone(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertIsNone(self.breaker.allow())
+        self.clock.now = 20
+        self.assertIsNotNone(self.breaker.allow())
+
+    def test_only_the_probe_owner_can_cancel_it(self):
+        self.trip()
+        self.clock.now = 10
+        probe = self.breaker.allow()
+        self.breaker.cancel(object())
+        self.breaker.cancel(None)
+        self.assertIsNone(self.breaker.allow())
+        self.breaker.cancel(probe)
+        self.assertIsNotNone(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+
+class InvokeLLMBreakerTests(SimpleTestCase):
+    def setUp(self):
+        llm_gateway.reset_llm_gateway()
+        self.addCleanup(llm_gateway.reset_llm_gateway)
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('modelo', threshold=1, cooldown=10, clock=self.clock)
+        llm_gateway._breakers['modelo'] = self.breaker
+        self.breaker.record_failure()
+        self.clock.now = 10
+
+    def test_interrupted_probe_is_released(self):
+        llm = mock.Mock()
+        llm.invoke.side_effect = KeyboardInterrupt
+        with mock.patch.object(llm_gateway, 'get_chat_model', return_value=llm):
+            with self.assertRaises(KeyboardInterrupt):
+                llm_gateway.invoke_llm('hola', model='modelo')
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertIsNotNone(self.breaker.allow())
+
+    def test_cancelled_async_probe_is_released(self):
+        started = asyncio.Event()
+
+        async def never_answers(prompt):
+            started.set()
+            await asyncio.sleep(60)
+
+        llm = mock.Mock()
+        llm.ainvoke = never_answers
+
+        async def run():
+            task = asyncio.create_task(llm_gateway.ainvoke_llm('hola', model='modelo'))
+            await started.wait()
+            self.assertIsNone(self.breaker.allow())
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with mock.patch.object(llm_gateway, 'get_chat_model', return_value=llm):
+            asyncio.run(run())
+        self.assertIsNotNone(self.breaker.allow())
+
+    def test_non_retryable_probe_error_releases_the_probe_without_closing(self):
+        llm = mock.Mock()
+        llm.invoke.side_effect = ValueError("prompt inválido")
+        with mock.patch.object(llm_gateway, 'get_chat_model', return_value=llm):
+            with self.assertRaises(ValueError):
+                llm_gateway.invoke_llm('hola', model='modelo')
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertIsNotNone(self.breaker.allow())
+
+    def test_probe_success_closes_the_circuit(self):
+        llm = mock.Mock()
+        llm.invoke.return_value = 'respuesta'
+        with mock.patch.object(llm_gateway, 'get_chat_model', return_value=llm):
+            self.assertEqual(llm_gateway.invoke_llm('hola', model='modelo'), 'respuesta')
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+def make_checkpoint(**channel_values):
+    checkpoint = empty_checkpoint()
+    checkpoint['channel_values'] = channel_values
+    return checkpoint
+
+
+class DjangoCheckpointSaverTests(TestCase):
+    def setUp(self):
+        self.saver = DjangoCheckpointSaver()
+        self.thread = {"configurable": {"thread_id": "ticket-1", "checkpoint_ns": ""}}
+
+    def put(self, config, step, **channel_values):
+        return self.saver.put(config, make_checkpoint(**channel_values), {"source": "loop", "step": step}, {})
+
+    def test_put_and_get_tuple_round_trip(self):
+        self.assertIsNone(self.saver.get_tuple(self.thread))
+        first = self.put(self.thread, 0, current_topic="Apostilla de la Haya", topic_locked=True)
+        second = self.put(first, 1, current_topic="Sección Noticias", topic_locked=False)
+
+        latest = self.saver.get_tuple(self.thread)
+        self.assertEqual(latest.config, second)
+        self.assertEqual(latest.parent_config, first)
+        self.assertEqual(latest.checkpoint['channel_values'], {"current_topic": "Sección Noticias", "topic_locked": False})
+        self.assertEqual(latest.metadata["step"], 1)
+
+        earlier = self.saver.get_tuple(first)
+        self.assertEqual(earlier.checkpoint['channel_values']["current_topic"], "Apostilla de la Haya")
+        self.assertIsNone(earlier.parent_config)
+
+    def test_put_writes_are_returned_as_pending_writes(self):
+        config = self.put(self.thread, 0)
+        self.saver.put_writes(config, [("rewritten_query", "¿Cómo apostillo?"), ("topic_locked", True)], "tarea-1")
+        # Una escritura normal repetida no pisa la anterior; un error sí.
+        self.saver.put_writes(config, [("rewritten_query", "otra")], "tarea-1")
+        self.saver.put_writes(config, [(ERROR, "primero")], "tarea-2")
+        self.saver.put_writes(config, [(ERROR, "segundo")], "tarea-2")
+
+        pending = self.saver.get_tuple(config).pending_writes
+        self.assertEqual(pending, [
+            ("tarea-1", "rewritten_query", "¿Cómo apostillo?"),
+            ("tarea-1", "topic_locked", True),
+            ("tarea-2", ERROR, "segundo"),
+        ])
+
+    @override_settings(GRAPH_CHECKPOINTS_PER_THREAD=5)
+    def test_list_filters_and_orders_newest_first(self):
+        configs, config = [], self.thread
+        for step in range(3):
+            config = self.put(config, step, final_response=f"respuesta {step}")
+            configs.append(config)
+        self.put({"configurable": {"thread_id": "ticket-2", "checkpoint_ns": ""}}, 0)
+
+        listed = list(self.saver.list(self.thread))
+        self.assertEqual([item.config for item in listed], configs[::-1])
+        self.assertEqual([item.config for item in self.saver.list(self.thread, limit=1)], [configs[2]])
+        self.assertEqual([item.config for item in self.saver.list(self.thread, before=configs[2])], configs[1::-1])
+        self.assertEqual([item.metadata["step"] for item in self.saver.list(self.thread, filter={"step": 1})], [1])
+        self.assertEqual(len(list(self.saver.list(None))), 4)
+
+    @override_settings(GRAPH_CHECKPOINTS_PER_THREAD=2)
+    def test_put_prunes_old_checkpoints_and_their_writes(self):
+        other_thread = {"configurable": {"thread_id": "ticket-2", "checkpoint_ns": ""}}
+        self.put(other_thread, 0)
+        configs, config = [], self.thread
+        for step in range(4):
+            config = self.put(config, step)
+            self.saver.put_writes(config, [("final_response", f"respuesta {step}")], "tarea")
+            configs.append(config)
+
+        kept = [item.config for item in self.saver.list(self.thread)]
+        self.assertEqual(kept, [configs[3], configs[2]])
+        self.assertIsNone(self.saver.get_tuple(configs[0]))
+        self.assertEqual(GraphCheckpointWrite.objects.filter(thread_id="ticket-1").count(), 2)
+        self.assertEqual(GraphCheckpoint.objects.filter(thread_id="ticket-2").count(), 1)
+
+    def test_delete_thread(self):
+        config = self.put(self.thread, 0)
+        self.saver.put_writes(config, [("final_response", "hola")], "tarea")
+        self.saver.delete_thread("ticket-1")
+        self.assertIsNone(self.saver.get_tuple(self.thread))
+        self.assertFalse(GraphCheckpointWrite.objects.exists())
+
+    async def test_async_round_trip(self):
+        config = await self.saver.aput(self.thread, make_checkpoint(topic_locked=True), {"source": "loop", "step": 0}, {})
+        await self.saver.aput_writes(config, [("final_response", "hola")], "tarea")
+        latest = await self.saver.aget_tuple(self.thread)
+        self.assertEqual(latest.checkpoint['channel_values'], {"topic_locked": True})
+        self.assertEqual(latest.pending_writes, [("tarea", "final_response", "hola")])
+        self.assertEqual([item.config async for item in self.saver.alist(self.thread)], [config])
+
+
+class LockedTopicTests(SimpleTestCase):
+    state = {"topic_locked": True, "current_topic": "[cite_start]Apostilla de la Haya"}
+
+    def test_lock_is_kept_for_the_same_family_or_an_unsure_classifier(self):
+        self.assertTrue(_keeps_locked_topic(self.state, ("DNI para Residentes", 0.8, 0.3, True), True))
+        self.assertTrue(_keeps_locked_topic(self.state, ("Sección Noticias", 0.4, 0.01, False), False))
+        self.assertTrue(_keeps_locked_topic(self.state, None, False))
+
+    def test_confident_topic_from_another_family_releases_the_lock(self):
+        self.assertFalse(_keeps_locked_topic(self.state, ("Sección Noticias", 0.8, 0.3, True), True))
+        self.assertFalse(_keeps_locked_topic({**self.state, "topic_locked": False}, None, False))
+
+    def test_clarification_releases_the_lock(self):
+        update = ask_topic_clarification({**self.state, "clarification_attempts": 1})
+        self.assertFalse(update["topic_locked"])
+        self.assertEqual(update["clarification_attempts"], 2)
+
+
+def chunk(chunk_id, text='', **metadata):
+    return Document(page_content=text, metadata={'chunk_id': chunk_id, **metadata})
+
+
+class LexicalIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = LexicalIndex()
+        self.index.add('apostilla', "Para apostillar un título se pide la apostilla de la Haya.", {'document_id': 1, 'tema': 'Trámites'})
+        self.index.add('pasaporte', "El pasaporte de emergencia se tramita en el consulado.", {'document_id': 2, 'tema': 'Trámites'})
+        self.index.add('logo', "Cómo cambiar el logo del sitio web del consulado.", {'document_id': 3, 'tema': 'Web'})
+
+    def test_tokenize_ignores_case_accents_and_stopwords(self):
+        self.assertEqual(tokenize("¿Cómo tramito el PASAPORTE de emergencia?"), ['tramito', 'pasaporte', 'emergencia'])
+
+    def test_ranks_exact_terms_and_weights_rare_ones_more(self):
+        hits = self.index.search("pasaporte consulado")
+        self.assertEqual([chunk_id for chunk_id, _ in hits], ['pasaporte', 'logo'])
+        # 'consulado' aparece en dos fragmentos: pesa menos que 'pasaporte', que aparece en uno.
+        self.assertGreater(hits[0][1], 2 * hits[1][1])
+        self.assertEqual(self.index.search("apostilla")[0][0], 'apostilla')
+        self.assertEqual(self.index.search("inexistente"), [])
+
+    def test_filters_by_metadata_and_removes_chunks(self):
+        self.assertEqual([chunk_id for chunk_id, _ in self.index.search("consulado", where={'tema': 'Web'})], ['logo'])
+        self.index.remove_document(3)
+        self.assertEqual([chunk_id for chunk_id, _ in self.index.search("consulado")], ['pasaporte'])
+        self.assertNotIn('logo', self.index.postings['sitio'])
+
+    def test_round_trips_through_dict(self):
+        copy = LexicalIndex.from_dict(self.index.to_dict())
+        self.assertEqual(copy.search("pasaporte consulado"), self.index.search("pasaporte consulado"))
+
+
+@override_settings(SIMILARITY_THRESHOLD=0.5, LEXICAL_MIN_SCORE=1.0, RERANK_ENABLED=False)
+class FuseResultsTests(SimpleTestCase):
+    def fuse(self, vector_hits, lexical_hits, fetched=None):
+        index = mock.Mock()
+        index.search.return_value = lexical_hits
+        with mock.patch.object(knowledge_base, 'get_lexical_index', return_value=index), \
+                mock.patch.object(knowledge_base, '_fetch_chunks', return_value=fetched or {}) as fetch:
+            return knowledge_base._fuse_results("consulta", vector_hits, {'tema': 'Trámites'}), index, fetch
+
+    def test_rrf_promotes_chunks_found_by_both_retrievers(self):
+        vector_hits = [(chunk('a'), 0.2), (chunk('b'), 0.3), (chunk('c'), 0.4)]
+        docs, index, _ = self.fuse(vector_hits, [('c', 5.0), ('b', 4.0)])
+        self.assertEqual([doc.metadata['chunk_id'] for doc in docs], ['c', 'b', 'a'])
+        index.search.assert_called_once_with("consulta", k=knowledge_base.SEARCH_K, where={'tema': 'Trámites'})
+
+    def test_thresholds_decide_eligibility_and_lexical_only_chunks_are_fetched(self):
+        vector_hits = [(chunk('lejano'), 0.9), (chunk('a'), 0.2)]
+        fetched = {'exacto': chunk('exacto', "texto")}
+        docs, _, fetch = self.fuse(vector_hits, [('exacto', 3.0), ('debil', 0.5)], fetched)
+        # 'lejano' no pasa el umbral vectorial y 'debil' no llega a LEXICAL_MIN_SCORE.
+        self.assertEqual([doc.metadata['chunk_id'] for doc in docs], ['exacto', 'a'])
+        fetch.assert_called_once_with(['exacto'])
+
+
+@override_settings(RERANK_PRIOR_WEIGHT=0.5, RERANK_MMR_DIVERSITY=0.3, RERANK_DUPLICATE_THRESHOLD=0.8)
+class RerankingTests(SimpleTestCase):
+    requisitos = "Los requisitos para apostillar un título son el original y el pago de la tasa consular."
+    requisitos_ampliado = requisitos + " El trámite demora cinco días hábiles."
+    horario = "El horario de atención del consulado es de lunes a viernes de 9 a 13."
+    pasaporte = "El pasaporte de emergencia requiere la denuncia policial y dos fotos."
+
+    def test_query_coverage_can_outrank_retrieval_order(self):
+        docs = [chunk('horario', self.horario), chunk('requisitos', self.requisitos)]
+        scores = score_passages("requisitos de la apostilla", docs)
+        self.assertAlmostEqual(scores[0], 0.5)
+        self.assertGreater(scores[1], scores[0])
+
+    def test_overlap_treats_an_extended_copy_as_the_same_passage(self):
+        a, b = set("abcd"), set("abcdefgh")
+        self.assertEqual(overlap(a, b), 1.0)
+        self.assertEqual(overlap(a, set()), 0.0)
+
+    def test_mmr_drops_near_duplicates_and_keeps_relevance_order(self):
+        docs = [chunk('1', self.requisitos), chunk('2', self.requisitos_ampliado),
+                chunk('3', self.pasaporte), chunk('4', self.horario)]
+        self.assertEqual(mmr_select(docs, [0.9, 0.85, 0.5, 0.4], top_n=3), [0, 2, 3])
+        self.assertEqual(mmr_select(docs, [0.9, 0.85, 0.5, 0.4], top_n=1), [0])
+
+    def test_rerank_removes_exact_duplicates_before_mmr(self):
+        docs = [chunk('a', self.horario, chunk_hash='h1'), chunk('b', self.requisitos, chunk_hash='h2'),
+                chunk('c', self.requisitos, chunk_hash='h2'), chunk('d', self.pasaporte, chunk_hash='h3')]
+        ranked = rerank_passages("requisitos para apostillar", docs, top_n=5)
+        self.assertEqual([doc.metadata['chunk_id'] for doc in ranked], ['b', 'a', 'd'])
+
+
+@override_settings(CONTEXT_MIN_PASSAGE_TOKENS=5, CONTEXT_RECENT_TURNS=2, CONTEXT_SUMMARY_TOKENS_PER_TURN=40)
+class PackContextTests(SimpleTestCase):
+    question = "¿Qué necesito para apostillar mi título?"
+    first = "La apostilla se pide en línea. Hay que subir el título escaneado."
+    second = "El pago se hace con tarjeta. La tasa cambia cada año. El trámite demora cinco días."
+    third = "El consulado atiende de lunes a viernes."
+
+    def test_truncate_keeps_whole_sentences_or_cuts_words(self):
+        self.assertEqual(truncate_to_tokens(self.first, count_tokens(self.first)), self.first)
+        self.assertEqual(truncate_to_tokens(self.first, count_tokens("La apostilla se pide en línea.")),
+                         "La apostilla se pide en línea.")
+        cut = truncate_to_tokens("Una oración muy larga sin puntos intermedios que no entra", 4)
+        self.assertTrue(cut.endswith("…"))
+        self.assertLessEqual(count_tokens(cut), 4)
+
+    def test_question_and_passages_fill_the_budget_in_order(self):
+        question_tokens, first_tokens = count_tokens(self.question), count_tokens(self.first)
+        second_head = "El pago se hace con tarjeta."
+        budget = question_tokens + first_tokens + count_tokens(second_head) + 2
+        packed = pack_context(self.question, [self.first, self.second, self.third], budget=budget)
+
+        # El segundo pasaje se recorta por oraciones y el tercero ya no tiene lugar.
+        self.assertEqual(packed.passages, [self.first, second_head])
+        self.assertEqual(packed.stats["passages"], 1)
+        self.assertEqual(packed.stats["tokens"],
+                         count_tokens(self.second) - count_tokens(second_head) + count_tokens(self.third))
+        self.assertEqual(packed.stats["used"], budget - 2)
+        self.assertLessEqual(packed.stats["used"], budget)
+
+    def test_recent_turns_are_kept_and_older_ones_summarized(self):
+        turns = [("Usuario", "Hola. Tengo una consulta."), ("Asistente", "Claro, decime."),
+                 ("Usuario", "¿Dónde queda el consulado?"), ("Asistente", "En la calle Mayor 123.")]
+        packed = pack_context(self.question, [self.first], turns=turns, budget=1000)
+
+        self.assertEqual(packed.recent_turns, turns[2:])
+        self.assertEqual(packed.older_summary, "- Usuario: Hola.\n- Asistente: Claro, decime.")
+        self.assertEqual((packed.stats["turns_summarized"], packed.stats["turns_dropped"]), (2, 0))
+        self.assertIn("Asistente: En la calle Mayor 123.", packed.history_text())
+
+    def test_turns_that_do_not_fit_are_counted_as_dropped(self):
+        turns = [("Usuario", "Primera pregunta."), ("Usuario", "Segunda pregunta.")]
+        budget = count_tokens(self.question)
+        packed = pack_context(self.question, [self.first], turns=turns, budget=budget)
+
+        self.assertEqual((packed.passages, packed.recent_turns, packed.older_summary), ([], [], ''))
+        self.assertEqual((packed.stats["passages"], packed.stats["turns_dropped"]), (1, 2))
+        self.assertEqual(packed.stats["used"], budget)
+
+
+@override_settings(ANSWER_CACHE_ENABLED=True, ANSWER_CACHE_SIMILARITY=0.95)
+class AnswerCacheTests(TestCase):
+    vectors = {
+        "¿Cómo apostillo un título?": [1.0, 0.0, 0.0],
+        "¿Cómo se apostilla un título?": [0.99, 0.05, 0.0],
+        "¿Dónde queda el consulado?": [0.0, 1.0, 0.0],
+    }
+
+    def setUp(self):
+        patcher = mock.patch.object(answer_cache, '_embed', side_effect=lambda question: self.vectors[question])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.document = KnowledgeDocument.objects.create(nombre="Apostilla", archivo="knowledge_base/a.pdf", hash_contenido="v1")
+        self.docs = [chunk('c1', "texto", document_id=str(self.document.id))]
+        answer_cache.clear_candidate_cache()
+        self.addCleanup(answer_cache.clear_candidate_cache)
+
+    def store(self, question="¿Cómo apostillo un título?", topic="Apostilla de la Haya"):
+        return answer_cache.store_answer(question, topic, "Se pide en línea.", self.docs)
+
+    def stats(self):
+        return AnswerCacheDailyStats.objects.values_list('aciertos', 'fallos').get()
+
+    def test_equivalent_question_of_the_same_topic_is_a_hit(self):
+        stored = self.store()
+        entry = answer_cache.lookup_answer("¿Cómo se apostilla un título?", "[cite_start]Apostilla de la Haya")
+        self.assertEqual(entry.pk, stored.pk)
+        self.assertEqual(entry.respuesta, "Se pide en línea.")
+        self.assertEqual(AnswerCacheEntry.objects.get().aciertos, 1)
+        self.assertEqual(self.stats(), (1, 0))
+
+    def test_other_question_or_topic_is_a_miss(self):
+        self.store()
+        self.assertIsNone(answer_cache.lookup_answer("¿Dónde queda el consulado?", "Apostilla de la Haya"))
+        self.assertIsNone(answer_cache.lookup_answer("¿Cómo apostillo un título?", "Sección Contacto"))
+        self.assertEqual(self.stats(), (0, 2))
+
+    def test_changed_document_makes_the_entry_stale(self):
+        self.store()
+        KnowledgeDocument.objects.filter(pk=self.document.pk).update(hash_contenido="v2")
+        self.assertIsNone(answer_cache.lookup_answer("¿Cómo apostillo un título?", "Apostilla de la Haya"))
+        self.assertFalse(AnswerCacheEntry.objects.exists())
+
+    def test_invalidation_and_missing_documents(self):
+        self.store()
+        self.assertEqual(answer_cache.invalidate_answers_for_documents([self.document.id]), 1)
+        self.assertFalse(AnswerCacheEntry.objects.exists())
+        self.docs = [chunk('c2', "texto", document_id="999999")]
+        self.assertIsNone(self.store())
+
+    def test_candidates_stay_in_memory_until_the_topic_changes(self):
+        self.store()
+        answer_cache.lookup_answer("¿Dónde queda el consulado?", "Apostilla de la Haya")
+        with mock.patch.object(AnswerCacheEntry.objects, 'filter', wraps=AnswerCacheEntry.objects.filter) as filter_:
+            answer_cache.lookup_answer("¿Dónde queda el consulado?", "Apostilla de la Haya")
+        # Solo la consulta de agregación: no se vuelven a leer los embeddings.
+        self.assertEqual(filter_.call_count, 1)
+
+        self.store("¿Dónde queda el consulado?")
+        entry = answer_cache.lookup_answer("¿Dónde queda el consulado?", "Apostilla de la Haya")
+        self.assertEqual(entry.pregunta, "¿Dónde queda el consulado?")
+
+    @override_settings(ANSWER_CACHE_TTL_SECONDS=60)
+    def test_expired_answers_are_ignored_and_deleted(self):
+        stored = self.store()
+        AnswerCacheEntry.objects.filter(pk=stored.pk).update(fecha_creacion=timezone.now() - timedelta(seconds=61))
+        self.assertIsNone(answer_cache.lookup_answer("¿Cómo apostillo un título?", "Apostilla de la Haya"))
+        self.assertFalse(AnswerCacheEntry.objects.exists())
+
+    @override_settings(ANSWER_CACHE_ENABLED=False)
+    def test_disabled_cache_neither_stores_nor_looks_up(self):
+        self.assertIsNone(self.store())
+        self.assertIsNone(answer_cache.lookup_answer("¿Cómo apostillo un título?", "Apostilla de la Haya"))
+        self.assertFalse(AnswerCacheDailyStats.objects.exists())
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_query(self, text):
+        self.calls.append(text)
+        return [float(len(text)), float(len(self.calls))]
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+    def embed_documents(self, texts):
+        self.calls.extend(texts)
+        return [[0.0] for _ in texts]
+
+
+class CachedEmbeddingsTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(embedding_cache.time, 'time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.inner = CountingEmbeddings()
+
+    def test_normalized_queries_share_an_entry(self):
+        cache = CachedEmbeddings(self.inner, 'modelo')
+        first = cache.embed_query("¿Cómo  apostillo un TÍTULO?")
+        self.assertEqual(cache.embed_query("¿cómo apostillo un título?"), first)
+        self.assertEqual(asyncio.run(cache.aembed_query(" ¿Cómo apostillo un título? ")), first)
+        self.assertEqual(len(self.inner.calls), 1)
+        self.assertEqual(cache.get_metrics()["memory_hits"], 2)
+
+    def test_lru_evicts_the_least_recently_used_query(self):
+        cache = CachedEmbeddings(self.inner, 'modelo', max_entries=2)
+        cache.embed_query("a")
+        cache.embed_query("b")
+        cache.embed_query("a")
+        cache.embed_query("c")   # Desaloja 'b', que es la menos usada.
+        cache.embed_query("a")
+        cache.embed_query("b")
+        self.assertEqual(self.inner.calls, ["a", "b", "c", "b"])
+        self.assertEqual(cache.get_metrics()["evictions"], 2)
+
+    def test_entries_expire_after_the_ttl(self):
+        cache = CachedEmbeddings(self.inner, 'modelo', ttl_seconds=60)
+        cache.embed_query("a")
+        self.now += 59
+        cache.embed_query("a")
+        self.now += 2
+        cache.embed_query("a")
+        self.assertEqual(self.inner.calls, ["a", "a"])
+
+    def test_disk_tier_survives_a_new_instance_and_respects_the_ttl(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.sqlite3')
+            vector = CachedEmbeddings(self.inner, 'modelo', ttl_seconds=60, disk_path=path).embed_query("a")
+            restarted = CachedEmbeddings(self.inner, 'modelo', ttl_seconds=60, disk_path=path)
+            self.assertEqual(restarted.embed_query("a"), vector)
+            self.assertEqual(restarted.get_metrics()["disk_hits"], 1)
+            # Otro modelo no comparte vectores.
+            CachedEmbeddings(self.inner, 'otro', disk_path=path).embed_query("a")
+            self.now += 61
+            CachedEmbeddings(self.inner, 'modelo', ttl_seconds=60, disk_path=path).embed_query("a")
+        self.assertEqual(self.inner.calls, ["a", "a", "a"])
+
+    def test_disk_rows_are_pruned_by_ttl_and_row_cap(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.sqlite3')
+            cache = CachedEmbeddings(self.inner, 'modelo', ttl_seconds=60, disk_path=path,
+                                     disk_max_entries=3, prune_every=2)
+            for text in ["a", "b", "c", "d"]:
+                self.now += 1
+                cache.embed_query(text)
+            keys = [row[0] for row in cache._db.execute("SELECT key FROM query_embeddings ORDER BY created_at")]
+            self.assertEqual(keys, [cache._make_key(text) for text in ["b", "c", "d"]])
+            self.now += 61
+            cache.embed_query("e")
+            cache.embed_query("f")
+            self.assertEqual(cache._db.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0], 2)
+            self.assertEqual(cache.get_metrics()["disk_pruned"], 4)
+            cache._db.close()
+
+    def test_locked_disk_falls_back_to_the_embeddings_client(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.sqlite3')
+            cache = CachedEmbeddings(self.inner, 'modelo', disk_path=path, disk_timeout=0.01)
+            other = sqlite3.connect(path)
+            other.execute("BEGIN EXCLUSIVE")
+            try:
+                self.assertEqual(cache.embed_query("a"), [1.0, 1.0])
+                self.assertEqual(cache.embed_query("a"), [1.0, 1.0])
+            finally:
+                other.rollback()
+                other.close()
+                cache._db.close()
+        self.assertEqual(self.inner.calls, ["a"])
+        self.assertEqual(cache.get_metrics()["disk_errors"], 2)
+
+    def test_async_disk_access_runs_off_the_event_loop(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = CachedEmbeddings(self.inner, 'modelo', disk_path=os.path.join(directory, 'cache.sqlite3'))
+            threads = []
+            get_disk = cache._get_disk
+
+            def record_thread(key):
+                threads.append(threading.get_ident())
+                return get_disk(key)
+
+            async def lookup():
+                with mock.patch.object(cache, '_get_disk', side_effect=record_thread):
+                    await cache.aembed_query("a")
+                return threading.get_ident()
+
+            loop_thread = asyncio.run(lookup())
+            cache._db.close()
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], loop_thread)
+
+    def test_document_chunks_are_not_cached(self):
+        cache = CachedEmbeddings(self.inner, 'modelo')
+        cache.embed_documents(["a", "a"])
+        cache.embed_documents(["a"])
+        self.assertEqual(self.inner.calls, ["a", "a", "a"])
+
+
+class SearchScopeTests(SimpleTestCase):
+    def test_subtopic_widens_to_its_parent_topic_and_then_everything(self):
+        self.assertEqual(build_search_scopes(" apostilla de la haya "), [
+            ("subtema", {"tema": "Trámites y Documentación", "subtema": "[cite_start]Apostilla de la Haya"}),
+            ("tema", {"tema": "Trámites y Documentación"}),
+            ("todos", {}),
+        ])
+
+    def test_main_unknown_and_missing_topics(self):
+        self.assertEqual(build_search_scopes("Información General"),
+                         [("tema", {"tema": "Información General"}), ("todos", {})])
+        self.assertEqual(build_search_scopes("Tema nuevo"), [("tema", {"tema": "Tema nuevo"}), ("todos", {})])
+        self.assertEqual(build_search_scopes(None), [("todos", {})])
+
+    @override_settings(TOPIC_MIN_HITS=2)
+    def test_widens_until_a_scope_has_enough_relevant_hits(self):
+        results = {
+            "subtema": [(chunk("a"), 0.2), (chunk("b"), 0.9)],
+            "tema": [(chunk("a"), 0.2), (chunk("c"), 0.3)],
+            "todos": [(chunk("d"), 0.1), (chunk("e"), 0.1)],
+        }
+        scopes = build_search_scopes("Apostilla de la Haya")
+        by_filter = {str(where): results[name] for name, where in scopes}
+        searched = []
+
+        def search_scope(query_embedding, where):
+            searched.append(where)
+            return by_filter[str(where)]
+
+        with mock.patch.object(knowledge_base, '_search_scope', side_effect=search_scope), \
+                mock.patch.object(knowledge_base, '_get_similarity_threshold', return_value=0.5):
+            where, docs_with_scores = knowledge_base._search_with_widening([0.0], scopes)
+
+        self.assertEqual(where, {"tema": "Trámites y Documentación"})
+        self.assertEqual([doc.metadata["chunk_id"] for doc, _ in docs_with_scores], ["a", "c"])
+        self.assertEqual(searched, [where for _, where in scopes[:2]])
+
+    @override_settings(TOPIC_MIN_HITS=1)
+    def test_falls_back_to_the_last_scope_when_nothing_is_relevant(self):
+        scopes = build_search_scopes("Información General")
+        with mock.patch.object(knowledge_base, '_search_scope', return_value=[(chunk("a"), 0.9)]), \
+                mock.patch.object(knowledge_base, '_get_similarity_threshold', return_value=0.5):
+            where, docs_with_scores = knowledge_base._search_with_widening([0.0], scopes)
+        self.assertEqual(where, {})
+        self.assertEqual(len(docs_with_scores), 1)
+
+
+class GraphMetricsTests(TestCase):
+    def setUp(self):
+        instrumentation.reset_graph_metrics_cache()
+        self.addCleanup(instrumentation.reset_graph_metrics_cache)
+        for duration in (100.0, 200.0, 300.0):
+            TurnMetrics.objects.create(duracion_ms=duration, nodos={'retrieve': duration / 2}, costo_usd=0.01)
+
+    def test_percentiles_per_node_and_turn(self):
+        metrics = instrumentation.get_graph_metrics()
+        self.assertEqual((metrics['turns'], metrics['turn_p50'], metrics['turn_p95']), (3, 200.0, 300.0))
+        self.assertEqual(metrics['nodes'], [{'name': 'retrieve', 'count': 3, 'p50': 100.0, 'p95': 150.0}])
+        self.assertAlmostEqual(metrics['daily_spend'][0]['costo'], 0.03)
+
+    @override_settings(GRAPH_METRICS_CACHE_SECONDS=60)
+    def test_result_is_reused_until_it_expires(self):
+        first = instrumentation.get_graph_metrics()
+        TurnMetrics.objects.create(duracion_ms=900.0, nodos={})
+        with self.assertNumQueries(0):
+            self.assertIs(instrumentation.get_graph_metrics(), first)
+        with override_settings(GRAPH_METRICS_CACHE_SECONDS=0):
+            self.assertEqual(instrumentation.get_graph_metrics()['turns'], 4)
@@ -0,0 +1,146 @@
+# apps/ai_core/tools/embedding_backends.py
+
+import os
+import zlib
+
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+
+from .lexical_index import tokenize
+
+# Colección que LangChain crea por defecto: es la que ya existe en chroma_db
+# y fue generada con Gemini, por eso ese backend la conserva.
+LEGACY_COLLECTION_NAME = 'langchain'
+LEGACY_BACKEND = 'gemini'
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Embeddings locales por "feature hashing": términos y n-gramas de caracteres
+    proyectados con signo sobre un vector de dimensión fija y normalizados (L2).
+
+    No necesita red ni modelos descargados y tarda microsegundos por texto.
+    Capta coincidencias de vocabulario (incluidas variantes como plural o
+    conjugaciones), no sinónimos: sirve para operar sin conexión, para CI y
+    para benchmarks herméticos.
+    """
+
+    is_local = True
+
+    def __init__(self, dimensions: int = 512, ngram_size: int = 4):
+        self.dimensions = dimensions
+        self.ngram_size = ngram_size
+
+    def _features(self, text: str):
+        for token in tokenize(text):
+            yield token, 1.0
+            padded = f"#{token}#"
+            if len(padded) > self.ngram_size:
+                for i in range(len(padded) - self.ngram_size + 1):
+                    yield padded[i:i + self.ngram_size], 0.5
+
+    def _embed(self, text: str) -> list:
+        import numpy as np
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature, weight in self._features(text):
+            # crc32 es estable entre procesos (hash() de Python no lo es).
+            h = zlib.crc32(feature.encode('utf-8'))
+            vector[h % self.dimensions] += weight if (h >> 31) & 1 else -weight
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed(text)
+
+
+class OnnxMiniLMEmbeddings(Embeddings):
+    """
+    Modelo all-MiniLM-L6-v2 en ONNX Runtime (el embedding por defecto de ChromaDB).
+    Corre en CPU dentro del proceso; el modelo se descarga una sola vez a ~/.cache/chroma.
+    """
+
+    is_local = True
+
+    def __init__(self):
+        from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+        self._function = ONNXMiniLM_L6_V2()
+
+    def embed_documents(self, texts: list) -> list:
+        return [[float(x) for x in vector] for vector in self._function(list(texts))]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+def _make_gemini_embeddings() -> Embeddings:
+    gemini_api_key = os.getenv('GEMINI_API_KEY')
+    if not gemini_api_key:
+        raise ValueError("La clave de API de Gemini no está configurada en el archivo .env")
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model=get_embedding_model_name('gemini'), google_api_key=gemini_api_key)
+
+
+def _make_hashing_embeddings() -> Embeddings:
+    return HashingEmbeddings(dimensions=getattr(settings, 'LOCAL_EMBEDDING_DIMENSIONS', 512))
+
+
+# Registro de backends. 'similarity_threshold' es la distancia L2 al cuadrado
+# máxima para considerar relevante un fragmento: cada modelo distribuye las
+# distancias de forma distinta, así que el umbral acompaña al backend.
+EMBEDDING_BACKENDS = {
+    'gemini': {
+        'factory': _make_gemini_embeddings,
+        'remote': True,
+        'similarity_threshold': 0.5,
+    },
+    'local': {
+        'factory': _make_hashing_embeddings,
+        'remote': False,
+        'similarity_threshold': 1.8,
+    },
+    'onnx': {
+        'factory': OnnxMiniLMEmbeddings,
+        'remote': False,
+        'similarity_threshold': 1.0,
+    },
+}
+
+
+def get_embedding_backend_name() -> str:
+    name = getattr(settings, 'EMBEDDING_BACKEND', LEGACY_BACKEND)
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(
+            f"EMBEDDING_BACKEND '{name}' no existe. Opciones: {', '.join(EMBEDDING_BACKENDS)}"
+        )
+    return name
+
+
+def get_embedding_backend(name: str = None) -> dict:
+    return EMBEDDING_BACKENDS[name or get_embedding_backend_name()]
+
+
+def get_embedding_model_name(name: str = None) -> str:
+    """Identificador del modelo: forma parte de la clave de la caché y de los metadatos de la colección."""
+    name = name or get_embedding_backend_name()
+    if name == 'gemini':
+        return getattr(settings, 'GEMINI_EMBEDDING_MODEL', "models/embedding-001")
+    if name == 'local':
+        return f"hashing-{getattr(settings, 'LOCAL_EMBEDDING_DIMENSIONS', 512)}"
+    return 'all-MiniLM-L6-v2'
+
+
+def get_collection_name(name: str = None) -> str:
+    """Cada backend escribe en su propia colección para no mezclar vectores."""
+    name = name or get_embedding_backend_name()
+    if name == LEGACY_BACKEND:
+        return LEGACY_COLLECTION_NAME
+    return f"{LEGACY_COLLECTION_NAME}_{name}"
+
+
+def create_embeddings(name: str = None) -> Embeddings:
+    return get_embedding_backend(name)['factory']()
@@ -0,0 +1,225 @@
+# apps/ai_core/tools/embedding_cache.py
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_query(text: str) -> str:
+    """Normaliza el texto de una consulta para usarlo como clave de caché."""
+    text = unicodedata.normalize('NFC', text or '')
+    return ' '.join(text.casefold().split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envoltorio de un cliente de embeddings que guarda los vectores de las consultas.
+
+    - Nivel en memoria: LRU acotado por 'max_entries', con expiración por 'ttl_seconds'.
+    - Nivel en disco (opcional): SQLite, para que los reinicios arranquen con la caché caliente.
+
+    Solo se cachean las consultas (embed_query); los fragmentos de documentos
+    se delegan directamente al cliente original.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, max_entries: int = 1024,
+                 ttl_seconds: float = None, disk_path: str = None, disk_max_entries: int = None,
+                 disk_timeout: float = 1.0, prune_every: int = 256):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self.disk_max_entries = disk_max_entries
+        self.prune_every = prune_every
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # La conexión SQLite se comparte entre hilos: su propio lock, para que
+        # una espera en disco no bloquee los aciertos en memoria.
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._disk_writes = 0
+        self.metrics = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0,
+                        "disk_errors": 0, "disk_pruned": 0}
+
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            # 'timeout': cuánto espera SQLite si otro proceso tiene la base bloqueada.
+            self._db = sqlite3.connect(disk_path, timeout=disk_timeout, check_same_thread=False)
+            try:
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                    "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                self._db.execute(
+                    "CREATE INDEX IF NOT EXISTS query_embeddings_created_at ON query_embeddings (created_at)"
+                )
+                self._db.commit()
+            except sqlite3.OperationalError as e:
+                print(f"CACHÉ DE EMBEDDINGS: No se pudo preparar la caché en disco ({e}). Se usa solo memoria.")
+                self._db.close()
+                self._db = None
+            else:
+                self._prune_disk()
+
+    # --------------------------------------------------------------------------
+    # Claves y niveles de caché
+    # --------------------------------------------------------------------------
+    def _make_key(self, text: str) -> str:
+        raw = f"{self.model_name}\x00{normalize_query(text)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and (time.time() - created_at) > self.ttl_seconds
+
+    def _disk_error(self, error):
+        # La caché en disco es solo una optimización: si SQLite está bloqueado
+        # por otro proceso, se sigue como si fuera un fallo de caché.
+        with self._lock:
+            self.metrics["disk_errors"] += 1
+        print(f"CACHÉ DE EMBEDDINGS: Error de la caché en disco ({error}). Se continúa sin ella.")
+
+    def _get_memory(self, key: str):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                vector, created_at = entry
+                if not self._is_expired(created_at):
+                    self._memory.move_to_end(key)
+                    self.metrics["memory_hits"] += 1
+                    return vector
+                del self._memory[key]
+            return None
+
+    def _get_disk(self, key: str):
+        """Busca en disco tras un fallo en memoria; cuenta el fallo si tampoco está ahí."""
+        row = None
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    row = self._db.execute(
+                        "SELECT vector, created_at FROM query_embeddings WHERE key = ?", (key,)
+                    ).fetchone()
+            except sqlite3.OperationalError as e:
+                self._disk_error(e)
+
+        with self._lock:
+            # Las filas vencidas no se devuelven; las borra la poda periódica.
+            if row is not None and not self._is_expired(row[1]):
+                vector = json.loads(row[0])
+                self._remember(key, vector, row[1])
+                self.metrics["disk_hits"] += 1
+                return vector
+            self.metrics["misses"] += 1
+            return None
+
+    def _remember(self, key: str, vector: list, created_at: float):
+        # Debe llamarse con el lock tomado.
+        self._memory[key] = (vector, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.metrics["evictions"] += 1
+
+    def _put_memory(self, key: str, vector: list) -> float:
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, vector, created_at)
+        return created_at
+
+    def _put_disk(self, key: str, vector: list, created_at: float):
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, model, vector, created_at) VALUES (?, ?, ?, ?)",
+                    (key, self.model_name, json.dumps(vector), created_at)
+                )
+                self._db.commit()
+                self._disk_writes += 1
+                prune = self._disk_writes % self.prune_every == 0
+        except sqlite3.OperationalError as e:
+            self._disk_error(e)
+            return
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Borra las filas vencidas y las más viejas por encima de 'disk_max_entries'."""
+        try:
+            with self._db_lock:
+                pruned = 0
+                if self.ttl_seconds is not None:
+                    pruned += self._db.execute(
+                        "DELETE FROM query_embeddings WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+                    ).rowcount
+                if self.disk_max_entries:
+                    pruned += self._db.execute(
+                        "DELETE FROM query_embeddings WHERE key IN ("
+                        "SELECT key FROM query_embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                        (self.disk_max_entries,)
+                    ).rowcount
+                self._db.commit()
+        except sqlite3.OperationalError as e:
+            self._disk_error(e)
+            return
+        if pruned:
+            with self._lock:
+                self.metrics["disk_pruned"] += pruned
+
+    async def _run_disk(self, func, *args):
+        # Sin nivel en disco no hay E/S: no vale la pena pasar por un hilo.
+        if self._db is None:
+            return func(*args)
+        return await asyncio.to_thread(func, *args)
+
+    # --------------------------------------------------------------------------
+    # Interfaz de Embeddings
+    # --------------------------------------------------------------------------
+    def embed_query(self, text: str) -> list:
+        key = self._make_key(text)
+        vector = self._get_memory(key)
+        if vector is None:
+            vector = self._get_disk(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._put_disk(key, vector, self._put_memory(key, vector))
+        return vector
+
+    async def aembed_query(self, text: str) -> list:
+        # SQLite es síncrono: las lecturas y escrituras en disco van a un hilo
+        # para no frenar el event loop (del bot de Telegram, por ejemplo).
+        key = self._make_key(text)
+        vector = self._get_memory(key)
+        if vector is None:
+            vector = await self._run_disk(self._get_disk, key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await self._run_disk(self._put_disk, key, vector, self._put_memory(key, vector))
+        return vector
+
+    def embed_documents(self, texts: list) -> list:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list) -> list:
+        return await self.embeddings.aembed_documents(texts)
+
+    def get_metrics(self) -> dict:
+        """Devuelve contadores de aciertos y fallos, más la ocupación actual."""
+        with self._lock:
+            metrics = dict(self.metrics)
+            metrics["memory_entries"] = len(self._memory)
+        lookups = metrics["memory_hits"] + metrics["disk_hits"] + metrics["misses"]
+        metrics["hit_rate"] = (metrics["memory_hits"] + metrics["disk_hits"]) / lookups if lookups else 0.0
+        return metrics
@@ -2,93 +2,251 @@
 
 import os
 import asyncio
-from django.conf import settings
 from functools import partial
 
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import Chroma
+from django.conf import settings
+
+from ..topics import build_search_scopes
+from .embedding_backends import get_embedding_backend
+from .lexical_index import get_lexical_index
+from .reranking import rerank_passages
+from .topic_index import get_topic_index
+from .vector_store import get_embeddings, get_persist_directory, get_vectorstore
 
+# Umbral de Gemini; los demás backends definen el suyo (ver embedding_backends).
 SIMILARITY_THRESHOLD = 0.5
+SEARCH_K = 5
+# Constante de Reciprocal Rank Fusion: amortigua el peso de las primeras posiciones.
+RRF_K = 60
 
-# --- ¡CAMBIO 1: AÑADIDO NUEVO PARÁMETRO 'topic'! ---
-async def _asearch_vector_store(user_query: str, topic: str = None) -> list:
+
+def _build_search_scopes(topic: str = None) -> list:
     """
-    Lógica asíncrona principal para realizar la búsqueda, ahora con filtrado por tema.
+    Alcances de búsqueda para el tema elegido: subtema, tema padre y toda la base.
+    Un subtema se resuelve a su tema padre porque así están guardados los fragmentos.
     """
-    try:
-        gemini_api_key = os.getenv('GEMINI_API_KEY')
-        if not gemini_api_key:
-            print("BÚSQUEDA VECTORIAL: Error - La clave de API de Gemini no está configurada.")
-            return []
+    scopes = build_search_scopes(topic)
+    if topic:
+        print(f"BÚSQUEDA VECTORIAL: Filtros para el tema '{topic}': {[where for _, where in scopes]}")
+    return scopes
 
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=gemini_api_key)
-        persist_directory = os.path.join(settings.BASE_DIR, 'chroma_db')
-        
-        if not os.path.exists(persist_directory):
-            print("BÚSQUEDA VECTORIAL: Error - El directorio de ChromaDB no existe.")
-            return []
 
-        vectorstore = Chroma(
-            persist_directory=persist_directory,
-            embedding_function=embeddings
-        )
+def _to_chroma_filter(where: dict):
+    """ChromaDB exige '$and' cuando el filtro tiene más de una condición."""
+    if not where:
+        return None
+    if len(where) == 1:
+        return dict(where)
+    return {"$and": [{key: value} for key, value in where.items()]}
 
-        # --- ¡CAMBIO 2: CONSTRUCCIÓN DEL FILTRO DE BÚSQUEDA! ---
-        search_filter = {}
-        if topic:
-            # Este es el filtro de metadatos que ChromaDB usará.
-            # Buscará solo en los chunks donde el metadato 'tema' coincida.
-            search_filter = {"tema": topic}
-            print(f"BÚSQUEDA VECTORIAL: Aplicando filtro de tema: '{topic}'")
 
-        # --- ¡CAMBIO 3: LLAMADA A LA BÚSQUEDA CON EL FILTRO! ---
-        # Usamos functools.partial para pasar argumentos nombrados de forma segura a asyncio.to_thread
-        search_func = partial(
-            vectorstore.similarity_search_with_score, 
-            query=user_query, 
-            k=5, 
-            filter=search_filter # Aquí pasamos el filtro
-        )
-        docs_with_scores = await asyncio.to_thread(search_func)
-        
-        if not docs_with_scores:
-            print("BÚSQUEDA VECTORIAL: No se encontraron fragmentos (incluso con filtro).")
-            return []
+def _get_similarity_threshold() -> float:
+    # SIMILARITY_THRESHOLD en settings fuerza un umbral (p. ej. para compararlos en un benchmark).
+    override = getattr(settings, 'SIMILARITY_THRESHOLD', None)
+    if override is not None:
+        return override
+    return get_embedding_backend().get('similarity_threshold', SIMILARITY_THRESHOLD)
+
+
+def _check_preconditions() -> bool:
+    if get_embedding_backend()['remote'] and not os.getenv('GEMINI_API_KEY'):
+        print("BÚSQUEDA VECTORIAL: Error - La clave de API de Gemini no está configurada.")
+        return False
+    if not os.path.exists(get_persist_directory()):
+        print("BÚSQUEDA VECTORIAL: Error - El directorio de ChromaDB no existe.")
+        return False
+    return True
+
+
+def _get_retrieval_mode(mode: str = None) -> str:
+    """'hybrid' (vectorial + BM25) o 'vector' (solo vectorial)."""
+    return mode or getattr(settings, 'RETRIEVAL_MODE', 'hybrid')
+
+
+def _rerank_enabled() -> bool:
+    return getattr(settings, 'RERANK_ENABLED', True)
+
+
+def _get_fetch_k() -> int:
+    """Candidatos a recuperar: con reranking se trae de más para luego quedarse con los mejores."""
+    if _rerank_enabled():
+        return max(SEARCH_K, getattr(settings, 'RERANK_FETCH_K', 20))
+    return SEARCH_K
+
+
+def _chunk_key(doc) -> str:
+    """Clave común a ChromaDB y al índice léxico (los fragmentos antiguos no tienen 'chunk_id')."""
+    return doc.metadata.get('chunk_id') or f"{doc.metadata.get('document_id')}:{doc.metadata.get('chunk_index')}"
+
+
+def _query_vector_store(query_embedding: list, search_filter: dict) -> list:
+    """Consulta bloqueante al índice HNSW con un vector ya calculado."""
+    vectorstore = get_vectorstore()
+    return vectorstore.similarity_search_by_vector_with_relevance_scores(
+        embedding=query_embedding,
+        k=_get_fetch_k(),
+        filter=_to_chroma_filter(search_filter)
+    )
+
+
+def _search_scope(query_embedding: list, where: dict) -> list:
+    """
+    Un alcance de la búsqueda. Los filtrados por tema usan el índice
+    particionado si TOPIC_PARTITION_INDEX está activo; el alcance sin filtro
+    ("todos") siempre va al índice HNSW de ChromaDB.
+    """
+    if where and getattr(settings, 'TOPIC_PARTITION_INDEX', False):
+        return get_topic_index().search_documents(query_embedding, _get_fetch_k(), where)
+    return _query_vector_store(query_embedding, where)
+
+
+def _search_with_widening(query_embedding: list, scopes: list) -> tuple:
+    """
+    Busca en el alcance más estrecho y, si devuelve menos de TOPIC_MIN_HITS
+    fragmentos relevantes, amplía al tema padre y luego a toda la base.
+    Devuelve (filtro usado, [(Document, distancia)]).
+    """
+    threshold = _get_similarity_threshold()
+    min_hits = getattr(settings, 'TOPIC_MIN_HITS', 1)
+
+    for scope_name, where in scopes:
+        docs_with_scores = _search_scope(query_embedding, where)
+        if sum(1 for _, score in docs_with_scores if score < threshold) >= min_hits:
+            break
+
+    if len(scopes) > 1:
+        print(f"BÚSQUEDA VECTORIAL: Alcance usado: '{scope_name}' {where or ''}")
+    return where, docs_with_scores
+
+
+def _fetch_chunks(chunk_ids: list) -> dict:
+    """Recupera de ChromaDB el texto y metadatos de fragmentos encontrados solo por el índice léxico."""
+    from langchain_core.documents import Document
+    if not chunk_ids:
+        return {}
+    results = get_vectorstore().get(ids=chunk_ids, include=["documents", "metadatas"])
+    return {
+        chunk_id: Document(page_content=text, metadata=metadata or {})
+        for chunk_id, text, metadata in zip(results['ids'], results['documents'], results['metadatas'])
+    }
 
+
+def _fuse_results(user_query: str, docs_with_scores: list, search_filter: dict) -> list:
+    """
+    Fusiona los candidatos vectoriales con los del índice léxico BM25 (Reciprocal Rank Fusion).
+
+    Entran al resultado los fragmentos vectoriales que superan el umbral de
+    relevancia y los léxicos con puntuación BM25 >= LEXICAL_MIN_SCORE; el
+    orden final lo decide la suma de 1 / (RRF_K + posición) en ambas listas.
+    """
+    lexical_min_score = getattr(settings, 'LEXICAL_MIN_SCORE', 2.0)
+    threshold = _get_similarity_threshold()
+    fetch_k = _get_fetch_k()
+    lexical_hits = get_lexical_index().search(user_query, k=fetch_k, where=search_filter or None)
+    print(f"BÚSQUEDA HÍBRIDA: {len(lexical_hits)} candidatos léxicos (BM25).")
+
+    fused_scores, docs_by_key, eligible = {}, {}, set()
+    for rank, (doc, score) in enumerate(docs_with_scores):
+        key = _chunk_key(doc)
+        docs_by_key[key] = doc
+        fused_scores[key] = fused_scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+        if score < threshold:
+            eligible.add(key)
+    for rank, (chunk_id, score) in enumerate(lexical_hits):
+        print(f"  - Candidato léxico '{chunk_id}' con BM25: {score:.2f}")
+        fused_scores[chunk_id] = fused_scores.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        if score >= lexical_min_score:
+            eligible.add(chunk_id)
+
+    docs_by_key.update(_fetch_chunks([key for key in eligible if key not in docs_by_key]))
+    ranked = sorted((key for key in eligible if key in docs_by_key), key=lambda key: fused_scores[key], reverse=True)
+    relevant_docs = [docs_by_key[key] for key in ranked[:fetch_k]]
+    print(f"BÚSQUEDA HÍBRIDA: {len(relevant_docs)} fragmentos relevantes tras la fusión.")
+    return relevant_docs
+
+
+def _retrieve(user_query: str, query_embedding: list, scopes: list, mode: str) -> list:
+    """Consulta vectorial y, en modo híbrido, fusión con el índice léxico. Bloqueante."""
+    search_filter, docs_with_scores = _search_with_widening(query_embedding, scopes)
+    relevant_docs = None
+    if _get_retrieval_mode(mode) == 'hybrid':
         print(f"BÚSQUEDA VECTORIAL: Se encontraron {len(docs_with_scores)} fragmentos candidatos.")
-        
-        relevant_docs = []
-        for doc, score in docs_with_scores:
-            print(f"  - Documento candidato con puntuación: {score:.4f}")
-            if score < SIMILARITY_THRESHOLD:
-                relevant_docs.append(doc)
-
-        if relevant_docs:
-            print(f"BÚSQUEDA VECTORIAL: Se encontraron {len(relevant_docs)} fragmentos RELEVANTES (puntuación < {SIMILARITY_THRESHOLD}).")
-        else:
-            print(f"BÚSQUEDA VECTORIAL: Ningún fragmento superó el umbral de relevancia.")
-            
-        return relevant_docs
+        try:
+            relevant_docs = _fuse_results(user_query, docs_with_scores, search_filter)
+        except (OSError, ValueError) as e:
+            # Sin índice léxico legible se responde solo con ChromaDB en lugar de escalar.
+            print(f"BÚSQUEDA HÍBRIDA: No se pudo leer el índice léxico ({e}). Se usan solo los resultados vectoriales.")
+    if relevant_docs is None:
+        relevant_docs = _filter_relevant(docs_with_scores)
+
+    # Reranking local y MMR: solo pasan a la generación los pasajes distintos más útiles.
+    if _rerank_enabled() and relevant_docs:
+        return rerank_passages(user_query, relevant_docs, top_n=SEARCH_K)
+    return relevant_docs[:SEARCH_K]
+
+
+def _filter_relevant(docs_with_scores: list) -> list:
+    """Descarta los fragmentos cuya distancia supera el umbral de relevancia."""
+    if not docs_with_scores:
+        print("BÚSQUEDA VECTORIAL: No se encontraron fragmentos (incluso con filtro).")
+        return []
+
+    print(f"BÚSQUEDA VECTORIAL: Se encontraron {len(docs_with_scores)} fragmentos candidatos.")
+
+    threshold = _get_similarity_threshold()
+    relevant_docs = []
+    for doc, score in docs_with_scores:
+        print(f"  - Documento candidato con puntuación: {score:.4f}")
+        if score < threshold:
+            relevant_docs.append(doc)
+
+    if relevant_docs:
+        print(f"BÚSQUEDA VECTORIAL: Se encontraron {len(relevant_docs)} fragmentos RELEVANTES (puntuación < {threshold}).")
+    else:
+        print(f"BÚSQUEDA VECTORIAL: Ningún fragmento superó el umbral de relevancia.")
+
+    return relevant_docs
+
+
+async def asearch_knowledge_base_vector(user_query: str, topic: str = None, mode: str = None) -> list:
+    """
+    Punto de entrada asíncrono de la búsqueda, con filtrado opcional por tema.
+
+    Pensado para llamadores que ya corren en un event loop (poller de Telegram,
+    vistas ASGI, `ainvoke` del grafo): el embedding de la consulta se espera
+    sobre el loop en curso y solo la consulta al índice local pasa a un hilo.
+    """
+    print(f"BÚSQUEDA VECTORIAL: Iniciando búsqueda asíncrona para la consulta: '{user_query}'")
+    try:
+        if not _check_preconditions():
+            return []
+
+        scopes = _build_search_scopes(topic)
+        query_embedding = await get_embeddings().aembed_query(user_query)
+        # Usamos functools.partial para pasar argumentos nombrados de forma segura a asyncio.to_thread
+        search_func = partial(_retrieve, user_query, query_embedding, scopes, mode)
+        return await asyncio.to_thread(search_func)
 
     except Exception as e:
         print(f"BÚSQUEDA VECTORIAL: Ocurrió un error al buscar en ChromaDB: {e}")
         return []
 
-# --- ¡CAMBIO 4: AÑADIDO NUEVO PARÁMETRO 'topic' AL ENVOLTORIO! ---
-def search_knowledge_base_vector(user_query: str, topic: str = None) -> list:
+
+def search_knowledge_base_vector(user_query: str, topic: str = None, mode: str = None) -> list:
     """
-    Envoltorio síncrono que ejecuta la búsqueda, pasando el filtro de tema.
+    Versión síncrona de la búsqueda, para los llamadores heredados (nodos
+    síncronos del grafo, orquestador). Corre en el hilo actual, sin crear
+    event loops.
     """
     print(f"BÚSQUEDA VECTORIAL: Iniciando búsqueda para la consulta: '{user_query}'")
     try:
-        # Aquí pasamos el 'topic' a la función asíncrona
-        return asyncio.run(_asearch_vector_store(user_query, topic=topic))
-    except RuntimeError as e:
-        if "cannot run loop while another loop is running" in str(e):
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            result = loop.run_until_complete(_asearch_vector_store(user_query, topic=topic))
-            loop.close()
-            return result
-        else:
-            raise e
+        if not _check_preconditions():
+            return []
+
+        scopes = _build_search_scopes(topic)
+        query_embedding = get_embeddings().embed_query(user_query)
+        return _retrieve(user_query, query_embedding, scopes, mode)
+
+    except Exception as e:
+        print(f"BÚSQUEDA VECTORIAL: Ocurrió un error al buscar en ChromaDB: {e}")
+        return []
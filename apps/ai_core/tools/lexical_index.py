@@ -0,0 +1,349 @@
+# apps/ai_core/tools/lexical_index.py
+
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo se serializan los hilos del proceso.
+    fcntl = None
+
+from django.conf import settings
+
+# Palabras vacías frecuentes en español: no aportan a la búsqueda exacta de términos.
+STOPWORDS = {
+    'a', 'al', 'algo', 'como', 'con', 'cual', 'de', 'del', 'el', 'en', 'es', 'esta', 'este', 'hay',
+    'la', 'las', 'le', 'lo', 'los', 'me', 'mi', 'mis', 'no', 'o', 'para', 'pero', 'por', 'que',
+    'se', 'si', 'sin', 'su', 'sus', 'tengo', 'un', 'una', 'uno', 'y', 'ya', 'yo',
+}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> list:
+    """Pasa a minúsculas, quita acentos y separa en términos, sin palabras vacías."""
+    text = unicodedata.normalize('NFKD', (text or '').casefold())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return [token for token in _TOKEN_RE.findall(text) if token not in STOPWORDS]
+
+
+class LexicalIndex:
+    """
+    Índice invertido con ranking BM25, guardado en disco junto a ChromaDB.
+
+    Cada fragmento se identifica con el mismo 'chunk_id' que usa ChromaDB, así
+    los resultados léxicos y vectoriales se pueden fusionar.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)   # término -> {chunk_id: frecuencia}
+        self.lengths = {}                   # chunk_id -> cantidad de términos
+        self.metadata = {}                  # chunk_id -> {'document_id', 'tema', 'subtema'}
+
+    # --------------------------------------------------------------------------
+    # Escritura
+    # --------------------------------------------------------------------------
+    def add(self, chunk_id: str, text: str, metadata: dict):
+        self.remove_chunks([chunk_id])
+        terms = Counter(tokenize(text))
+        for term, freq in terms.items():
+            self.postings[term][chunk_id] = freq
+        self.lengths[chunk_id] = sum(terms.values())
+        self.metadata[chunk_id] = {
+            'document_id': str(metadata.get('document_id')),
+            'tema': metadata.get('tema'),
+            'subtema': metadata.get('subtema'),
+        }
+
+    def remove_chunks(self, chunk_ids):
+        chunk_ids = {chunk_id for chunk_id in chunk_ids if chunk_id in self.lengths}
+        if not chunk_ids:
+            return
+        for term in list(self.postings):
+            entries = self.postings[term]
+            for chunk_id in chunk_ids & entries.keys():
+                del entries[chunk_id]
+            if not entries:
+                del self.postings[term]
+        for chunk_id in chunk_ids:
+            self.lengths.pop(chunk_id, None)
+            self.metadata.pop(chunk_id, None)
+
+    def remove_document(self, document_id):
+        document_id = str(document_id)
+        self.remove_chunks([cid for cid, meta in self.metadata.items() if meta['document_id'] == document_id])
+
+    def set_document_metadata(self, document_id, **metadata):
+        document_id = str(document_id)
+        for meta in self.metadata.values():
+            if meta['document_id'] == document_id:
+                meta.update(metadata)
+
+    # --------------------------------------------------------------------------
+    # Búsqueda
+    # --------------------------------------------------------------------------
+    def search(self, query: str, k: int = 5, where: dict = None) -> list:
+        """
+        Devuelve [(chunk_id, puntuación BM25)] ordenados de mayor a menor.
+        'where' filtra por metadatos con igualdad exacta, p. ej. {'tema': '...'}.
+        """
+        if not self.lengths:
+            return []
+        n_docs = len(self.lengths)
+        avg_len = sum(self.lengths.values()) / n_docs
+        scores = defaultdict(float)
+
+        for term in set(tokenize(query)):
+            entries = self.postings.get(term)
+            if not entries:
+                continue
+            idf = math.log(1 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            for chunk_id, freq in entries.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / avg_len)
+                scores[chunk_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+
+        if where:
+            scores = {
+                chunk_id: score for chunk_id, score in scores.items()
+                if all(self.metadata[chunk_id].get(key) == value for key, value in where.items())
+            }
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    # --------------------------------------------------------------------------
+    # Persistencia
+    # --------------------------------------------------------------------------
+    def to_dict(self) -> dict:
+        return {'k1': self.k1, 'b': self.b, 'postings': self.postings,
+                'lengths': self.lengths, 'metadata': self.metadata}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'LexicalIndex':
+        index = cls(k1=data.get('k1', 1.5), b=data.get('b', 0.75))
+        index.postings = defaultdict(dict, data.get('postings', {}))
+        index.lengths = data.get('lengths', {})
+        index.metadata = data.get('metadata', {})
+        return index
+
+
+# ==============================================================================
+# Instancia compartida por proceso
+# ==============================================================================
+# El índice vive en dos archivos: la base (lexical_index.json) y un registro de
+# altas (lexical_index.json.delta, una línea JSON por fragmento). La ingesta en
+# streaming solo agrega líneas al registro, sin releer ni reescribir la base en
+# cada tanda; al terminar cada documento se compacta todo en la base. Los
+# lectores aplican las líneas nuevas sobre una copia del índice que ya tenían.
+
+class LexicalIndexError(ValueError):
+    """El archivo del índice léxico (o su registro de altas) está dañado."""
+
+
+_lock = threading.RLock()          # estado del proceso (_index y lo leído de disco)
+_write_lock = threading.Lock()     # escritores del proceso; entre procesos, _file_lock
+_index = None
+_loaded_mtime = None
+_delta_offset = 0
+
+
+def get_lexical_index_path() -> str:
+    default = os.path.join(str(getattr(settings, 'CHROMA_PERSIST_DIRECTORY', os.path.join(settings.BASE_DIR, 'chroma_db'))), 'lexical_index.json')
+    return str(getattr(settings, 'LEXICAL_INDEX_PATH', None) or default)
+
+
+def _delta_path(path: str) -> str:
+    return path + '.delta'
+
+
+def _file_mtime(path: str):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+
+def _load_from_disk(path: str) -> LexicalIndex:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return LexicalIndex.from_dict(json.load(f))
+    except ValueError as e:
+        raise LexicalIndexError(f"{path}: {e}") from e
+
+
+def _read_delta(path: str, offset: int = 0):
+    """Devuelve (altas, offset final) del registro desde 'offset', solo con líneas completas."""
+    try:
+        with open(_delta_path(path), 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0
+    # Una línea sin '\n' final todavía se está escribiendo: se lee en la próxima.
+    complete = data[:data.rfind(b'\n') + 1]
+    try:
+        entries = [json.loads(line) for line in complete.splitlines() if line.strip()]
+    except ValueError as e:
+        raise LexicalIndexError(f"{_delta_path(path)}: {e}") from e
+    return entries, offset + len(complete)
+
+
+def _apply_delta(index: LexicalIndex, entries: list):
+    for entry in entries:
+        index.add(entry['id'], entry['text'], entry['metadata'])
+
+
+def _copy_index(index: LexicalIndex) -> LexicalIndex:
+    copy = LexicalIndex(k1=index.k1, b=index.b)
+    copy.postings = defaultdict(dict, {term: dict(entries) for term, entries in index.postings.items()})
+    copy.lengths = dict(index.lengths)
+    copy.metadata = {chunk_id: dict(meta) for chunk_id, meta in index.metadata.items()}
+    return copy
+
+
+def get_lexical_index() -> LexicalIndex:
+    """
+    Devuelve el índice léxico del proceso: recarga la base si cambió en disco y
+    aplica las altas nuevas del registro. Es de solo lectura: para modificarlo
+    usar update_lexical_index() o append_lexical_entries().
+    """
+    global _index, _loaded_mtime, _delta_offset
+    path = get_lexical_index_path()
+    with _lock:
+        mtime = _file_mtime(path)
+        if _index is None or mtime != _loaded_mtime:
+            index = LexicalIndex() if mtime is None else _load_from_disk(path)
+            entries, offset = _read_delta(path)
+            _apply_delta(index, entries)
+            if mtime is not None:
+                print(f"ÍNDICE LÉXICO: Cargado con {len(index.lengths)} fragmentos.")
+            _index, _loaded_mtime, _delta_offset = index, mtime, offset
+            return _index
+
+        offset = _delta_offset
+        if _file_size(_delta_path(path)) < offset:
+            offset = 0  # Otro proceso compactó el registro: se relee desde el comienzo.
+        entries, offset = _read_delta(path, offset)
+        if entries:
+            # Los lectores pueden estar recorriendo el índice actual: se modifica una copia.
+            index = _copy_index(_index)
+            _apply_delta(index, entries)
+            _index = index
+        _delta_offset = offset
+        return _index
+
+
+def _save(index: LexicalIndex, path: str):
+    """
+    Guarda el índice de forma atómica para que los lectores nunca vean un
+    archivo a medias (cada escritor usa su propio temporal) y vacía el
+    registro de altas, que ya quedó incluido.
+    """
+    global _index, _loaded_mtime, _delta_offset
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.lexical_index.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(index.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    open(_delta_path(path), 'wb').close()
+    with _lock:
+        _index, _loaded_mtime, _delta_offset = index, _file_mtime(path), 0
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Lock exclusivo entre procesos (workers de Celery, web) sobre un archivo auxiliar."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def append_lexical_entries(entries):
+    """
+    Agrega fragmentos [(chunk_id, texto, metadatos)] al registro de altas: el
+    costo es el de la tanda, no el del índice completo. Un fragmento que ya
+    estaba se reemplaza al aplicar el registro.
+    """
+    lines = ''.join(
+        json.dumps({'id': chunk_id, 'text': text, 'metadata': {
+            'document_id': str(metadata.get('document_id')),
+            'tema': metadata.get('tema'),
+            'subtema': metadata.get('subtema'),
+        }}, ensure_ascii=False) + '\n'
+        for chunk_id, text, metadata in entries
+    )
+    if not lines:
+        return
+    path = get_lexical_index_path()
+    with _write_lock, _file_lock(path):
+        with open(_delta_path(path), 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+
+@contextmanager
+def update_lexical_index():
+    """
+    Lee el índice desde disco (base más registro de altas), lo entrega para
+    modificarlo y lo guarda compactado, todo bajo un lock entre procesos: dos
+    ingestas simultáneas no se pisan las entradas. Uso:
+
+        with update_lexical_index() as index:
+            index.remove_chunks(ids)
+
+    Se trabaja sobre una copia recién leída: los lectores del proceso siguen
+    usando la anterior hasta que se guarda la nueva. Si el archivo está dañado
+    lanza LexicalIndexError en lugar de reemplazarlo: hay que reconstruirlo
+    desde ChromaDB ('sync_knowledge_base --rebuild-lexical').
+    """
+    path = get_lexical_index_path()
+    with _write_lock, _file_lock(path):
+        try:
+            index = _load_from_disk(path)
+        except FileNotFoundError:
+            index = LexicalIndex()
+        entries, _ = _read_delta(path)
+        _apply_delta(index, entries)
+        yield index
+        _save(index, path)
+
+
+def replace_lexical_index(index: LexicalIndex):
+    """Reemplaza el índice completo (reconstrucción) y descarta el registro de altas."""
+    path = get_lexical_index_path()
+    with _write_lock, _file_lock(path):
+        _save(index, path)
+
+
+def reset_lexical_index():
+    """Descarta el índice léxico del proceso; se vuelve a cargar en el próximo uso."""
+    global _index, _loaded_mtime, _delta_offset
+    with _lock:
+        _index = None
+        _loaded_mtime = None
+        _delta_offset = 0
@@ -0,0 +1,108 @@
+# apps/ai_core/tools/reranking.py
+
+import math
+
+from django.conf import settings
+
+from .lexical_index import tokenize
+
+# Largo del prefijo con el que se comparan términos: "requisito" y "requisitos"
+# o "apostillar" y "apostilla" cuentan como el mismo término.
+STEM_LENGTH = 6
+
+
+def _stems(text: str) -> set:
+    return {token[:STEM_LENGTH] for token in tokenize(text)}
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    """Secuencias de 'size' términos consecutivos: detectan pasajes casi idénticos."""
+    tokens = tokenize(text)
+    if len(tokens) < size:
+        return {tuple(tokens)} if tokens else set()
+    return {tuple(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def overlap(a: set, b: set) -> float:
+    """
+    Proporción del pasaje más corto contenida en el otro. A diferencia de
+    Jaccard, vale ~1 también cuando un pasaje es una copia ampliada del otro.
+    """
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def score_passages(query: str, docs: list) -> list:
+    """
+    Puntúa cada pasaje combinando su posición en la recuperación (prior) con la
+    cobertura de los términos de la consulta, ponderada por su rareza entre los
+    candidatos. Corre en CPU, sin modelos ni llamadas de red.
+    """
+    query_stems = _stems(query)
+    doc_stems = [_stems(doc.page_content) for doc in docs]
+    total = len(docs)
+    idf = {stem: math.log(1 + total / (1 + sum(stem in stems for stems in doc_stems))) for stem in query_stems}
+    query_weight = sum(idf.values()) or 1.0
+    prior_weight = getattr(settings, 'RERANK_PRIOR_WEIGHT', 0.5)
+
+    scores = []
+    for rank, stems in enumerate(doc_stems):
+        prior = (total - rank) / total
+        coverage = sum(weight for stem, weight in idf.items() if stem in stems) / query_weight
+        scores.append(prior_weight * prior + (1 - prior_weight) * coverage)
+    return scores
+
+
+def mmr_select(docs: list, relevance: list, top_n: int, diversity: float = 0.3,
+               duplicate_threshold: float = 0.8) -> list:
+    """
+    Maximal Marginal Relevance: elige uno a uno el pasaje con mejor
+    (1 - diversity) * relevancia - diversity * (máxima similitud con los ya elegidos).
+    Los pasajes cuya similitud con uno elegido supera 'duplicate_threshold' se descartan.
+
+    Devuelve los índices elegidos, en orden.
+    """
+    shingles = [_shingles(doc.page_content) for doc in docs]
+    remaining = list(range(len(docs)))
+    selected = []
+    while remaining and len(selected) < top_n:
+        best, best_score = None, None
+        for i in list(remaining):
+            max_similarity = max((overlap(shingles[i], shingles[j]) for j in selected), default=0.0)
+            if max_similarity >= duplicate_threshold:
+                remaining.remove(i)
+                continue
+            score = (1 - diversity) * relevance[i] - diversity * max_similarity
+            if best_score is None or score > best_score:
+                best, best_score = i, score
+        if best is None:
+            break
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+
+def rerank_passages(query: str, docs: list, top_n: int) -> list:
+    """
+    Reordena los candidatos recuperados y deja solo los pasajes distintos más útiles.
+    Los duplicados exactos (mismo 'chunk_hash', p. ej. el mismo archivo subido dos
+    veces) se eliminan antes del MMR.
+    """
+    unique_docs, seen_hashes = [], set()
+    for doc in docs:
+        chunk_hash = doc.metadata.get('chunk_hash') or doc.page_content
+        if chunk_hash in seen_hashes:
+            continue
+        seen_hashes.add(chunk_hash)
+        unique_docs.append(doc)
+
+    relevance = score_passages(query, unique_docs)
+    selected = mmr_select(
+        unique_docs, relevance, top_n,
+        diversity=getattr(settings, 'RERANK_MMR_DIVERSITY', 0.3),
+        duplicate_threshold=getattr(settings, 'RERANK_DUPLICATE_THRESHOLD', 0.8),
+    )
+    print(f"RERANKING: {len(docs)} candidatos, {len(docs) - len(unique_docs)} duplicados exactos, "
+          f"{len(selected)} pasajes elegidos.")
+    return [unique_docs[i] for i in selected]
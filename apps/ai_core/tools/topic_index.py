@@ -0,0 +1,169 @@
+# apps/ai_core/tools/topic_index.py
+
+import threading
+import time
+
+from django.conf import settings
+
+from .vector_store import get_loaded_index_version, get_vectorstore
+
+
+class TopicPartitionIndex:
+    """
+    Copia en memoria de los vectores de ChromaDB, particionada por tema y subtema.
+
+    Las filas se ordenan por (tema, subtema): cada tema ocupa un bloque
+    contiguo de la matriz y cada subtema un sub-bloque dentro de él. Una
+    búsqueda filtrada recorre solo su bloque (una vista, sin copiar), así el
+    costo depende del tamaño de la partición y no del de toda la base.
+    """
+
+    def __init__(self, ids: list, vectors, metadatas: list, documents: list):
+        import numpy as np
+
+        order = sorted(range(len(ids)), key=lambda i: (
+            (metadatas[i] or {}).get('tema') or '', (metadatas[i] or {}).get('subtema') or ''
+        ))
+        self.ids = [ids[i] for i in order]
+        self.metadatas = [metadatas[i] or {} for i in order]
+        self.documents = [documents[i] for i in order]
+        self.vectors = np.asarray(vectors, dtype=np.float32)[order] if len(order) else np.zeros((0, 0), dtype=np.float32)
+        self.squared_norms = (self.vectors ** 2).sum(axis=1)
+
+        # (tema,) y (tema, subtema) -> (inicio, fin) dentro de la matriz.
+        self.partitions = {}
+        for row, metadata in enumerate(self.metadatas):
+            for key in ((metadata.get('tema'),), (metadata.get('tema'), metadata.get('subtema'))):
+                if key[-1] is None:
+                    continue
+                start, _ = self.partitions.get(key, (row, row))
+                self.partitions[key] = (start, row + 1)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _slice_for(self, where: dict):
+        if not where:
+            return 0, len(self.ids)
+        key = (where.get('tema'), where['subtema']) if 'subtema' in where else (where.get('tema'),)
+        return self.partitions.get(key, (0, 0))
+
+    def search(self, query_embedding: list, k: int, where: dict = None) -> list:
+        """
+        Devuelve [(índice de fila, distancia L2 al cuadrado)] de los k vecinos más
+        cercanos dentro de la partición, la misma métrica que usa ChromaDB.
+        """
+        import numpy as np
+
+        start, end = self._slice_for(where)
+        if end <= start:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        block = self.vectors[start:end]
+        distances = self.squared_norms[start:end] - 2.0 * (block @ query) + float(query @ query)
+        k = min(k, end - start)
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [(start + int(i), max(0.0, float(distances[i]))) for i in nearest]
+
+    def search_documents(self, query_embedding: list, k: int, where: dict) -> list:
+        """Como search, pero devuelve [(Document, distancia)] como ChromaDB."""
+        from langchain_core.documents import Document
+        return [
+            (Document(page_content=self.documents[row], metadata=dict(self.metadatas[row])), distance)
+            for row, distance in self.search(query_embedding, k, where)
+        ]
+
+
+# ==============================================================================
+# Instancia compartida por proceso
+# ==============================================================================
+_lock = threading.Lock()
+# Solo un hilo por proceso actualiza el índice; los demás siguen con la copia vigente.
+_refresh_lock = threading.Lock()
+_index = None
+_index_version = None
+_index_collection = None
+_refreshed_at = 0.0
+
+
+def _refresh_seconds() -> float:
+    return getattr(settings, 'TOPIC_INDEX_REFRESH_SECONDS', 30.0)
+
+
+def _build_index(collection, previous):
+    """
+    Arma el índice a partir de la colección. Con un índice anterior de la misma
+    colección solo se descargan los vectores y textos de los fragmentos nuevos:
+    el 'chunk_id' sale del hash del texto, así que un id conocido tiene el mismo
+    vector. Los metadatos (tema, subtema) se leen siempre, porque la
+    reindexación los cambia sin cambiar el id.
+    """
+    import numpy as np
+
+    current = collection.get(include=['metadatas'])
+    known = {chunk_id: row for row, chunk_id in enumerate(previous.ids)} if previous is not None else {}
+    new_ids = [chunk_id for chunk_id in current['ids'] if chunk_id not in known]
+    fetched = {}
+    if new_ids:
+        data = collection.get(ids=new_ids, include=['embeddings', 'documents'])
+        fetched = {chunk_id: (vector, text) for chunk_id, vector, text in zip(data['ids'], data['embeddings'], data['documents'])}
+
+    ids, vectors, metadatas, documents = [], [], [], []
+    for chunk_id, metadata in zip(current['ids'], current['metadatas']):
+        if chunk_id in known:
+            row = known[chunk_id]
+            vector, text = previous.vectors[row], previous.documents[row]
+        elif chunk_id in fetched:
+            vector, text = fetched[chunk_id]
+        else:
+            continue  # Borrado entre las dos lecturas.
+        ids.append(chunk_id)
+        vectors.append(np.asarray(vector, dtype=np.float32))
+        metadatas.append(metadata)
+        documents.append(text)
+    return TopicPartitionIndex(ids, np.vstack(vectors) if vectors else [], metadatas, documents), len(new_ids)
+
+
+def get_topic_index() -> TopicPartitionIndex:
+    """
+    Devuelve el índice particionado. Cuando cambia la versión del índice en
+    disco (la misma señal que recarga ChromaDB) se actualiza de forma
+    incremental, como mucho cada TOPIC_INDEX_REFRESH_SECONDS: durante una
+    ingesta la versión cambia en cada tanda y no conviene reconstruir en cada
+    consulta. Mientras tanto, y mientras otro hilo actualiza, se usa la copia
+    vigente.
+    """
+    global _index, _index_version, _index_collection, _refreshed_at
+    vectorstore = get_vectorstore()
+    version, collection = get_loaded_index_version(), vectorstore._collection.name
+    with _lock:
+        index = _index
+        same_collection = index is not None and collection == _index_collection
+        if same_collection and (version == _index_version or time.monotonic() - _refreshed_at < _refresh_seconds()):
+            return index
+
+    # Sin índice (o con otra colección) hay que esperar; con uno vigente, no.
+    if not _refresh_lock.acquire(blocking=not same_collection):
+        return index
+    try:
+        with _lock:
+            if _index is not None and _index_collection == collection and _index_version == version:
+                return _index
+            previous = _index if _index_collection == collection else None
+        start = time.perf_counter()
+        new_index, downloaded = _build_index(vectorstore._collection, previous)
+        with _lock:
+            _index, _index_version, _index_collection, _refreshed_at = new_index, version, collection, time.monotonic()
+        print(f"ÍNDICE POR TEMA: {len(new_index)} fragmentos en {len(new_index.partitions)} particiones; "
+              f"{downloaded} descargados ({(time.perf_counter() - start) * 1000:.1f} ms).")
+        return new_index
+    finally:
+        _refresh_lock.release()
+
+
+def reset_topic_index():
+    global _index, _index_version, _index_collection, _refreshed_at
+    with _lock:
+        _index = _index_version = _index_collection = None
+        _refreshed_at = 0.0
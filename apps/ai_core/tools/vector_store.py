@@ -0,0 +1,220 @@
+# apps/ai_core/tools/vector_store.py
+
+import os
+import threading
+import time
+
+from django.conf import settings
+
+# Archivo "testigo" dentro de chroma_db. Cada proceso que escribe en el índice
+# (normalmente el worker de Celery) lo actualiza, y los demás procesos (web,
+# poller de Telegram) lo comparan con la versión que tienen cargada.
+INDEX_VERSION_FILENAME = '.index_version'
+
+_lock = threading.RLock()
+_embeddings = None
+_vectorstore = None
+_loaded_version = None
+
+_metrics = {
+    "open_time_ms": 0.0,
+    "open_count": 0,
+    "reuse_count": 0,
+    "reload_count": 0,
+    "last_opened_at": None,
+}
+
+
+def get_persist_directory() -> str:
+    """Devuelve la ruta del directorio persistente de ChromaDB."""
+    return str(getattr(settings, 'CHROMA_PERSIST_DIRECTORY', os.path.join(settings.BASE_DIR, 'chroma_db')))
+
+
+def _version_file_path() -> str:
+    return os.path.join(get_persist_directory(), INDEX_VERSION_FILENAME)
+
+
+def _read_index_version():
+    """Lee la versión actual del índice en disco (None si nunca se escribió)."""
+    try:
+        with open(_version_file_path(), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def get_embeddings():
+    """
+    Devuelve el cliente de embeddings del proceso, creándolo una sola vez.
+    El backend se elige con EMBEDDING_BACKEND en settings.
+    """
+    global _embeddings
+    with _lock:
+        if _embeddings is None:
+            from .embedding_backends import create_embeddings, get_embedding_backend, get_embedding_model_name
+            from .embedding_cache import CachedEmbeddings
+            embeddings = create_embeddings()
+            if get_embedding_backend()['remote']:
+                # Solo vale la pena cachear las consultas cuando cada embedding es una llamada de red.
+                disk_path = getattr(settings, 'EMBEDDING_CACHE_DISK_PATH', None)
+                embeddings = CachedEmbeddings(
+                    embeddings,
+                    model_name=get_embedding_model_name(),
+                    max_entries=getattr(settings, 'EMBEDDING_CACHE_MAX_ENTRIES', 1024),
+                    ttl_seconds=getattr(settings, 'EMBEDDING_CACHE_TTL_SECONDS', None),
+                    disk_path=str(disk_path) if disk_path else None,
+                    disk_max_entries=getattr(settings, 'EMBEDDING_CACHE_DISK_MAX_ENTRIES', None),
+                    disk_timeout=getattr(settings, 'EMBEDDING_CACHE_DISK_TIMEOUT_SECONDS', 1.0),
+                )
+            _embeddings = embeddings
+        return _embeddings
+
+
+def get_embedding_cache_metrics() -> dict:
+    """Devuelve los contadores de la caché de embeddings de consultas (vacío si no se creó)."""
+    with _lock:
+        embeddings = _embeddings
+    if embeddings is None or not hasattr(embeddings, 'get_metrics'):
+        return {}
+    return embeddings.get_metrics()
+
+
+def _check_collection_backend(collection):
+    """
+    Verifica que la colección fue creada con el backend de embeddings configurado.
+    Consultar vectores de otro modelo devolvería resultados sin sentido.
+    """
+    from .embedding_backends import (
+        LEGACY_BACKEND, LEGACY_COLLECTION_NAME, get_embedding_backend_name, get_embedding_model_name,
+    )
+    metadata = collection.metadata or {}
+    # La colección original no tiene metadatos: se creó con Gemini antes de existir los backends.
+    default_backend = LEGACY_BACKEND if collection.name == LEGACY_COLLECTION_NAME else None
+    recorded = (metadata.get('embedding_backend', default_backend), metadata.get('embedding_model'))
+    expected = (get_embedding_backend_name(), get_embedding_model_name())
+    if recorded[0] != expected[0] or (recorded[1] and recorded[1] != expected[1]):
+        raise ValueError(
+            f"La colección '{collection.name}' fue creada con el backend {recorded[0]} ({recorded[1]}) "
+            f"y la configuración actual usa {expected[0]} ({expected[1]}). "
+            "Reprocese los documentos con 'sync_knowledge_base --all --reembed'."
+        )
+
+
+def _close_client(vectorstore):
+    """
+    Detiene el "system" de Chroma del cliente y lo quita de la caché por ruta.
+    Solo vaciar la caché dejaría el anterior abierto (archivos, hilos y memoria del HNSW).
+    """
+    from chromadb.api.shared_system_client import SharedSystemClient
+    client = vectorstore._client
+    system = SharedSystemClient._identifier_to_system.pop(client._identifier, None)
+    if system is not None:
+        system.stop()
+
+
+def _open_vectorstore():
+    """Abre (o reabre) ChromaDB y registra el tiempo de apertura."""
+    global _vectorstore, _loaded_version
+    from langchain_community.vectorstores import Chroma
+    from .embedding_backends import get_collection_name, get_embedding_backend_name, get_embedding_model_name
+
+    if _vectorstore is not None:
+        # Chroma comparte un "system" por ruta dentro del proceso; hay que
+        # cerrarlo para que el segmento HNSW se vuelva a leer del disco.
+        _close_client(_vectorstore)
+
+    start = time.perf_counter()
+    version = _read_index_version()
+    vectorstore = Chroma(
+        collection_name=get_collection_name(),
+        persist_directory=get_persist_directory(),
+        embedding_function=get_embeddings(),
+        # Solo se aplica al crear la colección: queda registrado qué backend la generó.
+        collection_metadata={
+            'embedding_backend': get_embedding_backend_name(),
+            'embedding_model': get_embedding_model_name(),
+        },
+    )
+    _check_collection_backend(vectorstore._collection)
+    _vectorstore = vectorstore
+    _loaded_version = version
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    _metrics["open_time_ms"] = elapsed_ms
+    _metrics["open_count"] += 1
+    _metrics["last_opened_at"] = time.time()
+    print(f"VECTOR STORE: ChromaDB abierto en {elapsed_ms:.1f} ms "
+          f"(colección: {vectorstore._collection.name}, versión de índice: {version}).")
+
+
+def get_vectorstore():
+    """
+    Devuelve el almacén vectorial compartido por todo el proceso.
+
+    Se abre la primera vez que se necesita y se reutiliza en cada consulta.
+    Si otro proceso actualizó el índice desde la última apertura, se recarga.
+    """
+    with _lock:
+        if _vectorstore is None:
+            _open_vectorstore()
+        elif _read_index_version() != _loaded_version:
+            print("VECTOR STORE: El índice cambió en disco. Recargando...")
+            _metrics["reload_count"] += 1
+            _open_vectorstore()
+        else:
+            _metrics["reuse_count"] += 1
+        return _vectorstore
+
+
+def mark_index_updated():
+    """
+    Registra que el índice fue modificado para que los demás procesos lo recarguen.
+
+    Debe llamarse después de cada escritura en ChromaDB. El proceso que escribe
+    adopta la nueva versión sin recargar, porque su cliente ya ve los cambios.
+    """
+    global _loaded_version
+    persist_directory = get_persist_directory()
+    os.makedirs(persist_directory, exist_ok=True)
+
+    version = str(time.time_ns())
+    tmp_path = _version_file_path() + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(tmp_path, _version_file_path())
+
+    with _lock:
+        if _vectorstore is not None:
+            _loaded_version = version
+
+
+def get_vectorstore_metrics() -> dict:
+    """Devuelve una copia de las métricas del almacén vectorial de este proceso."""
+    with _lock:
+        return dict(_metrics)
+
+
+def reset_vectorstore():
+    """
+    Descarta el almacén vectorial y el cliente de embeddings del proceso.
+    La próxima llamada los vuelve a crear con la configuración vigente
+    (lo usan los benchmarks, que cambian de directorio y de backend).
+    """
+    global _embeddings, _vectorstore, _loaded_version
+    with _lock:
+        if _vectorstore is not None:
+            _close_client(_vectorstore)
+        _embeddings = None
+        _vectorstore = None
+        _loaded_version = None
+
+
+def get_index_version():
+    """Versión del índice en disco: cambia cada vez que algún proceso escribe en él."""
+    return _read_index_version()
+
+
+def get_loaded_index_version():
+    """Versión del índice que tiene abierta este proceso (cambia al recargar o al escribir)."""
+    with _lock:
+        return _loaded_version
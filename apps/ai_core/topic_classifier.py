@@ -0,0 +1,256 @@
+# apps/ai_core/topic_classifier.py
+
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import TopicDecision
+from .topics import TOPIC_HIERARCHY, clean_topic_name, get_master_topic_list, resolve_topic
+
+MODEL_FILENAME = 'topic_classifier.json'
+MODEL_VERSION = 1
+
+_lock = threading.Lock()
+_model = None
+_model_mtime = None
+
+
+def get_model_path() -> str:
+    """El modelo se guarda junto al índice (como el índice léxico), salvo que se indique otra ruta."""
+    path = getattr(settings, 'TOPIC_CLASSIFIER_PATH', None)
+    if path:
+        return str(path)
+    from .tools.vector_store import get_persist_directory
+    return os.path.join(get_persist_directory(), MODEL_FILENAME)
+
+
+def _embeddings():
+    # Siempre en CPU, sin red: el objetivo es no llamar a ninguna API en el camino rápido.
+    from .tools.embedding_backends import HashingEmbeddings
+    return HashingEmbeddings(dimensions=getattr(settings, 'LOCAL_EMBEDDING_DIMENSIONS', 512))
+
+
+def _family(label: str) -> str:
+    """Tema principal al que pertenece una etiqueta (él mismo si ya es principal)."""
+    return resolve_topic(label)[0]
+
+
+class TopicClassifier:
+    """
+    Clasificador por centroide más cercano: cada tema y subtema de
+    TOPIC_HIERARCHY tiene el promedio de los embeddings locales de sus ejemplos
+    (su nombre, los fragmentos indexados con ese tema y las consultas que el LLM
+    ya clasificó con confianza alta).
+
+    El margen es la diferencia de similitud entre la mejor etiqueta y la mejor
+    de OTRA familia: un subtema y su tema padre no compiten entre sí.
+    """
+
+    def __init__(self, labels: list, centroids, counts: dict, trained_at: str = None):
+        import numpy as np
+        self.labels = labels
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.counts = counts
+        self.trained_at = trained_at
+        self._families = [_family(label) for label in labels]
+
+    def predict(self, text: str):
+        """Devuelve (etiqueta, similitud, margen)."""
+        import numpy as np
+        query = np.asarray(_embeddings().embed_query(text), dtype=np.float32)
+        similarities = self.centroids @ query
+        order = np.argsort(-similarities)
+        best = int(order[0])
+        rival = next((int(i) for i in order[1:] if self._families[int(i)] != self._families[best]), None)
+        margin = float(similarities[best] - similarities[rival]) if rival is not None else float(similarities[best])
+        return self.labels[best], float(similarities[best]), margin
+
+    def to_dict(self) -> dict:
+        return {
+            'version': MODEL_VERSION,
+            'labels': self.labels,
+            'centroids': self.centroids.tolist(),
+            'counts': self.counts,
+            'trained_at': self.trained_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        if data.get('version') != MODEL_VERSION:
+            raise ValueError(f"Versión de modelo no soportada: {data.get('version')}")
+        return cls(data['labels'], data['centroids'], data['counts'], data.get('trained_at'))
+
+
+def collect_training_examples(include_names: bool = True, include_chunks: bool = True,
+                              include_decisions: bool = True) -> list:
+    """
+    Ejemplos (texto, etiqueta) para entrenar: el nombre de cada tema, los
+    fragmentos de la base de conocimiento (por su 'subtema' o 'tema') y las
+    consultas de tickets anteriores que el LLM clasificó con confianza alta.
+    """
+    examples = [(clean_topic_name(topic), topic) for topic in get_master_topic_list()] if include_names else []
+
+    if include_chunks:
+        from .tools.vector_store import get_vectorstore
+        data = get_vectorstore().get(include=['documents', 'metadatas'])
+        for text, metadata in zip(data['documents'], data['metadatas']):
+            metadata = metadata or {}
+            # El 'subtema' de un fragmento puede no figurar en TOPIC_HIERARCHY (p. ej. "General"):
+            # en ese caso el ejemplo cuenta para su tema.
+            for label in (metadata.get('subtema'), metadata.get('tema')):
+                main_topic, sub_topic = resolve_topic(label)
+                if main_topic in TOPIC_HIERARCHY:
+                    examples.append((text, sub_topic or main_topic))
+                    break
+
+    if include_decisions:
+        decisions = TopicDecision.objects.filter(origen=TopicDecision.Origen.LLM, confianza='alta')
+        for message, topic in decisions.values_list('mensaje', 'tema'):
+            main_topic, sub_topic = resolve_topic(topic)
+            if main_topic in TOPIC_HIERARCHY:
+                examples.append((message, sub_topic or main_topic))
+    return examples
+
+
+def train_classifier(examples: list) -> TopicClassifier:
+    """Calcula el centroide (normalizado) de cada etiqueta a partir de los ejemplos."""
+    import numpy as np
+    embeddings = _embeddings()
+    labels = get_master_topic_list()
+    index = {label: i for i, label in enumerate(labels)}
+    sums = np.zeros((len(labels), embeddings.dimensions), dtype=np.float32)
+    counts = {label: 0 for label in labels}
+    vectors = embeddings.embed_documents([text for text, _ in examples])
+    for (_, label), vector in zip(examples, vectors):
+        sums[index[label]] += vector
+        counts[label] += 1
+        # Los ejemplos de un subtema también cuentan para su tema padre.
+        parent = _family(label)
+        if parent != label:
+            sums[index[parent]] += vector
+            counts[parent] += 1
+    norms = np.linalg.norm(sums, axis=1, keepdims=True)
+    centroids = sums / np.where(norms == 0, 1.0, norms)
+    return TopicClassifier(labels, centroids, counts, trained_at=timezone.now().isoformat())
+
+
+def save_classifier(classifier: TopicClassifier, path: str = None) -> str:
+    path = path or get_model_path()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(classifier.to_dict(), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def get_classifier():
+    """
+    Devuelve el clasificador entrenado del proceso (None si no hay modelo).
+    Se recarga si el archivo cambió, p. ej. tras 'train_topic_classifier'.
+    """
+    global _model, _model_mtime
+    path = get_model_path()
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _lock:
+        if _model is None or mtime != _model_mtime:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    _model = TopicClassifier.from_dict(json.load(f))
+                _model_mtime = mtime
+            except (OSError, ValueError, KeyError) as e:
+                print(f"CLASIFICADOR LOCAL: No se pudo cargar el modelo ({e}).")
+                _model, _model_mtime = None, None
+        return _model
+
+
+def reset_classifier():
+    global _model, _model_mtime
+    with _lock:
+        _model, _model_mtime = None, None
+
+
+def classify_locally(text: str):
+    """
+    Camino rápido: devuelve (etiqueta, similitud, margen, confiable) o None si
+    está desactivado o no hay modelo. 'confiable' indica que se puede usar sin
+    consultar al LLM.
+    """
+    if not getattr(settings, 'TOPIC_CLASSIFIER_ENABLED', True) or not text:
+        return None
+    classifier = get_classifier()
+    if classifier is None:
+        return None
+    started = time.perf_counter()
+    label, similarity, margin = classifier.predict(text)
+    confident = (
+        margin >= getattr(settings, 'TOPIC_CLASSIFIER_MIN_MARGIN', 0.1)
+        and similarity >= getattr(settings, 'TOPIC_CLASSIFIER_MIN_SIMILARITY', 0.35)
+    )
+    print(f"CLASIFICADOR LOCAL: '{label}' (similitud {similarity:.3f}, margen {margin:.3f}) "
+          f"en {(time.perf_counter() - started) * 1000:.1f} ms. {'Se usa' if confident else 'Margen bajo, se consulta al LLM'}.")
+    return label, similarity, margin, confident
+
+
+def record_decision(ticket_id, message, topic, confidence, origin, local=None):
+    """Registra cada clasificación para las métricas y para reentrenar con las del LLM."""
+    local_topic, local_margin = (local[0], local[2]) if local else (None, None)
+    agrees = None
+    if origin == TopicDecision.Origen.LLM and local_topic is not None:
+        agrees = resolve_topic(local_topic) == resolve_topic(topic)
+    try:
+        TopicDecision.objects.create(
+            ticket_id=ticket_id, mensaje=message or '', tema=topic or '', confianza=confidence or '',
+            origen=origin, tema_local=local_topic, margen_local=local_margin, coincide=agrees,
+        )
+    except Exception as e:
+        print(f"CLASIFICADOR LOCAL: No se pudo registrar la decisión ({e}).")
+
+
+def get_topic_classifier_stats(days: int = 30) -> dict:
+    """Proporción de turnos resueltos por el camino rápido y coincidencia con el LLM."""
+    since = timezone.now() - timedelta(days=days)
+    totals = TopicDecision.objects.filter(fecha__gte=since).aggregate(
+        total=Count('id'),
+        local=Count('id', filter=Q(origen=TopicDecision.Origen.LOCAL)),
+        compared=Count('id', filter=Q(coincide__isnull=False)),
+        agreed=Count('id', filter=Q(coincide=True)),
+    )
+    return {
+        **totals,
+        'fast_path_rate': totals['local'] / totals['total'] if totals['total'] else 0.0,
+        'agreement_rate': totals['agreed'] / totals['compared'] if totals['compared'] else 0.0,
+    }
+
+
+def evaluate_classifier(classifier: TopicClassifier, examples: list) -> dict:
+    """
+    Precisión sobre ejemplos etiquetados (comparando tema y subtema resueltos),
+    proporción que el camino rápido respondería y precisión en esos casos.
+    """
+    min_margin = getattr(settings, 'TOPIC_CLASSIFIER_MIN_MARGIN', 0.1)
+    min_similarity = getattr(settings, 'TOPIC_CLASSIFIER_MIN_SIMILARITY', 0.35)
+    correct = confident = confident_correct = 0
+    for text, label in examples:
+        predicted, similarity, margin = classifier.predict(text)
+        hit = resolve_topic(predicted) == resolve_topic(label)
+        correct += hit
+        if margin >= min_margin and similarity >= min_similarity:
+            confident += 1
+            confident_correct += hit
+    total = len(examples)
+    return {
+        'examples': total,
+        'accuracy': correct / total if total else 0.0,
+        'fast_path_rate': confident / total if total else 0.0,
+        'fast_path_accuracy': confident_correct / confident if confident else 0.0,
+    }
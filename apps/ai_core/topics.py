@@ -32,4 +32,52 @@ def get_master_topic_list():
     for main_topic, sub_topics in TOPIC_HIERARCHY.items():
         master_list.append(main_topic)
         master_list.extend(sub_topics)
-    return master_list
\ No newline at end of file
+    return master_list
+
+# Los subtemas se guardaron con el prefijo "[cite_start]" (quedó del documento
+# de origen). Los fragmentos llevan el valor tal cual en 'subtema', así que el
+# prefijo solo se ignora al comparar nombres.
+CITE_PREFIX = "[cite_start]"
+
+
+def clean_topic_name(name):
+    """Nombre de tema sin el prefijo "[cite_start]" ni espacios sobrantes."""
+    name = (name or "").strip()
+    if name.startswith(CITE_PREFIX):
+        name = name[len(CITE_PREFIX):]
+    return name.strip()
+
+
+def resolve_topic(topic):
+    """
+    Traduce un tema elegido por el clasificador a los valores de los metadatos.
+
+    Devuelve (tema, subtema): para un tema principal, (tema, None); para un
+    subtema, (tema padre, subtema tal como figura en TOPIC_HIERARCHY). Un
+    nombre desconocido se devuelve como tema principal, igual que antes.
+    """
+    if not topic:
+        return None, None
+    wanted = clean_topic_name(topic).casefold()
+    for main_topic, sub_topics in TOPIC_HIERARCHY.items():
+        if main_topic.casefold() == wanted:
+            return main_topic, None
+        for sub_topic in sub_topics:
+            if clean_topic_name(sub_topic).casefold() == wanted:
+                return main_topic, sub_topic
+    return topic, None
+
+
+def build_search_scopes(topic):
+    """
+    Filtros de búsqueda del más estrecho al más amplio: subtema, tema padre y,
+    por último, toda la base. Cada elemento es (nombre del alcance, filtro).
+    """
+    main_topic, sub_topic = resolve_topic(topic)
+    scopes = []
+    if sub_topic:
+        scopes.append(("subtema", {"tema": main_topic, "subtema": sub_topic}))
+    if main_topic:
+        scopes.append(("tema", {"tema": main_topic}))
+    scopes.append(("todos", {}))
+    return scopes
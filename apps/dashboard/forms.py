@@ -1,9 +1,11 @@
 # apps/dashboard/forms.py
 
+import os
 from django import forms
 from apps.tickets.models import KnowledgeDocument
 # ¡Importamos nuestra jerarquía de temas!
 from apps.ai_core.topics import TOPIC_HIERARCHY
+from apps.tasks.loaders import SUPPORTED_EXTENSIONS
 
 def get_topic_choices():
     """
@@ -39,5 +41,14 @@ class DocumentUploadForm(forms.ModelForm):
         }
         labels = {
             'nombre': 'Nombre del Documento',
-            'archivo': 'Seleccionar Archivo (.pdf)',
-        }
\ No newline at end of file
+            'archivo': 'Seleccionar Archivo (.pdf, .docx, .txt)',
+        }
+
+    def clean_archivo(self):
+        archivo = self.cleaned_data['archivo']
+        extension = os.path.splitext(archivo.name)[1].lower()
+        if extension not in SUPPORTED_EXTENSIONS:
+            raise forms.ValidationError(
+                f"Formato no soportado. Formatos válidos: {', '.join(SUPPORTED_EXTENSIONS)}"
+            )
+        return archivo
\ No newline at end of file
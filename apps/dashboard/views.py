@@ -3,6 +3,12 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.db.models import Count, Avg
 from django.contrib import messages
 from apps.tickets.models import Ticket, KnowledgeDocument
+from apps.ai_core.answer_cache import get_answer_cache_stats
+from apps.ai_core.topic_classifier import get_topic_classifier_stats
+from apps.ai_core.instrumentation import get_graph_metrics
+from apps.ai_core.llm import get_chat_model_metrics
+from apps.ai_core.llm_gateway import get_llm_gateway_metrics
+from apps.ai_core.tools.vector_store import get_embedding_cache_metrics, get_vectorstore_metrics
 from .forms import DocumentUploadForm
 # --- ¡NUEVA IMPORTACIÓN! ---
 # Importamos nuestra nueva tarea de Celery para procesar documentos.
@@ -73,6 +79,13 @@ def dashboard_view(request):
         'status_data': status_data,
         'upload_form': form,
         'knowledge_documents': knowledge_documents,
+        'answer_cache': get_answer_cache_stats(),
+        'topic_classifier': get_topic_classifier_stats(),
+        'graph_metrics': get_graph_metrics(),
+        'llm_gateway': get_llm_gateway_metrics(),
+        'vectorstore': get_vectorstore_metrics(),
+        'embedding_cache': get_embedding_cache_metrics(),
+        'chat_models': get_chat_model_metrics(),
     }
     
     return render(request, 'dashboard/main.html', context)
@@ -0,0 +1,438 @@
+# apps/tasks/ingestion.py
+
+import hashlib
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+
+from apps.ai_core.tools.lexical_index import (
+    LexicalIndex,
+    LexicalIndexError,
+    append_lexical_entries,
+    replace_lexical_index,
+    update_lexical_index,
+)
+
+
+class TokenBucket:
+    """
+    Limitador de tasa tipo "token bucket", seguro entre hilos.
+    Cada llamada a la API de embeddings consume un token.
+    """
+
+    def __init__(self, rate_per_second: float, capacity: int = None, clock=None, sleep=None):
+        self.rate = rate_per_second
+        self.capacity = capacity or max(1, int(rate_per_second))
+        self.clock = clock or time.monotonic
+        self.sleep = sleep or time.sleep
+        self._tokens = float(self.capacity)
+        self._updated_at = self.clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 1):
+        """Bloquea hasta que haya tokens disponibles."""
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            self.sleep(wait)
+
+
+# Un bucket por proceso: la ingesta se guarda en tandas (ver DocumentChunkWriter)
+# y un bucket nuevo por tanda empezaría siempre lleno, sin respetar la cuota.
+_bucket_lock = threading.Lock()
+_buckets = {}
+
+
+def get_ingestion_bucket(embeddings):
+    """Token bucket compartido del proceso para INGESTION_REQUESTS_PER_MINUTE, o None con embeddings locales."""
+    # Los backends locales no consumen cuota de API: no hace falta limitar la tasa.
+    if getattr(embeddings, 'is_local', False):
+        return None
+    requests_per_minute = getattr(settings, 'INGESTION_REQUESTS_PER_MINUTE', 60)
+    capacity = getattr(settings, 'INGESTION_MAX_CONCURRENCY', 4)
+    with _bucket_lock:
+        bucket = _buckets.get((requests_per_minute, capacity))
+        if bucket is None:
+            bucket = _buckets[(requests_per_minute, capacity)] = TokenBucket(
+                rate_per_second=requests_per_minute / 60.0, capacity=capacity
+            )
+        return bucket
+
+
+class IngestionError(Exception):
+    """Se lanza cuando uno o más lotes no pudieron embeberse tras todos los reintentos."""
+
+
+def _make_batches(items: list, batch_size: int) -> list:
+    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+
+def embed_and_store_chunks(chunks: list, vectorstore, embeddings, ids: list = None, bucket=None) -> dict:
+    """
+    Embebe los fragmentos en lotes concurrentes y los guarda en ChromaDB.
+
+    - Los lotes se procesan con un máximo de INGESTION_MAX_CONCURRENCY en paralelo.
+    - Cada llamada a la API pasa por un token bucket (INGESTION_REQUESTS_PER_MINUTE);
+      por defecto el compartido del proceso (get_ingestion_bucket).
+    - Solo se reintentan los lotes que fallan, con backoff exponencial y jitter.
+
+    Devuelve estadísticas de la ingesta, incluido el throughput en fragmentos/s.
+    """
+    batch_size = getattr(settings, 'INGESTION_BATCH_SIZE', 64)
+    max_concurrency = getattr(settings, 'INGESTION_MAX_CONCURRENCY', 4)
+    max_retries = getattr(settings, 'INGESTION_MAX_RETRIES', 4)
+    retry_base_seconds = getattr(settings, 'INGESTION_RETRY_BASE_SECONDS', 2.0)
+
+    if ids is None:
+        ids = [str(uuid.uuid4()) for _ in chunks]
+
+    if bucket is None:
+        bucket = get_ingestion_bucket(embeddings)
+    write_lock = threading.Lock()
+    stats = {"chunks": len(chunks), "stored": 0, "batches": 0, "retries": 0, "failed_batches": 0}
+
+    def process_batch(batch_number, batch):
+        texts = [chunk.page_content for _, chunk in batch]
+        for attempt in range(max_retries + 1):
+            if bucket is not None:
+                bucket.acquire()
+            try:
+                vectors = embeddings.embed_documents(texts)
+                break
+            except Exception as e:
+                if attempt == max_retries:
+                    raise
+                delay = retry_base_seconds * (2 ** attempt) * random.uniform(0.5, 1.5)
+                print(f"INGESTA: Lote #{batch_number} falló ({e}). Reintento {attempt + 1}/{max_retries} en {delay:.1f}s.")
+                with write_lock:
+                    stats["retries"] += 1
+                time.sleep(delay)
+
+        # Las escrituras en ChromaDB se serializan; solo el embedding corre en paralelo.
+        with write_lock:
+            vectorstore._collection.upsert(
+                ids=[chunk_id for chunk_id, _ in batch],
+                embeddings=vectors,
+                metadatas=[chunk.metadata for _, chunk in batch],
+                documents=texts,
+            )
+            stats["stored"] += len(batch)
+
+    batches = _make_batches(list(zip(ids, chunks)), batch_size)
+    stats["batches"] = len(batches)
+
+    start = time.perf_counter()
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {executor.submit(process_batch, n, batch): n for n, batch in enumerate(batches)}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(f"lote #{futures[future]}: {e}")
+    elapsed = time.perf_counter() - start
+
+    stats["failed_batches"] = len(errors)
+    stats["seconds"] = elapsed
+    stats["chunks_per_second"] = stats["stored"] / elapsed if elapsed > 0 else 0.0
+    print(
+        f"INGESTA: {stats['stored']}/{len(chunks)} fragmentos en {len(batches)} lotes, {stats['retries']} reintentos, "
+        f"{elapsed:.1f}s ({stats['chunks_per_second']:.1f} fragmentos/s)."
+    )
+
+    if errors:
+        raise IngestionError(f"{len(errors)} lote(s) fallaron tras {max_retries} reintentos: " + "; ".join(errors))
+    return stats
+
+
+# ==============================================================================
+# Ingesta idempotente e incremental basada en hashes de contenido
+# ==============================================================================
+def build_topic_metadata(categoria: str) -> dict:
+    """
+    Traduce la categoría de un documento a los metadatos 'tema'/'subtema' de sus fragmentos.
+    Si la categoría es "TemaPrincipal/SubTema", los separamos.
+    """
+    if not categoria:
+        return {}
+    parts = categoria.split('/')
+    return {
+        'tema': parts[0],
+        'subtema': parts[1] if len(parts) > 1 else 'General',  # Un subtema por defecto
+    }
+
+
+def compute_file_hash(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Calcula el SHA-256 de un archivo leyéndolo por bloques."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def compute_chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def make_chunk_id(document_id, chunk_hash: str) -> str:
+    """ID estable de un fragmento en ChromaDB: mismo documento + mismo texto = mismo ID."""
+    return f"doc{document_id}-{chunk_hash[:32]}"
+
+
+def _iter_split_sections(file_path: str, chunk_size: int, chunk_overlap: int, workers: int = 1):
+    """
+    Genera los fragmentos crudos del archivo. Los PDF pueden parsearse en un
+    pool de procesos (workers > 1); si el pool no puede crearse (p. ej. dentro
+    de un worker "prefork" de Celery, cuyos procesos son daemon) se vuelve al
+    modo secuencial en streaming.
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_core.documents import Document
+    from .loaders import iter_document_sections
+
+    if workers > 1 and file_path.lower().endswith('.pdf'):
+        from concurrent.futures.process import BrokenProcessPool
+        from .parallel_parsing import iter_pdf_chunks_parallel
+        produced = False
+        try:
+            for text, metadata in iter_pdf_chunks_parallel(file_path, workers, chunk_size, chunk_overlap):
+                produced = True
+                yield Document(page_content=text, metadata=metadata)
+            return
+        except (AssertionError, OSError, BrokenProcessPool) as e:
+            if produced:
+                raise
+            print(f"INGESTA: No se pudo usar el pool de procesos ({e}). Se parsea en modo secuencial.")
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    for section in iter_document_sections(file_path):
+        yield from text_splitter.split_documents([section])
+
+
+def iter_document_chunks(file_path: str, document, workers: int = 1):
+    """
+    Lee el archivo página a página (o sección a sección), lo divide en fragmentos
+    y los enriquece con los metadatos del documento, todo de forma perezosa.
+    """
+    topic_metadata = build_topic_metadata(document.categoria)
+    raw_chunks = _iter_split_sections(
+        file_path,
+        chunk_size=getattr(settings, 'INGESTION_CHUNK_SIZE', 1000),
+        chunk_overlap=getattr(settings, 'INGESTION_CHUNK_OVERLAP', 200),
+        workers=workers,
+    )
+    for chunk_index, chunk in enumerate(raw_chunks):
+        chunk.metadata['document_id'] = str(document.id)
+        chunk.metadata['document_name'] = document.nombre
+        chunk.metadata['chunk_index'] = chunk_index
+        # Metadatos de tema a partir de la categoría guardada desde el formulario.
+        chunk.metadata.update(topic_metadata)
+        if chunk_index == 0:
+            print(f"CELERY: Ejemplo de metadatos del primer chunk: {chunk.metadata}")
+        yield chunk
+
+
+def _update_lexical_index(vectorstore, change):
+    """
+    Aplica 'change' al índice léxico (y compacta su registro de altas). Si el
+    archivo está dañado no se reemplaza por un índice vacío: se reconstruye
+    desde ChromaDB, que ya tiene el cambio aplicado.
+    """
+    try:
+        with update_lexical_index() as index:
+            change(index)
+    except LexicalIndexError as e:
+        print(f"ÍNDICE LÉXICO: Archivo dañado ({e}). Se reconstruye desde ChromaDB.")
+        rebuild_lexical_index(vectorstore)
+
+
+class DocumentChunkWriter:
+    """
+    Sincroniza en streaming los fragmentos de un documento con ChromaDB y el índice léxico.
+
+    Los fragmentos se agregan a medida que se generan y se guardan en tandas
+    de INGESTION_STREAM_FLUSH_SIZE, así los primeros quedan buscables antes
+    de terminar el archivo y la memoria no crece con su tamaño.
+
+    - Los fragmentos cuyo hash ya está indexado no se vuelven a embeber (solo se
+      actualizan sus metadatos, p. ej. 'chunk_index').
+    - Los fragmentos nuevos se embeben y se insertan.
+    - Al terminar, se eliminan los fragmentos que ya no existen en el archivo.
+    """
+
+    def __init__(self, document_id, vectorstore, embeddings, bucket=None):
+        self.document_id = document_id
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings
+        # Todas las tandas consumen del mismo bucket: la cuota se respeta en todo el documento.
+        self.bucket = bucket or get_ingestion_bucket(embeddings)
+        self.flush_size = getattr(
+            settings, 'INGESTION_STREAM_FLUSH_SIZE',
+            getattr(settings, 'INGESTION_BATCH_SIZE', 64) * getattr(settings, 'INGESTION_MAX_CONCURRENCY', 4)
+        )
+        self.existing_ids = set(vectorstore.get(where={"document_id": str(document_id)}, include=[])['ids'])
+        self.seen_ids = set()
+        self._pending_new = {}
+        self._pending_kept = {}
+        self._changed = False
+        self._started_at = time.perf_counter()
+        self.stats = {"chunks": 0, "stored": 0, "batches": 0, "retries": 0, "failed_batches": 0,
+                      "reused": 0, "deleted": 0, "total_chunks": 0}
+
+    def add(self, chunk):
+        chunk_hash = compute_chunk_hash(chunk.page_content)
+        chunk_id = make_chunk_id(self.document_id, chunk_hash)
+        # Un texto repetido dentro del mismo documento se indexa una sola vez.
+        if chunk_id in self.seen_ids:
+            return
+        self.seen_ids.add(chunk_id)
+        chunk.metadata['chunk_hash'] = chunk_hash
+        chunk.metadata['chunk_id'] = chunk_id
+
+        if chunk_id in self.existing_ids:
+            self._pending_kept[chunk_id] = chunk
+        else:
+            self._pending_new[chunk_id] = chunk
+        if len(self._pending_new) + len(self._pending_kept) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending_new and not self._pending_kept:
+            return
+
+        if self._pending_kept:
+            # En ChromaDB 'update' fusiona metadatos: ponemos a None el tema para
+            # que se borre si el documento ya no tiene categoría.
+            self.vectorstore._collection.update(
+                ids=list(self._pending_kept),
+                metadatas=[{'tema': None, 'subtema': None, **c.metadata} for c in self._pending_kept.values()]
+            )
+            self.stats["reused"] += len(self._pending_kept)
+
+        if self._pending_new:
+            batch_stats = embed_and_store_chunks(
+                list(self._pending_new.values()), self.vectorstore, self.embeddings,
+                ids=list(self._pending_new), bucket=self.bucket,
+            )
+            for key in ("chunks", "stored", "batches", "retries", "failed_batches"):
+                self.stats[key] += batch_stats[key]
+
+        # El índice léxico es local: cada tanda solo agrega sus fragmentos al
+        # registro de altas; se compacta una vez por documento en finish().
+        append_lexical_entries(
+            (chunk_id, chunk.page_content, chunk.metadata)
+            for chunk_id, chunk in {**self._pending_kept, **self._pending_new}.items()
+        )
+
+        self._pending_new, self._pending_kept = {}, {}
+        self._changed = True
+
+    def finish(self) -> dict:
+        """Guarda lo pendiente, elimina los fragmentos obsoletos y devuelve las estadísticas."""
+        self.flush()
+        stale_ids = list(self.existing_ids - self.seen_ids)
+        if stale_ids:
+            self.vectorstore._collection.delete(ids=stale_ids)
+        _update_lexical_index(self.vectorstore, lambda index: index.remove_chunks(stale_ids))
+        if self._changed or stale_ids:
+            # Una sola versión nueva por documento: cada cambio de versión obliga
+            # a los demás procesos a reabrir ChromaDB.
+            from apps.ai_core.tools.vector_store import mark_index_updated
+            mark_index_updated()
+
+        elapsed = time.perf_counter() - self._started_at
+        self.stats.update({
+            "deleted": len(stale_ids),
+            "total_chunks": len(self.seen_ids),
+            "seconds": elapsed,
+            "chunks_per_second": self.stats["stored"] / elapsed if self.stats["stored"] and elapsed > 0 else None,
+        })
+        print(
+            f"INGESTA: Documento #{self.document_id}: {self.stats['chunks']} fragmentos nuevos, "
+            f"{self.stats['reused']} reutilizados, {len(stale_ids)} eliminados."
+        )
+        return self.stats
+
+
+def sync_document_chunks(document_id, chunks, vectorstore, embeddings) -> dict:
+    """Sincroniza de una vez una secuencia (o generador) de fragmentos de un documento."""
+    writer = DocumentChunkWriter(document_id, vectorstore, embeddings)
+    for chunk in chunks:
+        writer.add(chunk)
+    return writer.finish()
+
+
+# ==============================================================================
+# Mantenimiento del índice: eliminación y reindexado por 'document_id'
+# ==============================================================================
+def delete_document_chunks(vectorstore, document_ids: list) -> int:
+    """Elimina de ChromaDB todos los fragmentos de los documentos indicados."""
+    document_ids = [str(document_id) for document_id in document_ids]
+    if not document_ids:
+        return 0
+    ids = vectorstore.get(where={"document_id": {"$in": document_ids}}, include=[])['ids']
+    if ids:
+        vectorstore._collection.delete(ids=ids)
+
+    def remove_documents(index):
+        for document_id in document_ids:
+            index.remove_document(document_id)
+    _update_lexical_index(vectorstore, remove_documents)
+    print(f"INDICE: Eliminados {len(ids)} fragmentos de los documentos {', '.join(document_ids)}.")
+    return len(ids)
+
+
+def update_document_metadata(vectorstore, document) -> int:
+    """
+    Actualiza nombre y tema de los fragmentos ya indexados de un documento,
+    sin volver a embeberlos. Devuelve la cantidad de fragmentos actualizados.
+    """
+    ids = vectorstore.get(where={"document_id": str(document.id)}, include=[])['ids']
+    if ids:
+        metadata = {'tema': None, 'subtema': None, 'document_name': document.nombre}
+        metadata.update(build_topic_metadata(document.categoria))
+        vectorstore._collection.update(ids=ids, metadatas=[dict(metadata) for _ in ids])
+
+        _update_lexical_index(vectorstore, lambda index: index.set_document_metadata(
+            document.id, tema=metadata['tema'], subtema=metadata['subtema']
+        ))
+    print(f"INDICE: Documento #{document.id}: {len(ids)} fragmentos reindexados (tema: '{document.categoria}').")
+    return len(ids)
+
+
+def rebuild_lexical_index(vectorstore, page_size: int = 1000) -> int:
+    """
+    Reconstruye el índice léxico desde los fragmentos guardados en ChromaDB
+    (p. ej. los indexados antes de que existiera, o tras un archivo dañado).
+    Devuelve la cantidad de fragmentos indexados.
+    """
+    index, offset = LexicalIndex(), 0
+    while True:
+        page = vectorstore.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        for chunk_id, text, metadata in zip(page['ids'], page['documents'], page['metadatas']):
+            index.add(chunk_id, text or '', metadata or {})
+        offset += len(page['ids'])
+    replace_lexical_index(index)
+    print(f"INDICE: Índice léxico reconstruido con {len(index.lengths)} fragmentos de ChromaDB.")
+    return len(index.lengths)
+
+
+def find_orphan_document_ids(vectorstore, known_document_ids) -> list:
+    """Devuelve los 'document_id' presentes en ChromaDB que ya no existen en la base de datos."""
+    known = {str(document_id) for document_id in known_document_ids}
+    metadatas = vectorstore.get(include=["metadatas"])['metadatas']
+    indexed = {str(m.get('document_id')) for m in metadatas if m and m.get('document_id') is not None}
+    return sorted(indexed - known)
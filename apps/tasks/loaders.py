@@ -0,0 +1,114 @@
+# apps/tasks/loaders.py
+
+import os
+import zipfile
+from xml.etree import ElementTree
+
+from langchain_core.documents import Document
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.txt', '.md')
+
+# Tamaño aproximado de cada sección emitida para DOCX y texto plano. Las
+# secciones se vuelven a dividir en fragmentos, así que solo acota la memoria.
+SECTION_MAX_CHARS = 8000
+# Tope de una sección de texto plano sin párrafos (líneas en blanco) donde cortar.
+TEXT_SECTION_HARD_MAX_CHARS = 4 * SECTION_MAX_CHARS
+
+_WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+class UnsupportedDocumentError(ValueError):
+    """El formato del archivo no está soportado por la ingesta."""
+
+
+def _iter_pdf_sections(file_path: str):
+    # PyPDFLoader.lazy_load lee y extrae el texto página por página.
+    from langchain_community.document_loaders import PyPDFLoader
+    yield from PyPDFLoader(file_path).lazy_load()
+
+
+def _run_text(node) -> str:
+    if node.tag == f'{_WORD_NS}t':
+        return node.text or ''
+    if node.tag in (f'{_WORD_NS}br', f'{_WORD_NS}cr'):
+        return '\n'
+    if node.tag == f'{_WORD_NS}tab':
+        return '\t'
+    return ''
+
+
+def _iter_docx_paragraphs(file_path: str):
+    """Recorre los párrafos de un .docx con iterparse, sin cargar todo el XML en memoria."""
+    body, body_depth, depth = None, None, 0
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open('word/document.xml') as xml_file:
+            for event, element in ElementTree.iterparse(xml_file, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if element.tag == f'{_WORD_NS}body':
+                        body, body_depth = element, depth
+                    continue
+                depth -= 1
+
+                paragraph = None
+                if element.tag == f'{_WORD_NS}p':
+                    style = element.find(f'{_WORD_NS}pPr/{_WORD_NS}pStyle')
+                    style_name = style.get(f'{_WORD_NS}val', '') if style is not None else ''
+                    text = ''.join(_run_text(node) for node in element.iter())
+                    paragraph = (text, style_name.lower().startswith(('heading', 'titulo', 'título', 'title')))
+                    element.clear()
+                # clear() vacía el elemento pero el cuerpo lo sigue referenciando:
+                # los hijos directos ya procesados (párrafos, tablas) se quitan del árbol.
+                if depth == body_depth:
+                    body.remove(element)
+                if paragraph is not None:
+                    yield paragraph
+
+
+def _iter_docx_sections(file_path: str):
+    """Agrupa párrafos en secciones: se corta en cada título o al llegar a SECTION_MAX_CHARS."""
+    buffer, size, section = [], 0, 0
+    for text, is_heading in _iter_docx_paragraphs(file_path):
+        if buffer and (is_heading or size >= SECTION_MAX_CHARS):
+            yield Document(page_content='\n'.join(buffer), metadata={'source': file_path, 'section': section})
+            buffer, size, section = [], 0, section + 1
+        if text.strip():
+            buffer.append(text)
+            size += len(text)
+    if buffer:
+        yield Document(page_content='\n'.join(buffer), metadata={'source': file_path, 'section': section})
+
+
+def _iter_text_sections(file_path: str):
+    """
+    Lee texto plano línea a línea y emite bloques de párrafos completos. Si el
+    archivo no tiene líneas en blanco (o tiene líneas enormes), corta igual al
+    llegar a TEXT_SECTION_HARD_MAX_CHARS para no acumularlo todo en memoria.
+    """
+    buffer, size, section = [], 0, 0
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in iter(lambda: f.readline(SECTION_MAX_CHARS), ''):
+            buffer.append(line)
+            size += len(line)
+            if (size >= SECTION_MAX_CHARS and not line.strip()) or size >= TEXT_SECTION_HARD_MAX_CHARS:
+                yield Document(page_content=''.join(buffer), metadata={'source': file_path, 'section': section})
+                buffer, size, section = [], 0, section + 1
+    if ''.join(buffer).strip():
+        yield Document(page_content=''.join(buffer), metadata={'source': file_path, 'section': section})
+
+
+def iter_document_sections(file_path: str):
+    """
+    Genera las páginas (PDF) o secciones (DOCX, texto) de un archivo de forma perezosa.
+    La memoria usada no depende del tamaño total del archivo.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.pdf':
+        return _iter_pdf_sections(file_path)
+    if extension == '.docx':
+        return _iter_docx_sections(file_path)
+    if extension in ('.txt', '.md'):
+        return _iter_text_sections(file_path)
+    raise UnsupportedDocumentError(
+        f"Formato '{extension}' no soportado. Formatos válidos: {', '.join(SUPPORTED_EXTENSIONS)}"
+    )
@@ -0,0 +1,90 @@
+# apps/tasks/parallel_parsing.py
+
+import math
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Este módulo corre también dentro de los procesos hijos del pool: las
+# funciones de trabajo no deben depender de Django ni del ORM.
+
+
+def _parse_pdf_page_range(file_path: str, start: int, end: int, chunk_size: int, chunk_overlap: int) -> list:
+    """
+    Extrae y divide en fragmentos las páginas [start, end) de un PDF.
+    Devuelve tuplas (texto, metadatos) para que el resultado sea liviano de serializar.
+    """
+    from pypdf import PdfReader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    reader = PdfReader(file_path)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    total_pages = len(reader.pages)
+
+    results = []
+    for page_number in range(start, end):
+        text = reader.pages[page_number].extract_text() or ''
+        try:
+            page_label = reader.page_labels[page_number]
+        except (IndexError, KeyError):
+            page_label = str(page_number + 1)
+        metadata = {'source': file_path, 'page': page_number, 'page_label': page_label, 'total_pages': total_pages}
+        for piece in splitter.split_text(text):
+            results.append((piece, dict(metadata)))
+    return results
+
+
+def count_pdf_pages(file_path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+
+def make_page_ranges(total_pages: int, workers: int, ranges_per_worker: int = 4) -> list:
+    """Divide las páginas en rangos contiguos; varios por worker para equilibrar la carga."""
+    if total_pages <= 0:
+        return []
+    pages_per_range = max(1, math.ceil(total_pages / (workers * ranges_per_worker)))
+    return [(start, min(start + pages_per_range, total_pages)) for start in range(0, total_pages, pages_per_range)]
+
+
+def iter_pdf_chunks_parallel(file_path: str, workers: int, chunk_size: int, chunk_overlap: int,
+                             max_in_flight: int = None):
+    """
+    Reparte el parseo de un PDF entre un pool de procesos, un rango de páginas por tarea.
+
+    Los resultados se consumen en el orden de los rangos, así el flujo combinado
+    conserva el orden original de las páginas (y por tanto de 'chunk_index'),
+    y se emiten apenas está listo el siguiente rango.
+
+    Solo hay 'max_in_flight' rangos enviados a la vez (por defecto 2 por
+    worker): si la ingesta consume más lento de lo que se parsea, los
+    fragmentos de un PDF enorme no se acumulan todos en memoria.
+    """
+    ranges = make_page_ranges(count_pdf_pages(file_path), workers)
+    max_in_flight = max(1, max_in_flight or 2 * workers)
+    print(f"PARSEO PARALELO: {len(ranges)} rangos de páginas en {workers} procesos "
+          f"(hasta {max_in_flight} en curso).")
+    pending_ranges = iter(ranges)
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        def submit_next():
+            page_range = next(pending_ranges, None)
+            if page_range is not None:
+                in_flight.append(executor.submit(_parse_pdf_page_range, file_path, *page_range,
+                                                 chunk_size, chunk_overlap))
+
+        try:
+            for _ in range(max_in_flight):
+                submit_next()
+            while in_flight:
+                results = in_flight.popleft().result()
+                submit_next()
+                yield from results
+        finally:
+            # Si quien consume deja de iterar, no se parsea el resto.
+            for future in in_flight:
+                future.cancel()
+
+
+def default_worker_count() -> int:
+    return max(1, (os.cpu_count() or 1) - 1)
@@ -3,6 +3,7 @@ from celery import shared_task
 from django.conf import settings
 
 from apps.tickets.models import Ticket, TechnicianProfile, KnowledgeDocument
+from apps.ai_core.answer_cache import invalidate_answers_for_documents
 from telegram_bot.sender import send_telegram_message_sync
 
 # ==============================================================================
@@ -53,75 +54,85 @@ def notify_technician_task(ticket_id):
         return "Ticket no encontrado."
 
 # ==============================================================================
-# Tarea de Procesamiento de Documentos (sin cambios)
+# Tarea de Procesamiento de Documentos
 # ==============================================================================
 @shared_task
-def process_document_task(document_id):
+def process_document_task(document_id, force=False, parse_workers=1):
     """
     Tarea de Celery para procesar un documento subido.
+
+    Es idempotente: si el archivo ya está indexado (por este documento o por
+    otro con el mismo contenido y categoría) no se vuelve a embeber. Con
+    force=True se reprocesa igualmente, pero solo se embeben los fragmentos
+    que cambiaron. Con parse_workers > 1 los PDF se parsean en un pool de
+    procesos (modo de carga masiva).
     """
-    # ... (código existente sin cambios)
     print(f"CELERY: Iniciando procesamiento para el Documento #{document_id}")
     try:
+        from .ingestion import compute_file_hash, delete_document_chunks, iter_document_chunks, sync_document_chunks
+
         doc = KnowledgeDocument.objects.get(id=document_id)
+        file_path = os.path.join(settings.MEDIA_ROOT, doc.archivo.name)
+        file_hash = compute_file_hash(file_path)
+
+        if not force and doc.hash_contenido == file_hash and doc.estado_procesamiento == KnowledgeDocument.Status.COMPLETED:
+            print(f"CELERY: El Documento #{doc.id} no cambió desde la última ingesta. Se omite.")
+            return f"Documento {document_id} sin cambios."
+
+        # Solo es duplicado si coincide también la categoría: los fragmentos
+        # se indexan con el metadato 'tema' del documento original.
+        duplicate_of = KnowledgeDocument.objects.filter(
+            hash_contenido=file_hash,
+            categoria=doc.categoria,
+            estado_procesamiento=KnowledgeDocument.Status.COMPLETED,
+            duplicado_de__isnull=True,
+        ).exclude(id=doc.id).first()
+
         doc.estado_procesamiento = KnowledgeDocument.Status.PROCESSING
+        doc.hash_contenido = file_hash
         doc.save()
 
-        file_path = os.path.join(settings.MEDIA_ROOT, doc.archivo.name)
-        
-        from langchain_community.document_loaders import PyPDFLoader
-        loader = PyPDFLoader(file_path)
-        documents = loader.load()
+        if duplicate_of:
+            print(f"CELERY: El Documento #{doc.id} es idéntico al #{duplicate_of.id}. No se indexa de nuevo.")
+            from apps.ai_core.tools.vector_store import get_vectorstore, mark_index_updated
+            vectorstore = get_vectorstore()
+            # Si antes tenía fragmentos propios (otra versión del archivo), se eliminan.
+            if delete_document_chunks(vectorstore, [doc.id]):
+                mark_index_updated()
+                invalidate_answers_for_documents([doc.id])
+            doc.duplicado_de = duplicate_of
+            doc.estado_procesamiento = KnowledgeDocument.Status.COMPLETED
+            doc.ultimo_error = None
+            doc.total_fragmentos = 0
+            doc.save()
+            return f"Documento {document_id} omitido: duplicado del Documento {duplicate_of.id}."
 
-        from langchain.text_splitter import RecursiveCharacterTextSplitter
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        chunks = text_splitter.split_documents(documents)
-        
-        print(f"CELERY: Enriqueciendo {len(chunks)} fragmentos con metadatos de tema...")
-        for i, chunk in enumerate(chunks):
-            # Metadatos existentes
-            chunk.metadata['document_id'] = str(doc.id)
-            chunk.metadata['document_name'] = doc.nombre
-            chunk.metadata['chunk_index'] = i
-            
-            # ¡NUEVOS METADATOS DE TEMA!
-            # Usamos la categoría guardada desde el formulario.
-            if doc.categoria:
-                # Si la categoría es "TemaPrincipal/SubTema", los separamos.
-                parts = doc.categoria.split('/')
-                chunk.metadata['tema'] = parts[0]
-                if len(parts) > 1:
-                    chunk.metadata['subtema'] = parts[1]
-                else:
-                    chunk.metadata['subtema'] = 'General' # Un subtema por defecto
-
-        # Imprimimos un ejemplo para verificar
-        if chunks:
-          print(f"CELERY: Ejemplo de metadatos del primer chunk: {chunks[0].metadata}")
-      
-
-        print(f"CELERY: Documento #{doc.id} dividido en {len(chunks)} fragmentos.")
-
-        gemini_api_key = os.getenv('GEMINI_API_KEY')
-        if not gemini_api_key:
-            raise ValueError("La clave de API de Gemini no está configurada en el archivo .env")
-
-        from langchain_google_genai import GoogleGenerativeAIEmbeddings
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=gemini_api_key)
-        
-        from langchain_community.vectorstores import Chroma
-        persist_directory = os.path.join(settings.BASE_DIR, 'chroma_db')
-        
-        vectorstore = Chroma.from_documents(
-            documents=chunks,
-            embedding=embeddings,
-            persist_directory=persist_directory
-        )
-        
+        # Las páginas/secciones se leen, dividen y embeben a medida que llegan:
+        # la memoria no depende del tamaño del archivo y los primeros fragmentos
+        # quedan buscables antes de terminar.
+        print(f"CELERY: Procesando en streaming el Documento #{doc.id} ({os.path.basename(file_path)})...")
+        from apps.ai_core.tools.vector_store import get_embeddings, get_vectorstore, mark_index_updated
+        # El almacén compartido del proceso valida la clave de API al crear los embeddings.
+        vectorstore = get_vectorstore()
+        try:
+            stats = sync_document_chunks(doc.id, iter_document_chunks(file_path, doc, workers=parse_workers), vectorstore, get_embeddings())
+        finally:
+            # Aunque falle algún lote, los que sí se guardaron deben ser visibles.
+            mark_index_updated()
+
+        # Las respuestas en caché que citaban este documento pueden haber quedado desactualizadas.
+        if stats["chunks"] or stats["deleted"]:
+            invalidate_answers_for_documents([doc.id])
+
+        print(f"CELERY: Documento #{doc.id} dividido en {stats['total_chunks']} fragmentos.")
         print(f"CELERY: Embeddings creados y guardados en ChromaDB para el Documento #{doc.id}")
 
         doc.estado_procesamiento = KnowledgeDocument.Status.COMPLETED
         doc.ultimo_error = None
+        doc.duplicado_de = None
+        doc.total_fragmentos = stats["total_chunks"]
+        if stats["chunks_per_second"] is not None:
+            doc.fragmentos_por_segundo = stats["chunks_per_second"]
         doc.save()
 
         return f"Documento {document_id} procesado exitosamente."
@@ -133,3 +144,111 @@ def process_document_task(document_id):
             doc.ultimo_error = str(e)
             doc.save()
         raise e
+
+# ==============================================================================
+# Tareas de Mantenimiento del Índice (eliminación y reindexado)
+# ==============================================================================
+@shared_task
+def delete_documents_task(document_ids, reprocess_ids=None):
+    """
+    Elimina de ChromaDB los fragmentos de documentos borrados.
+
+    'reprocess_ids' son documentos que eran duplicados de los borrados: como
+    sus fragmentos no estaban indexados, se procesan ahora para no perder el
+    contenido.
+    """
+    from apps.ai_core.tools.vector_store import get_vectorstore, mark_index_updated
+    from .ingestion import delete_document_chunks
+
+    print(f"CELERY: Eliminando del índice los documentos {document_ids}")
+    deleted = delete_document_chunks(get_vectorstore(), document_ids)
+    mark_index_updated()
+    invalidate_answers_for_documents(document_ids)
+
+    for document_id in reprocess_ids or []:
+        KnowledgeDocument.objects.filter(id=document_id).update(duplicado_de=None)
+        process_document_task.delay(document_id, force=True)
+
+    return f"{deleted} fragmentos eliminados de {len(document_ids)} documentos."
+
+
+@shared_task
+def reindex_documents_task(document_ids, reembed=False, run_now=False):
+    """
+    Sincroniza los metadatos de ChromaDB (nombre y tema) con los KnowledgeDocument.
+
+    Por defecto solo actualiza metadatos, sin llamar a la API de embeddings.
+    Los documentos sin fragmentos indexados, o todos si reembed=True, se
+    reprocesan completos (de forma incremental): en Celery, o en este mismo
+    proceso si run_now=True (sync_knowledge_base --now).
+    """
+    from apps.ai_core.tools.vector_store import get_vectorstore, mark_index_updated
+    from .ingestion import update_document_metadata
+
+    vectorstore = get_vectorstore()
+    updated = 0
+    for doc in KnowledgeDocument.objects.filter(id__in=document_ids):
+        if doc.duplicado_de_id:
+            continue
+        count = 0 if reembed else update_document_metadata(vectorstore, doc)
+        if count == 0:
+            if run_now:
+                process_document_task(doc.id, force=True)
+            else:
+                process_document_task.delay(doc.id, force=True)
+        updated += count
+    mark_index_updated()
+    # Cambió el tema o el nombre con que se citan: las respuestas guardadas ya no aplican.
+    invalidate_answers_for_documents(document_ids)
+
+    return f"{updated} fragmentos reindexados."
+
+
+@shared_task
+def rebuild_lexical_index_task():
+    """Reconstruye el índice léxico (BM25) desde los fragmentos de ChromaDB, sin llamar a la API."""
+    from apps.ai_core.tools.vector_store import get_vectorstore, mark_index_updated
+    from .ingestion import rebuild_lexical_index
+
+    count = rebuild_lexical_index(get_vectorstore())
+    mark_index_updated()
+    return f"Índice léxico reconstruido con {count} fragmentos."
+
+
+@shared_task
+def bulk_process_documents_task(document_ids, parse_workers=None, force=False):
+    """
+    Carga masiva: procesa varios documentos seguidos, parseando cada PDF en
+    paralelo (un rango de páginas por proceso) mientras el embedding corre en
+    lotes concurrentes. Conviene ejecutarla en un worker "solo" o desde el
+    comando 'ingest_knowledge_base', donde se pueden crear procesos hijos.
+    """
+    from .parallel_parsing import default_worker_count
+    parse_workers = parse_workers or getattr(settings, 'INGESTION_PARSE_WORKERS', None) or default_worker_count()
+
+    results = []
+    for document_id in document_ids:
+        try:
+            results.append(process_document_task(document_id, force=force, parse_workers=parse_workers))
+        except Exception as e:
+            # El error ya quedó registrado en el documento; seguimos con el resto.
+            results.append(f"Documento {document_id} falló: {e}")
+    return results
+
+
+# ==============================================================================
+# Tarea de Resumen de la Conversación
+# ==============================================================================
+@shared_task
+def update_conversation_summary_task(ticket_id):
+    """
+    Se encola después de cada turno: incorpora al resumen del ticket los
+    mensajes que ya no entran entre los últimos CONVERSATION_RECENT_TURNS.
+    """
+    from apps.ai_core.conversation_summary import update_conversation_summary
+
+    # Un ticket largo sin resumen previo se pone al día en varias pasadas.
+    passes = 0
+    while passes < 5 and update_conversation_summary(ticket_id):
+        passes += 1
+    return f"Resumen del ticket {ticket_id}: {passes} actualización(es)."
@@ -1,3 +1,358 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+import threading
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from langchain_core.documents import Document
+
+from apps.ai_core.tools import vector_store
+from apps.ai_core.tools.lexical_index import get_lexical_index, reset_lexical_index
+from apps.tickets.models import KnowledgeDocument
+from . import loaders, parallel_parsing, tasks
+from .ingestion import (
+    DocumentChunkWriter,
+    IngestionError,
+    TokenBucket,
+    compute_chunk_hash,
+    embed_and_store_chunks,
+    make_chunk_id,
+    sync_document_chunks,
+)
+
+
+class FakeClock:
+    """Reloj que solo avanza cuando alguien duerme."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.now += seconds
+
+
+class FakeCollection:
+    def __init__(self):
+        self.rows = {}
+        self.updated = {}
+        self.deleted = []
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        self.rows.update(zip(ids, documents))
+
+    def update(self, ids, metadatas):
+        self.updated.update(zip(ids, metadatas))
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+        for chunk_id in ids:
+            self.rows.pop(chunk_id, None)
+
+
+class FakeVectorStore:
+    def __init__(self, existing_ids=()):
+        self._collection = FakeCollection()
+        self.existing_ids = list(existing_ids)
+
+    def get(self, where=None, include=None):
+        return {'ids': list(self.existing_ids)}
+
+
+class FakeEmbeddings:
+    is_local = False
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(self.clock())
+        return [[0.0, 1.0] for _ in texts]
+
+
+class FlakyEmbeddings:
+    """Falla las primeras 'failures' llamadas de cada texto."""
+    is_local = True
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.attempts = {}
+
+    def embed_documents(self, texts):
+        key = texts[0]
+        self.attempts[key] = self.attempts.get(key, 0) + 1
+        if self.attempts[key] <= self.failures:
+            raise ConnectionError("503")
+        return [[1.0, 0.0] for _ in texts]
+
+
+@override_settings(INGESTION_BATCH_SIZE=2, INGESTION_MAX_CONCURRENCY=2, INGESTION_MAX_RETRIES=2,
+                   INGESTION_RETRY_BASE_SECONDS=0.0)
+class EmbedAndStoreRetryTests(SimpleTestCase):
+    def chunks(self, count):
+        return [Document(page_content=f"fragmento {number}", metadata={}) for number in range(count)]
+
+    def test_only_failed_batches_are_retried(self):
+        vectorstore, embeddings = FakeVectorStore(), FlakyEmbeddings(failures=2)
+        stats = embed_and_store_chunks(self.chunks(6), vectorstore, embeddings, ids=[f"id{n}" for n in range(6)])
+
+        self.assertEqual(stats["batches"], 3)
+        self.assertEqual(stats["stored"], 6)
+        self.assertEqual(stats["retries"], 6)
+        self.assertEqual(stats["failed_batches"], 0)
+        self.assertEqual(sorted(vectorstore._collection.rows), [f"id{n}" for n in range(6)])
+        self.assertEqual(set(embeddings.attempts.values()), {3})
+
+    def test_raises_after_exhausting_retries_but_keeps_the_other_batches(self):
+        vectorstore, embeddings = FakeVectorStore(), FlakyEmbeddings(failures=3)
+        embeddings.attempts["fragmento 0"] = embeddings.failures  # El primer lote ya agotó sus fallos.
+        with self.assertRaises(IngestionError):
+            embed_and_store_chunks(self.chunks(4), vectorstore, embeddings, ids=["a", "b", "c", "d"])
+        self.assertEqual(sorted(vectorstore._collection.rows), ["a", "b"])
+        self.assertEqual(embeddings.attempts["fragmento 2"], 3)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_starts_full_then_refills_at_the_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate_per_second=2.0, capacity=3, clock=clock, sleep=clock.sleep)
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(clock.now, 0.0)
+        bucket.acquire()
+        self.assertAlmostEqual(clock.now, 0.5)
+
+
+class TemporaryIndexMixin:
+    """ChromaDB y el índice léxico en un directorio temporal (la versión del índice y el BM25 se escriben ahí)."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            CHROMA_PERSIST_DIRECTORY=directory.name,
+            LEXICAL_INDEX_PATH=os.path.join(directory.name, 'lexical_index.json'),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_lexical_index()
+        self.addCleanup(reset_lexical_index)
+
+
+@override_settings(INGESTION_BATCH_SIZE=2, INGESTION_MAX_CONCURRENCY=4, INGESTION_STREAM_FLUSH_SIZE=8,
+                   INGESTION_REQUESTS_PER_MINUTE=60)
+class DocumentChunkWriterRateTests(TemporaryIndexMixin, SimpleTestCase):
+
+    def test_request_rate_holds_across_flushes(self):
+        clock = FakeClock()
+        embeddings = FakeEmbeddings(clock)
+        bucket = TokenBucket(rate_per_second=1.0, capacity=4, clock=clock, sleep=clock.sleep)
+        writer = DocumentChunkWriter(1, FakeVectorStore(), embeddings, bucket=bucket)
+        # 4 tandas de 8 fragmentos = 16 lotes de 2 = 16 llamadas a la API.
+        for number in range(32):
+            writer.add(Document(page_content=f"fragmento {number}", metadata={}))
+        stats = writer.finish()
+
+        self.assertEqual(stats["stored"], 32)
+        self.assertEqual(len(embeddings.calls), 16)
+        # Ráfaga inicial de 'capacity' llamadas y luego como mucho una por segundo.
+        for position, called_at in enumerate(sorted(embeddings.calls), start=1):
+            self.assertLessEqual(position, 4 + called_at * 1.0 + 1e-6)
+        self.assertGreaterEqual(clock.now, 12.0 - 1e-6)
+
+
+class ChunkIdTests(SimpleTestCase):
+    def test_same_document_and_text_give_the_same_id(self):
+        chunk_hash = compute_chunk_hash("Requisitos de la apostilla")
+        self.assertEqual(len(chunk_hash), 64)
+        self.assertEqual(make_chunk_id(7, chunk_hash), make_chunk_id("7", compute_chunk_hash("Requisitos de la apostilla")))
+        self.assertEqual(make_chunk_id(7, chunk_hash), f"doc7-{chunk_hash[:32]}")
+        self.assertNotEqual(make_chunk_id(8, chunk_hash), make_chunk_id(7, chunk_hash))
+        self.assertNotEqual(compute_chunk_hash("Requisitos de la apostilla."), chunk_hash)
+
+
+@override_settings(INGESTION_BATCH_SIZE=2, INGESTION_MAX_CONCURRENCY=1)
+class DocumentChunkWriterSyncTests(TemporaryIndexMixin, SimpleTestCase):
+    def chunk(self, text):
+        return Document(page_content=text, metadata={'document_id': '5', 'tema': 'Trámites y Documentación'})
+
+    def test_reuses_unchanged_chunks_embeds_new_ones_and_deletes_stale_ones(self):
+        kept_id = make_chunk_id(5, compute_chunk_hash("texto que no cambió"))
+        stale_id = make_chunk_id(5, compute_chunk_hash("texto que se borró"))
+        vectorstore = FakeVectorStore(existing_ids=[kept_id, stale_id])
+        embeddings = FlakyEmbeddings(failures=0)
+        chunks = [self.chunk("texto que no cambió"), self.chunk("texto nuevo"), self.chunk("texto nuevo")]
+
+        stats = sync_document_chunks(5, chunks, vectorstore, embeddings)
+
+        new_id = make_chunk_id(5, compute_chunk_hash("texto nuevo"))
+        self.assertEqual((stats["chunks"], stats["reused"], stats["deleted"], stats["total_chunks"]), (1, 1, 1, 2))
+        self.assertEqual(list(vectorstore._collection.rows), [new_id])
+        self.assertEqual(list(embeddings.attempts), ["texto nuevo"])
+        self.assertEqual(list(vectorstore._collection.updated), [kept_id])
+        self.assertIsNone(vectorstore._collection.updated[kept_id]['subtema'])
+        self.assertEqual(vectorstore._collection.deleted, [stale_id])
+        self.assertEqual(set(get_lexical_index().lengths), {kept_id, new_id})
+
+    @override_settings(INGESTION_STREAM_FLUSH_SIZE=2)
+    def test_index_version_changes_once_per_document(self):
+        writer = DocumentChunkWriter(5, FakeVectorStore(), FlakyEmbeddings(failures=0))
+        with mock.patch.object(vector_store, 'mark_index_updated') as mark_index_updated:
+            for number in range(5):
+                writer.add(self.chunk(f"fragmento {number}"))
+            mark_index_updated.assert_not_called()
+            writer.finish()
+        mark_index_updated.assert_called_once_with()
+
+    def test_unchanged_empty_document_keeps_the_index_version(self):
+        with mock.patch.object(vector_store, 'mark_index_updated') as mark_index_updated:
+            sync_document_chunks(5, [], FakeVectorStore(), FlakyEmbeddings(failures=0))
+        mark_index_updated.assert_not_called()
+
+
+class SyncKnowledgeBaseCommandTests(TestCase):
+    def setUp(self):
+        self.document = KnowledgeDocument.objects.create(nombre="Apostilla", archivo="knowledge_base/a.pdf")
+        for name in ('get_vectorstore', 'mark_index_updated'):
+            patcher = mock.patch.object(vector_store, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def reembed(self, *flags):
+        with mock.patch.object(tasks, 'process_document_task') as process_document_task:
+            call_command('sync_knowledge_base', '--reindex', str(self.document.id), '--reembed', *flags,
+                         stdout=io.StringIO())
+        return process_document_task
+
+    def test_now_processes_documents_in_this_process(self):
+        process_document_task = self.reembed('--now')
+        process_document_task.assert_called_once_with(self.document.id, force=True)
+        process_document_task.delay.assert_not_called()
+
+    def test_without_now_the_processing_is_queued(self):
+        with mock.patch.object(tasks.reindex_documents_task, 'delay') as delay:
+            self.reembed()
+        delay.assert_called_once_with([self.document.id], reembed=True, run_now=False)
+
+
+class RecordingExecutor:
+    """Ejecutor en el mismo proceso que registra cuántas tareas quedan sin consumir."""
+
+    def __init__(self, max_workers):
+        self.submitted = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, func, *args):
+        future = mock.Mock()
+        future.result.return_value = func(*args)
+        self.submitted.append(future)
+        return future
+
+
+class ParallelParsingTests(SimpleTestCase):
+    def test_keeps_a_bounded_number_of_page_ranges_in_flight(self):
+        executors = []
+        consumed = []
+
+        def make_executor(max_workers):
+            executors.append(RecordingExecutor(max_workers))
+            return executors[-1]
+
+        def parse(file_path, start, end, chunk_size, chunk_overlap):
+            return [(f"página {page}", {'page': page}) for page in range(start, end)]
+
+        with mock.patch.object(parallel_parsing, 'count_pdf_pages', return_value=40), \
+                mock.patch.object(parallel_parsing, '_parse_pdf_page_range', side_effect=parse), \
+                mock.patch.object(parallel_parsing, 'ProcessPoolExecutor', side_effect=make_executor):
+            for text, metadata in parallel_parsing.iter_pdf_chunks_parallel('a.pdf', 2, 100, 0):
+                # Rangos enviados que todavía no se empezaron a consumir (5 páginas por rango).
+                in_flight = len(executors[0].submitted) - (metadata['page'] // 5 + 1)
+                self.assertLessEqual(in_flight, 4)
+                consumed.append(metadata['page'])
+
+        self.assertEqual(consumed, list(range(40)))
+        self.assertEqual(len(executors[0].submitted), 8)
+
+    def test_stopping_early_cancels_the_pending_ranges(self):
+        executor = RecordingExecutor(2)
+        with mock.patch.object(parallel_parsing, 'count_pdf_pages', return_value=40), \
+                mock.patch.object(parallel_parsing, '_parse_pdf_page_range', return_value=[("texto", {})]), \
+                mock.patch.object(parallel_parsing, 'ProcessPoolExecutor', return_value=executor):
+            chunks = parallel_parsing.iter_pdf_chunks_parallel('a.pdf', 2, 100, 0)
+            next(chunks)
+            chunks.close()
+        self.assertEqual(len(executor.submitted), 5)
+        for future in executor.submitted[1:]:
+            future.cancel.assert_called_once_with()
+
+
+WORD = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+
+def docx_paragraph(text, style=None):
+    properties = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ''
+    return f'<w:p>{properties}<w:r><w:t>{text}</w:t></w:r></w:p>'
+
+
+class LoaderTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write_docx(self, body):
+        path = os.path.join(self.directory, 'guia.docx')
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr('word/document.xml', f'<w:document xmlns:w="{WORD}"><w:body>{body}</w:body></w:document>')
+        return path
+
+    def test_docx_sections_split_on_headings_and_include_tables(self):
+        table = f'<w:tbl><w:tr><w:tc>{docx_paragraph("Arancel: $100")}</w:tc></w:tr></w:tbl>'
+        path = self.write_docx(
+            docx_paragraph("Apostilla", "Heading1") + docx_paragraph("Se pide en línea.") + table
+            + docx_paragraph("Pasaporte", "Heading1") + docx_paragraph("Turno previo.")
+        )
+        sections = [doc.page_content for doc in loaders.iter_document_sections(path)]
+        self.assertEqual(sections, ["Apostilla\nSe pide en línea.\nArancel: $100", "Pasaporte\nTurno previo."])
+
+    def test_docx_paragraphs_are_removed_from_the_tree_once_read(self):
+        path = self.write_docx(''.join(docx_paragraph(f"párrafo {number}") for number in range(50)))
+        bodies = []
+        iterparse = loaders.ElementTree.iterparse
+
+        def recording_iterparse(*args, **kwargs):
+            for event, element in iterparse(*args, **kwargs):
+                if event == 'start' and element.tag.endswith('}body'):
+                    bodies.append(element)
+                yield event, element
+
+        with mock.patch.object(loaders.ElementTree, 'iterparse', side_effect=recording_iterparse):
+            for read, _ in enumerate(loaders._iter_docx_paragraphs(path), start=1):
+                # iterparse lee por bloques: puede haber párrafos parseados por
+                # adelantado, pero ninguno de los ya leídos sigue en el cuerpo.
+                self.assertLessEqual(len(bodies[0]), 50 - read)
+        self.assertEqual(len(bodies[0]), 0)
+
+    def test_text_without_blank_lines_is_cut_at_the_hard_limit(self):
+        path = os.path.join(self.directory, 'acta.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("línea sin párrafos\n" * 20000)
+        sections = list(loaders.iter_document_sections(path))
+        self.assertGreater(len(sections), 1)
+        self.assertTrue(all(len(doc.page_content) < loaders.TEXT_SECTION_HARD_MAX_CHARS + loaders.SECTION_MAX_CHARS
+                            for doc in sections))
+        self.assertEqual(sum(len(doc.page_content) for doc in sections), len("línea sin párrafos\n") * 20000)
@@ -3,6 +3,7 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 from .models import Ticket, LogInteraccion, TechnicianProfile
 from .models import Ticket, LogInteraccion, TechnicianProfile, KnowledgeDocument
+from apps.tasks.tasks import process_document_task, reindex_documents_task, delete_documents_task
 
 # ==============================================================================
 # Vista Personalizada para los Logs de Interacción (Inline)
@@ -39,7 +40,7 @@ class TicketAdmin(admin.ModelAdmin):
     search_fields = ('id', 'usuario__username', 'descripcion_inicial')
     
     # Campos de solo lectura en la vista de detalle.
-    readonly_fields = ('id', 'fecha_creacion', 'fecha_actualizacion')
+    readonly_fields = ('id', 'fecha_creacion', 'fecha_actualizacion', 'resumen_ultimo_log_id')
 
     # Muestra los logs de la conversación directamente en la página del ticket.
     inlines = [LogInteraccionInline]
@@ -73,7 +74,12 @@ class KnowledgeDocumentAdmin(admin.ModelAdmin):
     list_display = ('nombre', 'categoria', 'estado_procesamiento', 'cargado_por', 'fecha_carga')
     list_filter = ('estado_procesamiento', 'categoria', 'fecha_carga')
     search_fields = ('nombre', 'archivo')
-    readonly_fields = ('estado_procesamiento', 'cargado_por', 'fecha_carga', 'ultimo_error')
+    readonly_fields = (
+        'estado_procesamiento', 'cargado_por', 'fecha_carga', 'ultimo_error',
+        'total_fragmentos', 'fragmentos_por_segundo', 'hash_contenido', 'duplicado_de'
+    )
+
+    actions = ['reindex_documents', 'reprocess_documents']
 
     def save_model(self, request, obj, form, change):
         # Asigna automáticamente el usuario que está subiendo el archivo.
@@ -81,5 +87,39 @@ class KnowledgeDocumentAdmin(admin.ModelAdmin):
             obj.cargado_por = request.user
         super().save_model(request, obj, form, change)
 
+        # Si el archivo es nuevo o fue reemplazado, lo (re)procesamos en segundo plano.
+        # La tarea solo embebe los fragmentos que cambiaron.
+        if not change or 'archivo' in form.changed_data:
+            process_document_task.delay(obj.id)
+        elif 'categoria' in form.changed_data or 'nombre' in form.changed_data:
+            # Solo cambiaron metadatos: se actualizan en ChromaDB sin re-embeber.
+            reindex_documents_task.delay([obj.id])
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, KnowledgeDocument.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        # Guardamos los IDs antes de borrar: luego la tarea limpia ChromaDB en bloque.
+        document_ids = list(queryset.values_list('id', flat=True))
+        reprocess_ids = list(
+            KnowledgeDocument.objects.filter(duplicado_de__in=document_ids)
+            .exclude(id__in=document_ids).values_list('id', flat=True)
+        )
+        super().delete_queryset(request, queryset)
+        if document_ids:
+            delete_documents_task.delay(document_ids, reprocess_ids=reprocess_ids)
+
+    @admin.action(description="Reindexar tema y nombre en ChromaDB (sin re-embeber)")
+    def reindex_documents(self, request, queryset):
+        document_ids = list(queryset.values_list('id', flat=True))
+        reindex_documents_task.delay(document_ids)
+        self.message_user(request, f"Reindexado de {len(document_ids)} documento(s) en segundo plano.")
+
+    @admin.action(description="Reprocesar documentos (solo se embeben los fragmentos que cambiaron)")
+    def reprocess_documents(self, request, queryset):
+        document_ids = list(queryset.values_list('id', flat=True))
+        reindex_documents_task.delay(document_ids, reembed=True)
+        self.message_user(request, f"Reprocesamiento de {len(document_ids)} documento(s) en segundo plano.")
+
 
 
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.tickets.models import KnowledgeDocument
+from apps.tasks.tasks import bulk_process_documents_task
+
+
+class Command(BaseCommand):
+    help = (
+        'Carga masiva de la base de conocimiento: procesa varios documentos parseando '
+        'los PDF en paralelo en un pool de procesos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('document_ids', nargs='*', type=int, help='IDs de los documentos a procesar.')
+        parser.add_argument('--pending', action='store_true',
+                            help='Procesa todos los documentos pendientes o fallidos.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Procesos para el parseo (por defecto INGESTION_PARSE_WORKERS o núcleos - 1).')
+        parser.add_argument('--force', action='store_true',
+                            help='Reprocesa aunque el archivo no haya cambiado.')
+        parser.add_argument('--queue', action='store_true',
+                            help='Encola la carga en Celery en lugar de ejecutarla en este proceso.')
+
+    def handle(self, *args, **options):
+        document_ids = list(options['document_ids'])
+        if options['pending']:
+            document_ids += list(
+                KnowledgeDocument.objects.filter(
+                    estado_procesamiento__in=[KnowledgeDocument.Status.PENDING, KnowledgeDocument.Status.FAILED]
+                ).values_list('id', flat=True)
+            )
+        if not document_ids:
+            raise CommandError('No hay documentos para procesar. Indica IDs o usa --pending.')
+
+        if options['queue']:
+            bulk_process_documents_task.delay(document_ids, parse_workers=options['workers'], force=options['force'])
+            self.stdout.write(self.style.SUCCESS(f'Carga masiva de {len(document_ids)} documentos encolada.'))
+            return
+
+        # Por defecto corre en este proceso: aquí sí se pueden crear procesos hijos para el parseo.
+        for result in bulk_process_documents_task(document_ids, parse_workers=options['workers'], force=options['force']):
+            self.stdout.write(str(result))
+        self.stdout.write(self.style.SUCCESS('Carga masiva finalizada.'))
@@ -1,11 +1,13 @@
 import os
 import asyncio
+from collections import defaultdict
 import telegram
 import re
 from django.core.management.base import BaseCommand
 from telegram_bot.handlers import handle_message
 from apps.tickets.models import OutgoingTelegramMessage, TechnicianProfile
 from asgiref.sync import sync_to_async
+from django.conf import settings
 from telegram_bot.sender import send_telegram_message_sync
 from apps.ai_core.technician_actions import add_technician_reply
 
@@ -96,24 +98,43 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS('Iniciando bot de Telegram...'))
         asyncio.run(self.main_loop())
 
+    async def process_update(self, update):
+        """
+        Atiende un update. Los de un mismo chat se procesan en orden (un candado
+        por chat); los de chats distintos, en paralelo hasta TELEGRAM_MAX_CONCURRENT_TURNS.
+        """
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        async with self.chat_locks[chat_id]:
+            async with self.turn_semaphore:
+                try:
+                    # --- LÓGICA DE ENRUTAMIENTO ---
+                    # Primero, vemos si es una respuesta de un técnico
+                    is_technician_reply = await process_technician_reply(update)
+
+                    # Si no fue una respuesta de técnico, lo procesamos como un mensaje de usuario normal
+                    if not is_technician_reply:
+                        await handle_message(update)
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f'Error al procesar el update {update.update_id}: {e}'))
+
     async def main_loop(self):
         TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
         bot = telegram.Bot(token=TELEGRAM_BOT_TOKEN)
         update_id = 0
+        self.chat_locks = defaultdict(asyncio.Lock)
+        self.turn_semaphore = asyncio.Semaphore(getattr(settings, 'TELEGRAM_MAX_CONCURRENT_TURNS', 8))
+        pending_turns = set()
 
         while True:
             try:
                 updates = await bot.get_updates(offset=update_id, timeout=1)
                 for update in updates:
                     update_id = update.update_id + 1
-                    
-                    # --- LÓGICA DE ENRUTAMIENTO ---
-                    # Primero, vemos si es una respuesta de un técnico
-                    is_technician_reply = await process_technician_reply(update)
-                    
-                    # Si no fue una respuesta de técnico, lo procesamos como un mensaje de usuario normal
-                    if not is_technician_reply:
-                        await handle_message(update)
+                    # Cada turno corre como tarea aparte: el bucle sigue recibiendo
+                    # mensajes mientras otros esperan al LLM.
+                    task = asyncio.create_task(self.process_update(update))
+                    pending_turns.add(task)
+                    task.add_done_callback(pending_turns.discard)
 
                 # Buscamos y enviamos mensajes salientes
                 await process_outgoing_messages()
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.tickets.models import KnowledgeDocument
+from apps.tasks.tasks import delete_documents_task, rebuild_lexical_index_task, reindex_documents_task
+
+
+class Command(BaseCommand):
+    help = (
+        'Mantiene ChromaDB sincronizado con los KnowledgeDocument: elimina fragmentos, '
+        'reindexa temas, limpia fragmentos huérfanos y reconstruye el índice léxico.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', nargs='+', type=int, default=[], metavar='ID',
+                            help='IDs de documento cuyos fragmentos se eliminan del índice.')
+        parser.add_argument('--reindex', nargs='+', type=int, default=[], metavar='ID',
+                            help='IDs de documento cuyos metadatos (nombre/tema) se actualizan.')
+        parser.add_argument('--all', action='store_true',
+                            help='Reindexa todos los documentos procesados.')
+        parser.add_argument('--reembed', action='store_true',
+                            help='Reprocesa los documentos en lugar de solo actualizar metadatos.')
+        parser.add_argument('--prune-orphans', action='store_true',
+                            help='Elimina fragmentos de documentos que ya no existen en la base de datos.')
+        parser.add_argument('--rebuild-lexical', action='store_true',
+                            help='Reconstruye el índice léxico (BM25) desde los fragmentos de ChromaDB.')
+        parser.add_argument('--now', action='store_true',
+                            help='Ejecuta en este proceso en lugar de encolar en Celery.')
+
+    def _run(self, task, *args, **kwargs):
+        if self.run_now:
+            return task(*args, **kwargs)
+        task.delay(*args, **kwargs)
+        return f"Tarea '{task.name}' encolada."
+
+    def handle(self, *args, **options):
+        self.run_now = options['now']
+        if not any([options['delete'], options['reindex'], options['all'], options['prune_orphans'],
+                    options['rebuild_lexical']]):
+            raise CommandError(
+                'Indica al menos una operación: --delete, --reindex, --all, --prune-orphans o --rebuild-lexical.'
+            )
+
+        delete_ids = list(options['delete'])
+        if options['prune_orphans']:
+            from apps.ai_core.tools.vector_store import get_vectorstore
+            from apps.tasks.ingestion import find_orphan_document_ids
+            known_ids = KnowledgeDocument.objects.values_list('id', flat=True)
+            orphans = find_orphan_document_ids(get_vectorstore(), known_ids)
+            self.stdout.write(f"Documentos huérfanos en el índice: {orphans or 'ninguno'}")
+            delete_ids.extend(orphans)
+
+        if delete_ids:
+            self.stdout.write(self._run(delete_documents_task, delete_ids))
+
+        reindex_ids = list(options['reindex'])
+        if options['all']:
+            reindex_ids = list(
+                KnowledgeDocument.objects.filter(estado_procesamiento=KnowledgeDocument.Status.COMPLETED)
+                .values_list('id', flat=True)
+            )
+        if reindex_ids:
+            self.stdout.write(self._run(
+                reindex_documents_task, reindex_ids, reembed=options['reembed'], run_now=self.run_now
+            ))
+
+        if options['rebuild_lexical']:
+            self.stdout.write(self._run(rebuild_lexical_index_task))
+
+        self.stdout.write(self.style.SUCCESS('Sincronización de la base de conocimiento finalizada.'))
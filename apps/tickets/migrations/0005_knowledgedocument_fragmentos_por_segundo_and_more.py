@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0004_outgoingtelegrammessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgedocument',
+            name='fragmentos_por_segundo',
+            field=models.FloatField(blank=True, help_text='Throughput de la última ingesta (embedding + escritura en ChromaDB).', null=True, verbose_name='Fragmentos por Segundo'),
+        ),
+        migrations.AddField(
+            model_name='knowledgedocument',
+            name='total_fragmentos',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Total de Fragmentos'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-17 17:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0005_knowledgedocument_fragmentos_por_segundo_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgedocument',
+            name='duplicado_de',
+            field=models.ForeignKey(blank=True, help_text='Documento ya indexado con el mismo contenido. Los duplicados no se vuelven a embeber.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicados', to='tickets.knowledgedocument', verbose_name='Duplicado de'),
+        ),
+        migrations.AddField(
+            model_name='knowledgedocument',
+            name='hash_contenido',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True, verbose_name='Hash del Contenido (SHA-256)'),
+        ),
+    ]
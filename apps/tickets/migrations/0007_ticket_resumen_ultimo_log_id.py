@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0006_knowledgedocument_duplicado_de_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='resumen_ultimo_log_id',
+            field=models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Último Log Resumido'),
+        ),
+    ]
@@ -39,6 +39,10 @@ class Ticket(models.Model):
     descripcion_confirmada_ia = models.TextField(
         blank=True, null=True, verbose_name="Resumen de la IA"
     )
+    # Último LogInteraccion incorporado al resumen (ver apps/ai_core/conversation_summary.py).
+    resumen_ultimo_log_id = models.PositiveBigIntegerField(
+        null=True, blank=True, verbose_name="Último Log Resumido"
+    )
     calificacion = models.IntegerField(
         choices=Calificacion.choices, null=True, blank=True, verbose_name="Calificación del Usuario"
     )
@@ -124,6 +128,19 @@ class KnowledgeDocument(models.Model):
     )
     fecha_carga = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Carga")
     ultimo_error = models.TextField(blank=True, null=True, verbose_name="Último Error")
+    total_fragmentos = models.PositiveIntegerField(null=True, blank=True, verbose_name="Total de Fragmentos")
+    fragmentos_por_segundo = models.FloatField(
+        null=True, blank=True, verbose_name="Fragmentos por Segundo",
+        help_text="Throughput de la última ingesta (embedding + escritura en ChromaDB)."
+    )
+    hash_contenido = models.CharField(
+        max_length=64, blank=True, null=True, db_index=True, verbose_name="Hash del Contenido (SHA-256)"
+    )
+    duplicado_de = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, related_name="duplicados",
+        verbose_name="Duplicado de",
+        help_text="Documento ya indexado con el mismo contenido. Los duplicados no se vuelven a embeber."
+    )
 
     def __str__(self):
         return self.nombre
@@ -6,6 +6,8 @@ app_name = 'tickets'
 urlpatterns = [
     # Ruta existente para el chat
     path('', views.chat_view, name='chat'),
+    # Envía un mensaje y recibe la respuesta en streaming (server-sent events).
+    path('stream/', views.chat_stream_view, name='chat_stream'),
     # Esta ruta manejará la lógica para iniciar una nueva conversación.
     path('nuevo/', views.new_chat_view, name='new_chat'),
     # Esta ruta recibirá el ID del ticket y la calificación (un número del 1 al 5).
@@ -1,8 +1,15 @@
 
+import json
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.views.decorators.http import require_POST
 from .models import Ticket, LogInteraccion
-from apps.ai_core.graph import app as langgraph_app
+from apps.ai_core.graph import app as langgraph_app, get_ticket_graph_state, turn_kwargs
+from apps.ai_core.streaming import stream_graph_response
+from apps.ai_core.instrumentation import track_turn
+from apps.ai_core.conversation_summary import schedule_summary_update
 
 @login_required
 def chat_view(request, ticket_id=None):
@@ -27,44 +34,13 @@ def chat_view(request, ticket_id=None):
         except Ticket.DoesNotExist:
             del request.session['active_ticket_id']
 
-    graph_state = request.session.get('graph_state', {})
-
     if request.method == 'POST':
         mensaje_usuario = request.POST.get('mensaje', '').strip()
         if mensaje_usuario:
-            # Lógica para crear un ticket nuevo si es necesario (ESTA PARTE ESTÁ BIEN)
-            if not ticket_activo or ticket_activo.estado in [Ticket.Estado.RESUELTO_BOT, Ticket.Estado.RESUELTO_TECNICO, Ticket.Estado.CERRADO]:
-                ticket_activo = Ticket.objects.create(
-                    usuario=request.user,
-                    descripcion_inicial=mensaje_usuario,
-                    estado=Ticket.Estado.EN_PROCESO # ¡Mejora! Nace 'En Proceso'.
-                )
-                request.session['active_ticket_id'] = ticket_activo.id
-
-            # Guardamos el mensaje del usuario (ESTA PARTE ESTÁ BIEN)
-            LogInteraccion.objects.create(
-                ticket=ticket_activo,
-                mensaje=mensaje_usuario,
-                emisor=LogInteraccion.Emisor.USUARIO
-            )
-
-            # --- ¡INTEGRACIÓN CON LANGGRAPH! ---
-            initial_state = {
-                "ticket_id": ticket_activo.id,
-                "user_input": mensaje_usuario,
-                "current_topic": graph_state.get("current_topic"),
-                "topic_locked": graph_state.get("topic_locked", False),
-                "clarification_attempts": graph_state.get("clarification_attempts", 0),
-            }
-            final_state = langgraph_app.invoke(initial_state)
-
-            # Guardamos la respuesta final generada por el grafo (ESTA PARTE ESTÁ BIEN)
-            if final_state.get("final_response"):
-                LogInteraccion.objects.create(
-                    ticket=ticket_activo,
-                    mensaje=final_state["final_response"],
-                    emisor=LogInteraccion.Emisor.SISTEMA
-                )
+            ticket_activo, initial_state = _start_turn(request, ticket_activo, mensaje_usuario)
+            with track_turn(ticket_activo.id, Ticket.Canal.WEB):
+                final_state = langgraph_app.invoke(initial_state, **turn_kwargs(ticket_activo.id))
+            _save_bot_response(ticket_activo, final_state)
 
             # ¡YA NO HACEMOS NADA MÁS! EL TICKET SIGUE 'EN PROCESO'.
 
@@ -74,10 +50,103 @@ def chat_view(request, ticket_id=None):
         'tickets_del_usuario': tickets_del_usuario,
         'ticket_activo': ticket_activo,
         'logs_conversacion': logs_conversacion,
+        # El estado del grafo es del ticket (no de la sesión): es el mismo desde cualquier canal.
+        'graph_state': get_ticket_graph_state(ticket_activo.id) if ticket_activo else {},
     }
     return render(request, 'tickets/chat.html', context)
 
 
+def _get_active_ticket(request):
+    active_ticket_id = request.session.get('active_ticket_id')
+    if not active_ticket_id:
+        return None
+    return Ticket.objects.filter(id=active_ticket_id, usuario=request.user).first()
+
+
+def _start_turn(request, ticket_activo, mensaje_usuario):
+    """
+    Registra el mensaje del usuario (creando un ticket si hace falta) y arma la
+    entrada del turno. El resto del estado (tema, intentos de aclaración...) lo
+    retoma el grafo del checkpoint del ticket. Devuelve (ticket, estado inicial).
+    """
+    # Lógica para crear un ticket nuevo si es necesario (ESTA PARTE ESTÁ BIEN)
+    if not ticket_activo or ticket_activo.estado in [Ticket.Estado.RESUELTO_BOT, Ticket.Estado.RESUELTO_TECNICO, Ticket.Estado.CERRADO]:
+        ticket_activo = Ticket.objects.create(
+            usuario=request.user,
+            descripcion_inicial=mensaje_usuario,
+            estado=Ticket.Estado.EN_PROCESO # ¡Mejora! Nace 'En Proceso'.
+        )
+        request.session['active_ticket_id'] = ticket_activo.id
+
+    # Guardamos el mensaje del usuario (ESTA PARTE ESTÁ BIEN)
+    LogInteraccion.objects.create(
+        ticket=ticket_activo,
+        mensaje=mensaje_usuario,
+        emisor=LogInteraccion.Emisor.USUARIO
+    )
+
+    # --- ¡INTEGRACIÓN CON LANGGRAPH! ---
+    initial_state = {
+        "ticket_id": ticket_activo.id,
+        "user_input": mensaje_usuario,
+    }
+    return ticket_activo, initial_state
+
+
+def _save_bot_response(ticket_activo, final_state):
+    # Guardamos la respuesta final generada por el grafo (ESTA PARTE ESTÁ BIEN)
+    if final_state.get("final_response"):
+        LogInteraccion.objects.create(
+            ticket=ticket_activo,
+            mensaje=final_state["final_response"],
+            emisor=LogInteraccion.Emisor.SISTEMA
+        )
+    schedule_summary_update(ticket_activo.id)
+
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@login_required
+@require_POST
+def chat_stream_view(request):
+    """
+    Igual que el POST de 'chat_view', pero devuelve la respuesta como
+    server-sent events mientras se genera: eventos 'token' con cada fragmento
+    y un evento 'done' con la respuesta completa al terminar.
+    """
+    mensaje_usuario = request.POST.get('mensaje', '').strip()
+    if not mensaje_usuario:
+        return HttpResponseBadRequest("El mensaje está vacío.")
+
+    ticket_activo, initial_state = _start_turn(request, _get_active_ticket(request), mensaje_usuario)
+    # La sesión se guarda al devolver la respuesta, antes de recorrer el generador.
+    request.session.modified = True
+
+    def events():
+        final_state = {}
+        try:
+            with track_turn(ticket_activo.id, Ticket.Canal.WEB):
+                for event, data in stream_graph_response(initial_state):
+                    if event == "token":
+                        yield _sse_event("token", {"text": data})
+                    else:
+                        final_state = data
+        except Exception as e:
+            print(f"CHAT: Error durante el streaming del Ticket #{ticket_activo.id}: {e}")
+            yield _sse_event("error", {"message": "Lo siento, no pude procesar tu solicitud."})
+            return
+        _save_bot_response(ticket_activo, final_state)
+        yield _sse_event("done", {"ticket_id": ticket_activo.id, "final_response": final_state.get("final_response", "")})
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Evita que un proxy (nginx) acumule la respuesta antes de reenviarla.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 def new_chat_view(request):
     """
@@ -126,3 +126,164 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
+
+# ==============================================================================
+# Base de Conocimiento (ChromaDB y embeddings)
+# ==============================================================================
+CHROMA_PERSIST_DIRECTORY = BASE_DIR / 'chroma_db'
+GEMINI_EMBEDDING_MODEL = 'models/embedding-001'
+
+# Caché de embeddings de consultas: LRU en memoria + nivel opcional en disco.
+EMBEDDING_CACHE_MAX_ENTRIES = 1024
+EMBEDDING_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+EMBEDDING_CACHE_DISK_PATH = BASE_DIR / 'cache' / 'query_embeddings.sqlite3'
+# Tope de filas en disco (se podan las vencidas y las más viejas) y espera máxima
+# si otro proceso tiene la base bloqueada; pasado ese tiempo se calcula el embedding.
+EMBEDDING_CACHE_DISK_MAX_ENTRIES = 50000
+EMBEDDING_CACHE_DISK_TIMEOUT_SECONDS = 1.0
+
+# Ingesta de documentos: lotes de embeddings concurrentes con límite de tasa.
+INGESTION_BATCH_SIZE = 64
+INGESTION_MAX_CONCURRENCY = 4
+INGESTION_REQUESTS_PER_MINUTE = 60
+INGESTION_MAX_RETRIES = 4
+INGESTION_RETRY_BASE_SECONDS = 2.0
+INGESTION_CHUNK_SIZE = 1000
+INGESTION_CHUNK_OVERLAP = 200
+# Fragmentos acumulados antes de embeber y guardar una tanda durante la ingesta en streaming.
+INGESTION_STREAM_FLUSH_SIZE = INGESTION_BATCH_SIZE * INGESTION_MAX_CONCURRENCY
+
+# Recuperación híbrida: 'hybrid' fusiona ChromaDB con el índice léxico BM25 (chroma_db/lexical_index.json);
+# 'vector' usa solo ChromaDB.
+RETRIEVAL_MODE = 'hybrid'
+LEXICAL_MIN_SCORE = 2.0
+
+# Carga masiva: procesos para parsear PDFs en paralelo (None = núcleos disponibles - 1).
+INGESTION_PARSE_WORKERS = None
+
+# Backend de embeddings: 'gemini' (API remota), 'local' (hashing en CPU, sin red)
+# u 'onnx' (all-MiniLM-L6-v2 en CPU). Cada backend usa su propia colección de
+# ChromaDB; al cambiarlo hay que reprocesar: 'sync_knowledge_base --all --reembed --now'.
+EMBEDDING_BACKEND = 'gemini'
+LOCAL_EMBEDDING_DIMENSIONS = 512
+
+# Búsqueda por tema: si un filtro devuelve menos de TOPIC_MIN_HITS fragmentos
+# relevantes, se amplía al tema padre y luego a toda la base (sin filtro, por
+# HNSW en ChromaDB). Con TOPIC_PARTITION_INDEX, los alcances filtrados se
+# buscan en una copia en memoria particionada por tema/subtema: cada proceso
+# carga todos los vectores, así que conviene solo con bases chicas. Durante una
+# ingesta la copia se actualiza (solo lo nuevo) como mucho cada
+# TOPIC_INDEX_REFRESH_SECONDS.
+TOPIC_PARTITION_INDEX = False
+TOPIC_INDEX_REFRESH_SECONDS = 30.0
+TOPIC_MIN_HITS = 1
+
+# Reranking local antes de la generación: se recuperan RERANK_FETCH_K candidatos,
+# se reordenan en CPU y un MMR descarta pasajes casi idénticos.
+RERANK_ENABLED = True
+RERANK_FETCH_K = 20
+RERANK_PRIOR_WEIGHT = 0.5
+RERANK_MMR_DIVERSITY = 0.3
+RERANK_DUPLICATE_THRESHOLD = 0.8
+
+# Presupuesto de tokens del prompt (estimación local): pregunta, pasajes, turnos
+# recientes y, con lo que sobre, un resumen de los turnos anteriores.
+CONTEXT_TOKEN_BUDGET = 6000
+CONTEXT_RECENT_TURNS = 8
+CONTEXT_MIN_PASSAGE_TOKENS = 40
+CONTEXT_SUMMARY_TOKENS_PER_TURN = 40
+
+# Caché semántica de respuestas: una pregunta reformulada del mismo tema con
+# similitud coseno >= ANSWER_CACHE_SIMILARITY se responde sin llamar al LLM,
+# siempre que los documentos que respaldaron la respuesta no hayan cambiado.
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_SIMILARITY = 0.95
+ANSWER_CACHE_MAX_CANDIDATES = 500
+# Antigüedad máxima de una respuesta guardada (None: no vencen). Las vencidas se
+# ignoran y se borran al recargar los candidatos del tema.
+ANSWER_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+
+# Modelo de chat de Gemini. Los clientes se comparten por proceso (uno por
+# modelo/temperatura/opciones), reutilizando sus conexiones entre turnos.
+# GEMINI_TRANSPORT puede ser 'grpc' (por defecto de la librería) o 'rest'.
+GEMINI_CHAT_MODEL = 'gemini-1.5-flash'
+GEMINI_TRANSPORT = None
+
+# Memoria de la conversación: un resumen incremental en Ticket.descripcion_confirmada_ia
+# (lo actualiza una tarea de Celery al terminar cada turno, hasta
+# CONVERSATION_SUMMARY_BATCH mensajes por pasada) más los últimos
+# CONVERSATION_RECENT_TURNS mensajes textuales. Si el resumen se atrasa, los
+# prompts leen como mucho CONVERSATION_MAX_RAW_TURNS mensajes.
+CONVERSATION_RECENT_TURNS = 6
+CONVERSATION_MAX_RAW_TURNS = 16
+CONVERSATION_SUMMARY_TOKENS = 300
+CONVERSATION_SUMMARY_BATCH = 40
+
+# Clasificación del tema y reformulación de la pregunta en una sola llamada al
+# LLM (respuesta JSON con 'tema', 'confianza' y 'pregunta'). En False se usan
+# los nodos separados determine_topic y rewrite_query.
+GRAPH_COMBINED_CLASSIFY_REWRITE = True
+
+# Estado del grafo por ticket guardado en la BD (hilo 'ticket-<id>'), compartido
+# por la web y Telegram. Con durabilidad 'exit' se guarda un checkpoint por
+# turno ('async' o 'sync' guardan uno por paso); se conservan los últimos
+# GRAPH_CHECKPOINTS_PER_THREAD de cada ticket.
+GRAPH_CHECKPOINT_DURABILITY = 'exit'
+GRAPH_CHECKPOINTS_PER_THREAD = 3
+
+# Clasificador de temas local (centroide más cercano sobre embeddings en CPU).
+# Si su margen frente al mejor tema de otra familia es >= TOPIC_CLASSIFIER_MIN_MARGIN
+# se usa sin llamar al LLM. Se entrena con 'python manage.py train_topic_classifier';
+# el modelo se guarda junto al índice salvo que se indique TOPIC_CLASSIFIER_PATH.
+TOPIC_CLASSIFIER_ENABLED = True
+TOPIC_CLASSIFIER_MIN_MARGIN = 0.1
+TOPIC_CLASSIFIER_MIN_SIMILARITY = 0.35
+TOPIC_CLASSIFIER_PATH = None
+
+# Streaming de respuestas: en Telegram se envía un mensaje con el primer texto
+# y se edita como mucho cada TELEGRAM_STREAM_EDIT_INTERVAL segundos.
+TELEGRAM_STREAM_RESPONSES = True
+TELEGRAM_STREAM_EDIT_INTERVAL = 1.0
+
+# Turnos de Telegram atendidos a la vez por el poller (los de un mismo chat
+# siempre se procesan en orden).
+TELEGRAM_MAX_CONCURRENT_TURNS = 8
+
+# Precios por millón de tokens (USD) para estimar el gasto diario del tablero.
+LLM_PRICING_USD_PER_MILLION = {
+    'gemini-1.5-flash': {'input': 0.075, 'output': 0.30},
+}
+
+# Segundos durante los que el tablero reutiliza las latencias y el gasto ya
+# calculados (los percentiles por nodo recorren hasta 5000 turnos).
+GRAPH_METRICS_CACHE_SECONDS = 60
+
+# Gateway del LLM (apps/ai_core/llm_gateway.py): llamadas simultáneas por
+# proceso (globales y por modelo), reintentos con backoff y jitter para errores
+# transitorios, plazo total por llamada y circuit breaker. Con el circuito
+# abierto el grafo responde desde la caché o con los pasajes encontrados
+# (hasta LLM_DEGRADED_ANSWER_TOKENS) en lugar de escalar.
+LLM_MAX_CONCURRENCY = 16
+LLM_MODEL_CONCURRENCY = {
+    'gemini-1.5-flash': 8,
+}
+LLM_MAX_RETRIES = 2
+LLM_RETRY_BASE_SECONDS = 0.5
+LLM_RETRY_MAX_SECONDS = 8.0
+LLM_CALL_DEADLINE_SECONDS = 30.0
+LLM_REQUEST_TIMEOUT_SECONDS = 20.0
+LLM_BREAKER_FAILURE_THRESHOLD = 5
+LLM_BREAKER_COOLDOWN_SECONDS = 30.0
+LLM_DEGRADED_ANSWER_TOKENS = 250
+
+# Proveedor del modelo de chat (apps/ai_core/llm_replay.py): 'gemini' (API real),
+# 'record' (llama a Gemini y graba cada prompt → respuesta en LLM_FIXTURES_PATH),
+# 'replay' (responde desde LLM_FIXTURES_PATH sin red; lo no grabado, como 'stub')
+# o 'stub' (respuestas sintéticas locales). En 'replay' y 'stub' cada llamada
+# espera LLM_STUB_LATENCY_MS ± LLM_STUB_LATENCY_JITTER_MS (None = la latencia
+# grabada). Lo usa 'python manage.py benchmark_graph'.
+LLM_PROVIDER = 'gemini'
+LLM_FIXTURES_PATH = BASE_DIR / 'llm_fixtures.jsonl'
+LLM_STUB_LATENCY_MS = 0.0
+LLM_STUB_LATENCY_JITTER_MS = 0.0
+LLM_STUB_RESPONSE_TOKENS = 120
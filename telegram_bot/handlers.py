@@ -2,19 +2,26 @@
 
 from telegram import Update
 from telegram.ext import ContextTypes
+from django.conf import settings
 from django.contrib.auth.models import User
 from asgiref.sync import sync_to_async
 
 from apps.tickets.models import Ticket, LogInteraccion
 # Importamos la app de LangGraph, ¡el cerebro del sistema!
-from apps.ai_core.graph import app as langgraph_app
+from apps.ai_core.graph import app as langgraph_app, turn_kwargs
+from apps.ai_core.streaming import astream_graph_response
+from apps.ai_core.instrumentation import atrack_turn
+from apps.ai_core.conversation_summary import schedule_summary_update
+from telegram_bot.sender import TelegramStreamingMessage, send_telegram_message_sync
 
 # Esta es la única función que necesitamos. Es el punto de entrada para todos los mensajes.
-@sync_to_async
-def handle_message(update: Update):
+async def handle_message(update: Update):
     """
     Procesa mensajes de Telegram. Mantiene el hilo de la conversación buscando
     tickets activos para el usuario antes de crear uno nuevo.
+
+    Es asíncrona de punta a punta (ORM async y nodos async del grafo): mientras
+    espera al LLM no ocupa ningún hilo, así el poller atiende varios turnos a la vez.
     """
     message = update.message
     if not message or not message.text or message.text.startswith('/'):
@@ -33,18 +40,18 @@ def handle_message(update: Update):
     # --- LÓGICA DE GESTIÓN DE CONVERSACIÓN ---
 
     # 1. Buscamos o creamos el usuario de Django.
-    user, _ = User.objects.get_or_create(username=telegram_username)
+    user, _ = await User.objects.aget_or_create(username=telegram_username)
 
     # 2. Buscamos un ticket ACTIVO para este usuario.
-    active_ticket = Ticket.objects.filter(
+    active_ticket = await Ticket.objects.filter(
         usuario=user,
         estado__in=[Ticket.Estado.NUEVO, Ticket.Estado.EN_PROCESO, Ticket.Estado.ESCALADO]
-    ).order_by('-fecha_creacion').first()
+    ).order_by('-fecha_creacion').afirst()
 
     # 3. Si no hay ticket activo, CREAMOS uno nuevo.
     if not active_ticket:
         print(f"HANDLER: No se encontró ticket activo para {telegram_username}. Creando uno nuevo.")
-        active_ticket = Ticket.objects.create(
+        active_ticket = await Ticket.objects.acreate(
             usuario=user,
             descripcion_inicial=user_text,
             canal_origen=Ticket.Canal.TELEGRAM,
@@ -54,28 +61,46 @@ def handle_message(update: Update):
         print(f"HANDLER: Continuando conversación en ticket #{active_ticket.id} para {telegram_username}.")
 
     # 4. Guardamos el mensaje del usuario en el log del ticket correcto.
-    LogInteraccion.objects.create(
+    await LogInteraccion.objects.acreate(
         ticket=active_ticket,
         mensaje=user_text,
         emisor=LogInteraccion.Emisor.USUARIO
     )
 
-    # 5. Invocamos el grafo de LangGraph (igual que en la web).
+    # 5. Invocamos el grafo de LangGraph (igual que en la web). El resto del
+    # estado (tema fijado, intentos de aclaración...) se retoma del checkpoint del ticket.
     initial_state = {
         "ticket_id": active_ticket.id,
         "user_input": user_text,
     }
-    final_state = langgraph_app.invoke(initial_state)
-    bot_response = final_state.get('final_response', 'Lo siento, no pude procesar tu solicitud.')
+    if getattr(settings, 'TELEGRAM_STREAM_RESPONSES', True):
+        # La respuesta se muestra mientras se genera, editando un único mensaje.
+        streaming_message = TelegramStreamingMessage(message.chat_id)
+        final_state = {}
+        async with atrack_turn(active_ticket.id, Ticket.Canal.TELEGRAM):
+            async for event, data in astream_graph_response(initial_state):
+                if event == "token":
+                    await streaming_message.add(data)
+                else:
+                    final_state = data
+        bot_response = final_state.get('final_response', 'Lo siento, no pude procesar tu solicitud.')
+        if not await streaming_message.finish(bot_response):
+            await sync_to_async(send_telegram_message_sync, thread_sensitive=False)(message.chat_id, bot_response)
+    else:
+        async with atrack_turn(active_ticket.id, Ticket.Canal.TELEGRAM):
+            final_state = await langgraph_app.ainvoke(initial_state, **turn_kwargs(active_ticket.id))
+        bot_response = final_state.get('final_response', 'Lo siento, no pude procesar tu solicitud.')
+        await sync_to_async(send_telegram_message_sync, thread_sensitive=False)(message.chat_id, bot_response)
 
     # 6. Guardamos la respuesta del bot en el log.
-    LogInteraccion.objects.create(
+    await LogInteraccion.objects.acreate(
         ticket=active_ticket,
         mensaje=bot_response,
         emisor=LogInteraccion.Emisor.SISTEMA
     )
-    
-    # 7. Enviamos la respuesta de vuelta al usuario en Telegram.
+    await sync_to_async(schedule_summary_update, thread_sensitive=False)(active_ticket.id)
+
+    # 7. La respuesta ya se envió en el paso 5 (con streaming, editando el mismo mensaje).
     # Esta parte requiere que tu bot tenga permisos para enviar mensajes.
     # await update.message.reply_text(bot_response)
     print(f"HANDLER: Respuesta para {telegram_username}: {bot_response}")
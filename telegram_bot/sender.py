@@ -49,3 +49,79 @@ def send_telegram_message_sync(chat_id: str, message: str) -> bool:
     except Exception as e:
         print(f"SENDER: Excepción al intentar conectar con la API de Telegram: {e}")
         return False
+
+
+def _call_telegram_api(method: str, payload: dict):
+    """
+    Llama a un método de la API de Telegram y devuelve el campo 'result' de la
+    respuesta, o None si falló.
+    """
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        print("ERROR CRÍTICO: La variable de entorno TELEGRAM_BOT_TOKEN no fue encontrada.")
+        return None
+
+    url = f"https://api.telegram.org/bot{token}/{method}"
+    try:
+        response = requests.post(url, data=payload, timeout=10)
+        data = response.json()
+    except Exception as e:
+        print(f"SENDER: Excepción al llamar a '{method}' en la API de Telegram: {e}")
+        return None
+
+    if response.status_code == 200 and data.get('ok'):
+        return data.get('result')
+    # Editar con el mismo texto no es un error para nosotros.
+    if 'message is not modified' in data.get('description', ''):
+        return True
+    print(f"SENDER: Error en '{method}': {response.status_code} - {data.get('description')}")
+    return None
+
+
+def send_telegram_message_returning_id_sync(chat_id: str, message: str):
+    """
+    Envía un mensaje (sin formato, porque un texto parcial puede dejar el
+    Markdown incompleto) y devuelve su 'message_id' para poder editarlo, o None.
+    """
+    result = _call_telegram_api('sendMessage', {'chat_id': chat_id, 'text': message})
+    return result.get('message_id') if isinstance(result, dict) else None
+
+
+def edit_telegram_message_sync(chat_id: str, message_id: int, message: str) -> bool:
+    """Reemplaza el texto de un mensaje ya enviado. Devuelve True si se editó."""
+    result = _call_telegram_api('editMessageText', {'chat_id': chat_id, 'message_id': message_id, 'text': message})
+    return result is not None
+
+
+class TelegramStreamingMessage:
+    """
+    Muestra una respuesta en streaming en un único mensaje de Telegram: se
+    envía con el primer texto y luego se edita en tandas (Telegram limita la
+    frecuencia de ediciones, de ahí el intervalo de TELEGRAM_STREAM_EDIT_INTERVAL).
+
+    Se usa desde el event loop del poller: las peticiones HTTP corren en hilos
+    aparte para no bloquear los demás turnos.
+    """
+
+    def __init__(self, chat_id: str, interval: float = None):
+        from apps.ai_core.streaming import AsyncThrottledMessageEditor
+        self.chat_id = chat_id
+        self.message_id = None
+        self.editor = AsyncThrottledMessageEditor(
+            self._publish, interval=interval or getattr(settings, 'TELEGRAM_STREAM_EDIT_INTERVAL', 1.0)
+        )
+
+    async def _publish(self, text: str):
+        from asgiref.sync import sync_to_async
+        if self.message_id is None:
+            self.message_id = await sync_to_async(send_telegram_message_returning_id_sync, thread_sensitive=False)(self.chat_id, text)
+        else:
+            await sync_to_async(edit_telegram_message_sync, thread_sensitive=False)(self.chat_id, self.message_id, text)
+
+    async def add(self, token: str):
+        await self.editor.add(token)
+
+    async def finish(self, final_text: str) -> bool:
+        """Deja el mensaje con el texto definitivo. Devuelve False si nunca se pudo enviar."""
+        await self.editor.finish(final_text)
+        return self.message_id is not None